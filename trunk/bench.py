@@ -0,0 +1,1118 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for lovi.
+
+Usage: bench.py [benchmark...]
+
+Run without arguments to see the list of benchmarks.
+"""
+
+"""
+Copyright (c) 2005-2006 by Akos Polster
+
+See main.py for the terms and conditions.
+"""
+
+import os
+import random
+import re
+import resource
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from lovicore import Bookmark, Classifier, detectParser, Exporter, \
+    LineFilter, LineIndex, LineStore, Merger, POLL_INTERVAL, PollScheduler, \
+    PROFILER, renderLines, renderTerminal, Searcher, Tail, Watcher
+
+
+class CountingFile:
+
+    """File wrapper counting the reads and the bytes read through it."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.reads = 0
+        self.bytesRead = 0
+
+    def read(self, *args):
+        data = self.fd.read(*args)
+        self.reads = self.reads + 1
+        self.bytesRead = self.bytesRead + len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fd, name)
+
+
+def makeLog(lineLength, size):
+    """Create a temporary log file of about size bytes.
+
+    lineLength is a function returning the length of the next line."""
+    fd, fileName = tempfile.mkstemp(".log", "lovibench")
+    f = os.fdopen(fd, "wb")
+    written = 0
+    lineNo = 0
+    while written < size:
+        line = "%08d " % lineNo
+        line = line + "x" * max(0, lineLength() - len(line))
+        f.write(line + "\n")
+        written = written + len(line) + 1
+        lineNo = lineNo + 1
+    f.close()
+    return fileName
+
+
+def rss():
+    """Return the resident set size of the process in MB."""
+    try:
+        f = open("/proc/self/statm")
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+        return pages * resource.getpagesize() / 1048576.0
+    except (IOError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def severity(rnd):
+    """Return a random severity word: mostly empty, sometimes a warning or 
+    an error keyword."""
+    x = rnd.random()
+    if x < 0.02:
+        return rnd.choice(["error", "failed", "FAILURE"])
+    elif x < 0.07:
+        return rnd.choice(["warning", "cannot", "unable to"])
+    return rnd.choice(["", "ok", "done", "accepted"])
+
+
+def syslogLine(rnd, i):
+    """A syslog line."""
+    return "Oct %2d %02d:%02d:%02d host%d %s[%d]: %s request %d from " \
+        "10.0.%d.%d %s" % (1 + i // 86400 % 28, i // 3600 % 24, 
+        i // 60 % 60, i % 60, rnd.randint(1, 9), 
+        rnd.choice(["sshd", "cron", "kernel", "postfix/smtpd", "named"]), 
+        rnd.randint(100, 32000), rnd.choice(["handled", "queued", "sent"]),
+        i, rnd.randint(0, 255), rnd.randint(0, 255), severity(rnd))
+
+
+def apacheLine(rnd, i):
+    """An Apache access log line."""
+    return '10.%d.%d.%d - - [17/Oct/2006:%02d:%02d:%02d +0200] "GET /%s/%d ' \
+        'HTTP/1.1" %d %d "-" "Mozilla/5.0 (X11; Linux) %s"' % (
+        rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255),
+        i // 3600 % 24, i // 60 % 60, i % 60,
+        rnd.choice(["index.html", "images", "api/v1/items", "search"]), i,
+        rnd.choice([200, 200, 200, 304, 404, 500]), rnd.randint(0, 65536),
+        severity(rnd))
+
+
+def jsonLine(rnd, i):
+    """A structured JSON log line."""
+    return '{"ts": "2006-10-17T%02d:%02d:%02d.%03dZ", "level": "%s", ' \
+        '"service": "%s", "request": %d, "duration_ms": %d, "msg": "%s %s", ' \
+        '"tags": ["%s"]}' % (i // 3600 % 24, i // 60 % 60, i % 60, 
+        rnd.randint(0, 999), rnd.choice(["info", "info", "debug"]), 
+        rnd.choice(["auth", "billing", "frontend", "search"]), i, 
+        rnd.randint(0, 5000), rnd.choice(["lookup", "update", "fetch"]), 
+        severity(rnd), "x" * rnd.randint(0, 400))
+
+
+def logfmtLine(rnd, i):
+    """A logfmt line."""
+    return 'ts=2006-10-17T%02d:%02d:%02dZ level=%s host=db%d status=%d ' \
+        'duration=%d msg="%s %s"' % (i // 3600 % 24, i // 60 % 60, i % 60, 
+        rnd.choice(["info", "info", "warn", "error"]), rnd.randint(1, 9), 
+        rnd.choice([200, 200, 200, 304, 404, 500]), rnd.randint(0, 5000), 
+        rnd.choice(["lookup", "update", "fetch"]), severity(rnd))
+
+
+GENERATORS = [
+    ("syslog", syslogLine),
+    ("apache", apacheLine),
+    ("json", jsonLine),
+]
+
+
+def generateLines(generator, count, seed = 0):
+    """Return count lines made by generator."""
+    rnd = random.Random(seed)
+    return [generator(rnd, i) for i in range(count)]
+
+
+def generateLog(generator, size, seed = 0):
+    """Create a temporary log file of about size bytes made by generator. 
+    Return its name and the number of lines."""
+    rnd = random.Random(seed)
+    fd, fileName = tempfile.mkstemp(".log", "lovibench")
+    f = os.fdopen(fd, "wb")
+    written = 0
+    lineNo = 0
+    while written < size:
+        lines = [generator(rnd, lineNo + i) for i in range(1000)]
+        data = "\n".join(lines) + "\n"
+        f.write(data)
+        written = written + len(data)
+        lineNo = lineNo + len(lines)
+    f.close()
+    return fileName, lineNo
+
+
+def heuristicStart(fd):
+    """The line-length guessing Tail.start() of lovi 0.3, for comparison."""
+    avgCharsPerLine = 75
+    while 1:
+        try:
+            fd.seek(-1 * int(avgCharsPerLine * Tail.LINES_BACK), 2)
+        except IOError:
+            fd.seek(0)
+        if fd.tell() == 0:
+            atStart = 1
+        else:
+            atStart = 0
+        lines = fd.read().split("\n")
+        if (len(lines) > (Tail.LINES_BACK + 1)) or atStart:
+            break
+        avgCharsPerLine = avgCharsPerLine * 1.3
+    if len(lines) > Tail.LINES_BACK:
+        start = len(lines) - Tail.LINES_BACK - 1
+    else:
+        start = 0
+    return lines[start:len(lines) - 1]
+
+
+def benchStart():
+    """Tail.start(): block-based backward seek versus line length guessing."""
+    distributions = [
+        ("short (40)", lambda: 40),
+        ("typical (120)", lambda: 120),
+        ("json (2000)", lambda: 2000),
+        ("mixed (lognormal)", lambda: int(random.lognormvariate(5, 1.2))),
+    ]
+    print("%-20s %12s %12s %12s %12s" %
+        ("lines", "old ms", "old bytes", "new ms", "new bytes"))
+    for name, lineLength in distributions:
+        random.seed(0)
+        fileName = makeLog(lineLength, 32 * 1024 * 1024)
+        try:
+            tail = Tail(fileName)
+            fd = CountingFile(tail.fd)
+            begin = time.time()
+            old = heuristicStart(fd)
+            oldTime = time.time() - begin
+            tail.fd = CountingFile(tail.fd)
+            begin = time.time()
+            new = tail.start()
+            newTime = time.time() - begin
+            if old != new:
+                print("%s: results differ" % name)
+            print("%-20s %12.2f %12d %12.2f %12d" % (name, oldTime * 1000,
+                fd.bytesRead, newTime * 1000, tail.fd.bytesRead))
+        finally:
+            os.unlink(fileName)
+
+
+class LegacyTail(Tail):
+
+    """Tail with the readline() based follow() of lovi 0.3, for comparison."""
+
+    LINES_AT_ONCE = 700
+
+    def __init__(self, fileName, rotated = False, encoding = None):
+        Tail.__init__(self, fileName, rotated, encoding)
+        # Buffered like lovi 0.3; readline() reads bytewise without buffer
+        self.fd.close()
+        self.fd = open(fileName, "rb")
+
+    def follow(self):
+        ret = []
+        if not self.started:
+            ret = self.start()
+            self.started = True
+        for cnt in range(0, LegacyTail.LINES_AT_ONCE):
+            where = self.fd.tell()
+            line = self.fd.readline()
+            if not line:
+                self.fd.seek(where)
+                break
+            ret.append(line.strip("\r\n"))
+        return ret
+
+
+WRITER = """
+import sys, time
+f = open(sys.argv[1], "ab")
+end = time.time() + float(sys.argv[2])
+burst = ("x" * 100 + "\\n") * 1000
+while time.time() < end:
+    f.write(burst)
+    f.flush()
+    time.sleep(0.01)
+"""
+
+
+def benchFollow():
+    """Tail.follow(): lines/s sustained against a writer process."""
+    duration = 5.0
+    tick = POLL_INTERVAL
+    print("%-12s %14s %14s %14s" % 
+        ("", "written/s", "followed/s", "behind (MB)"))
+    for name, tailClass in (("readline", LegacyTail), ("chunked", Tail)):
+        fileName = makeLog(lambda: 100, 1024)
+        try:
+            tail = tailClass(fileName)
+            tail.follow()
+            writer = subprocess.Popen([sys.executable, "-c", WRITER, 
+                fileName, str(duration)])
+            followed = 0
+            begin = time.time()
+            while writer.poll() is None:
+                followed = followed + len(tail.follow())
+                time.sleep(tick)
+            elapsed = time.time() - begin
+            written = os.path.getsize(fileName) / 101
+            behind = os.path.getsize(fileName) - tail.fd.tell()
+            print("%-12s %14d %14d %14.1f" % (name, written / elapsed, 
+                followed / elapsed, behind / 1048576.0))
+        finally:
+            os.unlink(fileName)
+
+
+def benchRender():
+    """Monitor rendering: per-line append() versus one batched append()."""
+    from qt import QApplication, QTextEdit
+    app = QApplication(sys.argv)
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    random.seed(0)
+    words = ["request", "served", "warning:", "error", "<tag>", "ok", "user"]
+    print("%-8s %14s %14s %14s" % 
+        ("lines", "render ms", "per-line ms", "batched ms"))
+    for count in (1000, 10000):
+        lines = []
+        for i in range(count):
+            lines.append(" ".join([random.choice(words) for w in range(12)]))
+        begin = time.time()
+        html = renderLines(lines, classifier)
+        renderTime = time.time() - begin
+        times = []
+        for batched in (False, True):
+            edit = QTextEdit()
+            edit.setTextFormat(QTextEdit.LogText)
+            edit.setMaxLogLines(1000)
+            edit.show()
+            app.processEvents()
+            begin = time.time()
+            if batched:
+                edit.setUpdatesEnabled(False)
+                edit.append("\n".join(html[-1000:]))
+                edit.setUpdatesEnabled(True)
+                edit.viewport().update()
+            else:
+                for line in html:
+                    edit.append(line)
+            app.processEvents()
+            times.append(time.time() - begin)
+            edit.close()
+        print("%-8d %14.1f %14.1f %14.1f" % (count, renderTime * 1000,
+            times[0] * 1000, times[1] * 1000))
+
+
+def writeLines(fileNames, interval, stop):
+    """Append a time-stamped line to each file every interval seconds."""
+    files = [open(fileName, "ab") for fileName in fileNames]
+    while not stop.isSet():
+        for f in files:
+            f.write("%.6f\n" % time.time())
+            f.flush()
+        time.sleep(interval)
+    for f in files:
+        f.close()
+
+
+def rotatingWriter(fileName, mode, duration, period, result):
+    """Write numbered lines to fileName for duration seconds, and rotate it 
+    every period seconds: by renaming it and creating it again (create), 
+    or by copying it and truncating it in place, with a writer appending 
+    (copytruncate) or writing at its own offset (sparse). With small, the 
+    writer appends a short line at a time, so the file stays within a stdio 
+    buffer. The writer waits during rotation. Rotated files are numbered 
+    downwards, so the newest is always the lowest, without renaming the 
+    others under the reader. The number of lines written and of rotations 
+    is left in result."""
+    flags = os.O_WRONLY | os.O_CREAT
+    if mode != "sparse":
+        flags = flags | os.O_APPEND
+    fd = os.open(fileName, flags, 420)
+    rnd = random.Random(0)
+    batch = 50
+    length = 200
+    if mode == "small":
+        batch = 1
+        length = 10
+    count = 0
+    rotations = 0
+    end = time.time() + duration
+    rotation = time.time() + period
+    while time.time() < end:
+        for i in range(batch):
+            os.write(fd, "%08d %s\n" % (count, "x" * rnd.randint(0, length)))
+            count = count + 1
+        if time.time() >= rotation:
+            rotated = "%s.%d" % (fileName, 100000 - rotations)
+            if mode == "create":
+                os.rename(fileName, rotated)
+                os.close(fd)
+                fd = os.open(fileName, flags, 420)
+            else:
+                src = open(fileName, "rb")
+                dst = open(rotated, "wb")
+                dst.write(src.read())
+                dst.close()
+                src.close()
+                os.ftruncate(fd, 0)
+            rotations = rotations + 1
+            rotation = rotation + period
+        time.sleep(0.001)
+    os.close(fd)
+    result["written"] = count
+    result["rotations"] = rotations
+
+
+def measureWatch(tails, useWatcher, duration):
+    """Follow tails for duration seconds, with inotify or with polling.
+    Return the number of wakeups, the number of follow() calls and the list 
+    of latencies."""
+    stats = {"follows": 0, "latencies": []}
+    
+    def follow(tail):
+        stats["follows"] = stats["follows"] + 1
+        now = time.time()
+        for line in tail.follow():
+            stats["latencies"].append(now - float(line))
+        
+    wakeups = 0
+    end = time.time() + duration
+    if useWatcher:
+        watcher = Watcher()
+        for tail in tails:
+            watcher.add(tail.getFileName(), lambda tail = tail: follow(tail))
+        while time.time() < end:
+            ready = select.select([watcher], [], [], end - time.time())[0]
+            if ready:
+                wakeups = wakeups + 1
+                watcher.process()
+        watcher.close()
+    else:
+        while time.time() < end:
+            time.sleep(POLL_INTERVAL)
+            wakeups = wakeups + 1
+            for tail in tails:
+                follow(tail)
+    return wakeups, stats["follows"], stats["latencies"]
+
+
+def benchWatch():
+    """Change notification: wakeups and latency, inotify versus polling."""
+    duration = 10.0
+    fileNames = [makeLog(lambda: 80, 1024) for i in range(40)]
+    try:
+        print("%-24s %12s %12s %10s %10s" % 
+            ("", "wakeups/min", "follows/min", "avg ms", "max ms"))
+        for busy in (0, 1):
+            for useWatcher in (False, True):
+                tails = [Tail(fileName) for fileName in fileNames]
+                for tail in tails:
+                    tail.follow()
+                stop = threading.Event()
+                writer = threading.Thread(target = writeLines, 
+                    args = (fileNames[:busy], 0.05, stop))
+                writer.start()
+                try:
+                    wakeups, follows, latencies = \
+                        measureWatch(tails, useWatcher, duration)
+                finally:
+                    stop.set()
+                    writer.join()
+                if latencies:
+                    avg = sum(latencies) / len(latencies) * 1000
+                    worst = max(latencies) * 1000
+                else:
+                    avg = worst = 0
+                name = "%s, %s" % (("idle", "busy")[busy], 
+                    ("polling", "inotify")[useWatcher])
+                print("%-24s %12d %12d %10.1f %10.1f" % (name, 
+                    wakeups * 60 / duration, follows * 60 / duration, 
+                    avg, worst))
+    finally:
+        for fileName in fileNames:
+            os.unlink(fileName)
+
+
+class SyscallCounter:
+
+    """Count the stat and fstat calls made while installed."""
+
+    def __init__(self):
+        self.calls = 0
+        self.stat = os.stat
+        self.fstat = os.fstat
+        
+    def counted(self, function):
+        def call(*args):
+            self.calls = self.calls + 1
+            return function(*args)
+        return call
+        
+    def install(self):
+        os.stat = self.counted(self.stat)
+        os.fstat = self.counted(self.fstat)
+        
+    def uninstall(self):
+        os.stat = self.stat
+        os.fstat = self.fstat
+        
+
+def benchPoll():
+    """Polling 100 files: 5 hot, 15 warm, 80 idle, fixed versus adaptive."""
+    duration = 600.0
+    step = 0.05
+    hot, warm = 5, 15
+    fileNames = [makeLog(lambda: 80, 1024) for i in range(100)]
+    try:
+        print("%-20s %10s %10s %12s %10s %10s %10s" % ("", "polls", 
+            "syscalls", "syscalls/s", "deferred", "hot ms", "warm ms"))
+        for name, maxRate in (("fixed", None), ("adaptive", 1000), 
+            ("adaptive, 20/s cap", 20)):
+            files = [open(fileName, "ab") for fileName in fileNames]
+            tails = [Tail(fileName) for fileName in fileNames]
+            for tail in tails:
+                tail.follow()
+            for tail in tails:
+                tail.fd = CountingFile(tail.fd)
+            latencies = ([], [])
+            counter = SyscallCounter()
+            clock = [0.0]
+            
+            def follow(i):
+                for line in tails[i].follow():
+                    latencies[i >= hot].append(clock[0] - float(line))
+                    
+            scheduler = PollScheduler(maxRate or 1, 0.0)
+            if maxRate is not None:
+                for i in range(len(tails)):
+                    scheduler.add(i, lambda i = i: follow(i), 
+                        lambda i = i: tails[i].fd.tell(), 1, 0.0)
+                # The visible tab is a warm file
+                scheduler.setVisible(hot, 0.0)
+            counter.install()
+            try:
+                polls = 0
+                nextPoll = 0.0
+                while clock[0] < duration:
+                    clock[0] = clock[0] + step
+                    now = clock[0]
+                    # Hot files get a line every 0.2 s, warm files one every 
+                    # 30 s
+                    tick = int(round(now / step))
+                    for i in range(hot + warm):
+                        if (i < hot and tick % 4 == 0) or \
+                            (i >= hot and tick % 600 == i * 37 % 600):
+                            files[i].write("%.6f\n" % now)
+                            files[i].flush()
+                    if maxRate is None:
+                        if now >= nextPoll:
+                            nextPoll = nextPoll + POLL_INTERVAL
+                            for i in range(len(tails)):
+                                follow(i)
+                            polls = polls + len(tails)
+                    else:
+                        scheduler.run(now)
+                if maxRate is not None:
+                    polls = scheduler.polls
+            finally:
+                counter.uninstall()
+            for f in files:
+                f.close()
+            calls = counter.calls + sum([tail.fd.reads for tail in tails])
+            print("%-20s %10d %10d %12.1f %10d %10.0f %10.0f" % (name, polls, 
+                calls, calls / duration, 
+                scheduler.deferrals, 
+                sum(latencies[0]) / max(1, len(latencies[0])) * 1000, 
+                sum(latencies[1]) / max(1, len(latencies[1])) * 1000))
+    finally:
+        for fileName in fileNames:
+            os.unlink(fileName)
+
+
+def benchProfile():
+    """Profiler: cost of the instrumentation per tick, disabled and 
+    enabled, versus none."""
+    ticks = 20000
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    print("%-10s %12s %12s" % ("profiler", "us/tick", "ticks/s"))
+    for mode in ("none", "disabled", "enabled") * 2:
+        fileName = makeLog(lambda: 80, 1024)
+        try:
+            f = open(fileName, "ab")
+            tail = Tail(fileName)
+            tail.follow()
+            PROFILER.reset()
+            PROFILER.enabled = mode == "enabled"
+            instrumented = mode != "none"
+            begin = time.time()
+            for i in range(ticks):
+                f.write("%08d line of a log\n" % i)
+                f.flush()
+                if not instrumented:
+                    lines = tail.follow()
+                    renderLines(lines, classifier, 
+                        classifier.classifyLines(lines))
+                    continue
+                # The stages of Monitor.fetch(), timed like there
+                timer = PROFILER.enabled and PROFILER.timer()
+                lines = tail.follow()
+                if timer:
+                    timer.lap("follow")
+                    PROFILER.sample("lines per tick", len(lines))
+                severities = classifier.classifyLines(lines)
+                if timer:
+                    timer.lap("classify")
+                renderLines(lines, classifier, severities)
+                if timer:
+                    timer.lap("render")
+            elapsed = time.time() - begin
+            f.close()
+        finally:
+            PROFILER.enabled = False
+            os.unlink(fileName)
+        print("%-10s %12.2f %12d" % (mode, elapsed / ticks * 1000000, 
+            ticks / elapsed))
+
+
+def benchClassify():
+    """Classifying and colouring: lines/s for each log generator."""
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    print("%-8s %14s %14s %14s %10s" % 
+        ("log", "classify/s", "rich text/s", "terminal/s", "RSS (MB)"))
+    for name, generator in GENERATORS:
+        lines = generateLines(generator, 200000)
+        rates = []
+        for work in (lambda: [classifier.classify(l) for l in lines],
+            lambda: renderLines(lines, classifier),
+            lambda: renderTerminal(lines, classifier)):
+            begin = time.time()
+            work()
+            rates.append(len(lines) / (time.time() - begin))
+        print("%-8s %14d %14d %14d %10.1f" % 
+            (name, rates[0], rates[1], rates[2], rss()))
+
+
+def benchSearch():
+    """Searcher: whole file search throughput and match lookup latency."""
+    print("%-8s %10s %12s %14s %10s %10s" % 
+        ("log", "matches", "MB/s", "lines/s", "find us", "RSS (MB)"))
+    for name, generator in GENERATORS:
+        fileName, count = generateLog(generator, 128 * 1024 * 1024)
+        try:
+            searcher = Searcher(fileName, "error|fail", re.IGNORECASE)
+            begin = time.time()
+            matches = searcher.update()
+            elapsed = time.time() - begin
+            size = os.path.getsize(fileName)
+            rnd = random.Random(0)
+            offsets = [rnd.randint(0, size) for i in range(10000)]
+            begin = time.time()
+            for offset in offsets:
+                searcher.find(offset, False)
+            findTime = (time.time() - begin) / len(offsets)
+            print("%-8s %10d %12.1f %14d %10.1f %10.1f" % (name, matches, 
+                size / elapsed / 1048576, count / elapsed, 
+                findTime * 1000000, rss()))
+        finally:
+            os.unlink(fileName)
+
+
+def benchExport():
+    """Exporter: errors of whole files per second, line by line in one 
+    process versus by ranges in one process and in a process pool."""
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    lineFilter = LineFilter("", "", Classifier.ERROR)
+    parallelSize = Exporter.PARALLEL_SIZE
+    print("%-8s %-10s %10s %12s %10s" % 
+        ("log", "mode", "lines", "MB/s", "RSS (MB)"))
+    for name, generator in GENERATORS:
+        fileName, count = generateLog(generator, 128 * 1024 * 1024)
+        outputName = fileName + ".out"
+        try:
+            size = os.path.getsize(fileName)
+            for mode in ("lines", "serial", "parallel"):
+                begin = time.time()
+                if mode == "lines":
+                    fileClassifier = classifier.withParser(
+                        detectParser(generateLines(generator, 100)))
+                    lines = 0
+                    f = open(fileName, "rb")
+                    output = open(outputName, "wb")
+                    for line in f:
+                        if fileClassifier.classify(line) == \
+                            Classifier.ERROR:
+                            output.write(line)
+                            lines = lines + 1
+                    output.close()
+                    f.close()
+                else:
+                    if mode == "serial":
+                        Exporter.PARALLEL_SIZE = size
+                    exporter = Exporter([fileName], outputName, lineFilter, 
+                        classifier)
+                    exporter.run()
+                    Exporter.PARALLEL_SIZE = parallelSize
+                    lines = exporter.lines
+                elapsed = time.time() - begin
+                print("%-8s %-10s %10d %12.1f %10.1f" % (name, mode, lines, 
+                    size / elapsed / 1048576, rss()))
+        finally:
+            Exporter.PARALLEL_SIZE = parallelSize
+            os.unlink(fileName)
+            if os.path.exists(outputName):
+                os.unlink(outputName)
+
+
+def benchBookmark():
+    """Bookmarks: time to show the lines around a bookmark near the end of 
+    a file, locating it and reading around it versus indexing up to it, 
+    in the file and after rotation."""
+    print("%-10s %12s %12s %12s" % ("file", "locate ms", "window ms", 
+        "index ms"))
+    fileName = makeLog(lambda: 100, 256 * 1024 * 1024)
+    try:
+        bookmark = Bookmark.at(fileName, os.path.getsize(fileName) - 1000)
+        for name in ("current", "rotated"):
+            if name == "rotated":
+                os.rename(fileName, fileName + ".1")
+                open(fileName, "wb").close()
+            begin = time.time()
+            path = bookmark.locate()
+            located = time.time()
+            fd = open(path, "rb")
+            size = os.path.getsize(path)
+            anchor = LineIndex.startBefore(fd, bookmark.offset, 25)
+            LineIndex.readFrom(fd, size, anchor, 50)
+            shown = time.time()
+            index = LineIndex()
+            index.update(fd, bookmark.offset + 1)
+            index.readLines(fd, size, index.lineOf(fd, bookmark.offset) - 25, 
+                50)
+            indexed = time.time()
+            fd.close()
+            print("%-10s %12.2f %12.2f %12.1f" % (name, 
+                (located - begin) * 1000, (shown - located) * 1000, 
+                (indexed - shown) * 1000))
+    finally:
+        for path in (fileName, fileName + ".1"):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+TIMED_WRITER = """
+import sys, time
+f = open(sys.argv[1], "ab")
+rate = int(sys.argv[2])
+end = time.time() + float(sys.argv[3])
+text = " " + sys.argv[4]
+while time.time() < end:
+    now = "%.6f" % time.time()
+    f.write((now + text + "\\n") * (rate // 100))
+    f.flush()
+    time.sleep(0.01)
+"""
+
+
+def benchTail():
+    """Tailing: lines/s, latency and memory against writer processes."""
+    duration = 5.0
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    print("%-10s %12s %12s %10s %10s %10s" % ("rate", "written/s", 
+        "followed/s", "avg ms", "p99 ms", "RSS (MB)"))
+    for rate in (1000, 10000, 100000):
+        fileName = makeLog(lambda: 100, 1024)
+        try:
+            initial = os.path.getsize(fileName)
+            tail = Tail(fileName)
+            tail.follow()
+            try:
+                watcher = Watcher()
+            except OSError:
+                watcher = None
+            state = {"followed": 0, "latencies": []}
+            
+            def follow():
+                now = time.time()
+                lines = tail.follow()
+                for line in lines:
+                    classifier.classify(line)
+                if lines:
+                    state["followed"] = state["followed"] + len(lines)
+                    state["latencies"].append(
+                        now - float(lines[0].split(" ", 1)[0]))
+                    
+            if watcher is not None:
+                watcher.add(fileName, follow)
+            writer = subprocess.Popen([sys.executable, "-c", TIMED_WRITER, 
+                fileName, str(rate), str(duration), syslogLine(random, 0)])
+            begin = time.time()
+            while writer.poll() is None:
+                if watcher is None:
+                    time.sleep(POLL_INTERVAL)
+                    follow()
+                elif select.select([watcher], [], [], 0.1)[0]:
+                    watcher.process()
+            follow()
+            elapsed = time.time() - begin
+            if watcher is not None:
+                watcher.close()
+            f = open(fileName, "rb")
+            f.seek(initial)
+            written = f.read().count("\n")
+            f.close()
+            latencies = state["latencies"]
+            latencies.sort()
+            if latencies:
+                avg = sum(latencies) / len(latencies) * 1000
+                p99 = latencies[len(latencies) * 99 // 100] * 1000
+            else:
+                avg = p99 = 0
+            print("%-10d %12d %12d %10.1f %10.1f %10.1f" % (rate, 
+                written / elapsed, state["followed"] / elapsed, 
+                avg, p99, rss()))
+        finally:
+            os.unlink(fileName)
+
+
+def benchRotate():
+    """Rotation and truncation: lines lost or duplicated while a writer runs 
+    during rapid rotations."""
+    duration = 5.0
+    print("%-13s %10s %10s %8s %8s %8s %10s %8s" % ("mode", "written", 
+        "followed", "lost", "twice", "order", "rotations", "events"))
+    for mode in ("create", "copytruncate", "sparse", "small"):
+        directory = tempfile.mkdtemp(prefix = "lovi-bench-")
+        fileName = os.path.join(directory, "rotating.log")
+        try:
+            open(fileName, "wb").close()
+            tail = Tail(fileName)
+            tail.follow()
+            result = {}
+            writer = threading.Thread(target = rotatingWriter, 
+                args = (fileName, mode, duration, 0.05, result))
+            writer.start()
+            lines = []
+            events = 0
+            while writer.isAlive():
+                time.sleep(0.002)
+                lines.extend(tail.follow())
+                events = events + len(tail.takeEvents())
+            for i in range(3):
+                lines.extend(tail.follow())
+                events = events + len(tail.takeEvents())
+            numbers = [int(line[:8]) for line in lines if line[:8].isdigit()]
+            unique = len(dict.fromkeys(numbers))
+            disorder = len([i for i in range(1, len(numbers)) 
+                if numbers[i] <= numbers[i - 1]])
+            print("%-13s %10d %10d %8d %8d %8d %10d %8d" % (mode, 
+                result["written"], len(lines), result["written"] - unique, 
+                len(numbers) - unique, disorder, result["rotations"], 
+                events))
+        finally:
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+            os.rmdir(directory)
+
+
+def benchMerge():
+    """Merger: lines/s merged from several files, versus just reading 
+    them."""
+    count = 250000
+    print("%-8s %14s %14s %10s" % ("files", "read/s", "merged/s", "RSS (MB)"))
+    for files in (2, 4, 8):
+        fileNames = [makeLog(lambda: 0, 0) for i in range(files)]
+        begin = time.time() - 3600
+        data = []
+        for i in range(files):
+            data.append("".join(["%s host %d line %d\n" % 
+                (time.strftime("%b %d %H:%M:%S", 
+                time.localtime(begin + j * 0.01)), i, j) 
+                for j in range(count)]))
+            # Lines are held until later stamps are read
+            data[i] = data[i] + "%s host %d end\n" % (time.strftime(
+                "%b %d %H:%M:%S", time.localtime(begin + count * 0.01 + 
+                Merger.REORDER_TIME + 1)), i)
+        try:
+            rates = []
+            for merge in (False, True):
+                for fileName in fileNames:
+                    open(fileName, "wb").close()
+                tails = [Tail(fileName) for fileName in fileNames]
+                sources = tails
+                if merge:
+                    sources = [Merger(tails)]
+                for source in sources:
+                    source.follow()
+                for i in range(files):
+                    f = open(fileNames[i], "ab")
+                    f.write(data[i])
+                    f.close()
+                begin = time.time()
+                followed = 0
+                while followed < files * count:
+                    for source in sources:
+                        followed = followed + len(source.follow())
+                rates.append(followed / (time.time() - begin))
+            print("%-8d %14d %14d %10.1f" % (files, rates[0], rates[1], rss()))
+        finally:
+            for fileName in fileNames:
+                os.unlink(fileName)
+
+
+def retainWidget(fileName, classifier):
+    """Keep the lines of a file in a QTextEdit, as monitors used to."""
+    from qt import QApplication, QTextEdit
+    app = QApplication(sys.argv)
+    edit = QTextEdit()
+    edit.setTextFormat(QTextEdit.LogText)
+    edit.setMaxLogLines(1 << 30)
+    tail = Tail(fileName)
+    tail.started = True
+    while True:
+        lines = tail.follow()
+        if not lines:
+            break
+        edit.append("\n".join(renderLines(lines, classifier)))
+    return edit
+
+
+def retainRichText(fileName, classifier):
+    """Keep the lines of a file as rich text strings, like the widget is 
+    fed."""
+    tail = Tail(fileName)
+    tail.started = True
+    ret = []
+    while True:
+        lines = tail.follow()
+        if not lines:
+            break
+        ret.extend(renderLines(lines, classifier))
+    return ret
+
+
+def retainStore(fileName, classifier, cacheLines = LineStore.CACHE_LINES):
+    """Keep the lines of a file in a LineStore."""
+    tail = Tail(fileName)
+    tail.started = True
+    store = LineStore(LineStore.CAPACITY, cacheLines)
+    while True:
+        lines = tail.follow()
+        if not lines:
+            break
+        store.append(lines, classifier, classifier.classifyLines(lines), 
+            tail.lineStarts, fileName, tail.inode())
+    return store
+
+
+def forked(work):
+    """Run work() in a child process, keeping its result. Return the growth 
+    of the resident set size of the child in MB and the time taken, or None 
+    if work() has failed."""
+    readFd, writeFd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(readFd)
+        try:
+            try:
+                before = rss()
+                begin = time.time()
+                kept = work()
+                os.write(writeFd, "%f %f" % (rss() - before, 
+                    time.time() - begin))
+            except:
+                pass
+        finally:
+            os._exit(0)
+    os.close(writeFd)
+    data = os.read(readFd, 100)
+    os.close(readFd)
+    os.waitpid(pid, 0)
+    if not data:
+        return None
+    return [float(x) for x in data.split()]
+
+
+def benchStore():
+    """Line store: memory and filtering time of 1M retained lines."""
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    count = LineStore.CAPACITY
+    print("%-24s %12s %12s %12s" % ("", "RSS (MB)", "bytes/line", "load s"))
+    fileName = makeLog(lambda: 0, 0)
+    rnd = random.Random(0)
+    f = open(fileName, "wb")
+    for i in range(0, count, 1000):
+        f.write("\n".join([syslogLine(rnd, i + j) for j in range(1000)]) + 
+            "\n")
+    f.close()
+    try:
+        for name, work in (
+            ("QTextEdit", lambda: retainWidget(fileName, classifier)),
+            ("rich text strings", 
+                lambda: retainRichText(fileName, classifier)),
+            ("store, all cached", 
+                lambda: retainStore(fileName, classifier, count)),
+            ("store", lambda: retainStore(fileName, classifier))):
+            result = forked(work)
+            if result is None:
+                print("%-24s %12s" % (name, "failed"))
+            else:
+                print("%-24s %12.1f %12d %12.1f" % (name, result[0], 
+                    result[0] * 1048576 / count, result[1]))
+        store = retainStore(fileName, classifier)
+        for name, lineFilter in (
+            ("errors", LineFilter("", "", Classifier.ERROR)), 
+            ("include sshd", LineFilter("sshd")), 
+            ("errors of sshd", LineFilter("sshd", "", Classifier.ERROR))):
+            begin = time.time()
+            lines, severities = store.select(lineFilter, store.first, 
+                store.end)
+            print("%-24s %12d lines in %.2f s" % ("select " + name, 
+                len(lines), time.time() - begin))
+    finally:
+        os.unlink(fileName)
+
+
+def blocks():
+    """Return the number of memory blocks allocated by the interpreter, or 
+    None if it cannot tell."""
+    getallocatedblocks = getattr(sys, "getallocatedblocks", None)
+    if getallocatedblocks is None:
+        return None
+    return getallocatedblocks()
+
+
+def benchDecode():
+    """Rendering a burst of lines: every line read versus only the lines 
+    shown, decoded."""
+    shown = 1000
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    print("%-8s %-12s %10s %10s %12s %12s" % ("log", "rendering", 
+        "render ms", "strings", "MB rendered", "blocks"))
+    for name, generator in GENERATORS:
+        lines = generateLines(generator, 100000)
+        # Some bytes that are not UTF-8
+        lines[::100] = [line + " caf\xe9" for line in lines[::100]]
+        severities = classifier.classifyLines(lines)
+        for how, render in (
+            ("every line", lambda: renderLines(lines, classifier, 
+                severities)),
+            ("shown lines", lambda: renderLines(lines[-shown:], classifier, 
+                severities[-shown:], "utf-8"))):
+            before = blocks()
+            begin = time.time()
+            html = render()
+            elapsed = time.time() - begin
+            after = blocks()
+            allocated = "n/a"
+            if before is not None:
+                allocated = "%d" % (after - before)
+            size = sum([len(line) for line in html])
+            print("%-8s %-12s %10.1f %10d %12.1f %12s" % (name, how, 
+                elapsed * 1000, len(html), size / 1048576.0, allocated))
+            del html
+
+
+def benchFields():
+    """Structured lines: parsing and storing their fields, and field 
+    queries over the store."""
+    classifier = Classifier(Classifier.keywords(Classifier.ERRORS),
+        Classifier.keywords(Classifier.WARNINGS))
+    queries = {"syslog": "program=sshd host=host3", 
+        "json": "service=auth duration_ms>=4000", 
+        "logfmt": "status>=500 host=db3"}
+    print("%-8s %-8s %12s %12s %12s %10s %10s %10s" % ("log", "format", 
+        "parse/s", "store/s", "column B/l", "dropped", "query ms", 
+        "matches"))
+    for name, generator in GENERATORS + [("logfmt", logfmtLine)]:
+        lines = generateLines(generator, 100000)
+        parser = detectParser(lines)
+        if parser is None:
+            print("%-8s %-8s" % (name, "-"))
+            continue
+        fieldClassifier = classifier.withParser(parser)
+        begin = time.time()
+        records = fieldClassifier.parseLines(lines)
+        severities = fieldClassifier.classifyLines(lines, records)
+        parsed = time.time()
+        store = LineStore(len(lines))
+        store.append(lines, fieldClassifier, severities, records = records)
+        stored = time.time()
+        fields = store.fields
+        columnBytes = sum([column.itemsize * len(column) 
+            for column in fields.columns.values()])
+        lineFilter = LineFilter("", "", Classifier.NORMAL, queries[name])
+        begin2 = time.time()
+        matches = store.select(lineFilter, store.first, store.end)[0]
+        queried = time.time()
+        print("%-8s %-8s %12d %12d %12.1f %10d %10.1f %10d" % (name, 
+            parser.NAME, len(lines) / (parsed - begin), 
+            len(lines) / (stored - parsed), columnBytes / float(len(lines)), 
+            len(fields.dropped), (queried - begin2) * 1000, len(matches)))
+
+
+BENCHMARKS = [
+    ("start", benchStart),
+    ("watch", benchWatch),
+    ("poll", benchPoll),
+    ("profile", benchProfile),
+    ("follow", benchFollow),
+    ("render", benchRender),
+    ("classify", benchClassify),
+    ("search", benchSearch),
+    ("export", benchExport),
+    ("bookmark", benchBookmark),
+    ("tail", benchTail),
+    ("rotate", benchRotate),
+    ("merge", benchMerge),
+    ("store", benchStore),
+    ("decode", benchDecode),
+    ("fields", benchFields),
+]
+
+
+def main():
+
+    """Main program."""
+
+    names = sys.argv[1:]
+    if not names:
+        print(__doc__.strip())
+        print("")
+        for name, bench in BENCHMARKS:
+            print("  %-12s %s" % (name, bench.__doc__))
+        return
+    for name, bench in BENCHMARKS:
+        if name in names:
+            print("== %s" % name)
+            bench()
+
+
+if __name__ == "__main__":
+    main()
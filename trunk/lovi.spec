@@ -24,6 +24,7 @@ make clean DESTDIR=$RPM_BUILD_ROOT
 
 %files
 /usr/bin/lovi
+/usr/share/lovi/lovicore.py
 /usr/share/applications/lovi.desktop
 /usr/share/icons/lovi.png
 
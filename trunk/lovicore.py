@@ -0,0 +1,4013 @@
+"""
+Log file monitoring engine of lovi, usable without Qt and KDE.
+"""
+
+"""
+Copyright (c) 2005-2006 by Akos Polster
+
+See main.py for the terms and conditions.
+"""
+
+import bisect
+import codecs
+import collections
+import cProfile
+import errno
+import fcntl
+import heapq
+import json
+import operator
+import optparse
+import os
+import pipes
+import Queue
+import re
+import select
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+from array import array
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+try:
+    import zlib
+except ImportError:
+    zlib = None
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# Type code of arrays holding file offsets
+if array("L").itemsize >= 8:
+    OFFSET_TYPE = "L"
+else:
+    OFFSET_TYPE = "d"
+
+# Encoding of files that are not UTF-8: it decodes any byte
+FALLBACK_ENCODING = "latin-1"
+
+
+def detectEncoding(data):
+    """Return the encoding of a sample of a file: UTF-8 if the sample is 
+    valid UTF-8, ignoring a character cut at the end, FALLBACK_ENCODING 
+    otherwise."""
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:
+        error = sys.exc_info()[1]
+        if error.start < len(data) - 3 or error.end < len(data):
+            return FALLBACK_ENCODING
+    return "utf-8"
+    
+    
+def encodingName(encoding):
+    """Return the canonical name of an encoding, or None if it is 
+    unknown."""
+    try:
+        return codecs.lookup(encoding).name
+    except (LookupError, TypeError):
+        return None
+
+
+class Tail:
+
+    """
+    File monitor.
+    
+    Lines are read as bytes. Their encoding is given, or detected from the 
+    lines read by start(); they only need to be decoded for display.
+    
+    Rotation is noticed when the file name refers to another inode, and 
+    truncation in place (like by logrotate's copytruncate) when the file 
+    gets shorter than the read position, or the last FINGERPRINT bytes read 
+    change. Either way, data moved away before it was read is recovered 
+    from the rotated siblings, and the event is recorded for takeEvents().
+    
+    Based on code contributed to Python Cookbook by Ed Pascoe (2003).
+    """
+
+    LINES_BACK = 700
+    BLOCK_SIZE = 64 * 1024
+    CHUNK_MAX = 16 * 1024 * 1024
+    MAX_BACKLOG = 64 * 1024 * 1024
+    FINGERPRINT = 128
+    REPLACED = -1
+    ROTATED = "rotated"
+    TRUNCATED = "truncated"
+
+    def __init__(self, fileName, rotated = False, encoding = None):
+        self.fileName = fileName
+        self.rotated = rotated
+        self.encoding = encoding
+        # Unbuffered: a buffer would keep data truncated in place
+        self.fd = open(fileName, "rb", 0)
+        self.started = False
+        self.changed = False
+        self.partial = ""
+        self.resync = False
+        self.dropped = 0
+        self.index = LineIndex()
+        self.lineStarts = array(OFFSET_TYPE)
+        self.fingerprint = ""
+        self.hole = None
+        self.events = []
+        
+    def start(self, offset = None):
+        
+        """Start monitoring; return the last LINES_BACK lines of the file, 
+        or with offset, the last LINES_BACK lines before offset.
+        
+        The file is read backwards from the end in blocks of BLOCK_SIZE 
+        bytes, until enough line breaks have been seen, so each byte is read 
+        at most once. The file position is left after the last complete 
+        line. If rotated, lines missing from a freshly rotated file are taken 
+        from its rotated siblings. The offsets of the lines are left in 
+        lineStarts, like by follow()."""
+    
+        if offset is None:
+            self.fd.seek(0, 2)
+        else:
+            self.fd.seek(offset)
+        pos = self.fd.tell()
+        blocks = []
+        newLines = 0
+        
+        # One more line break than LINES_BACK is needed to find where the 
+        # first line starts
+        while pos > 0 and newLines <= Tail.LINES_BACK:
+            size = min(pos, Tail.BLOCK_SIZE)
+            pos = pos - size
+            self.fd.seek(pos)
+            block = self.fd.read(size)
+            newLines = newLines + block.count("\n")
+            blocks.append(block)
+            
+        blocks.reverse()
+        data = "".join(blocks)
+        if PROFILER.enabled:
+            PROFILER.add("bytes read", len(data))
+        if self.encoding is None:
+            self.encoding = detectEncoding(data)
+        end = data.rfind("\n") + 1
+        self.fd.seek(pos + end)
+        self.fingerprint = data[max(0, end - Tail.FINGERPRINT):end]
+        lines = []
+        if end > 0:
+            lines = data[:end - 1].split("\n")
+        if len(lines) > Tail.LINES_BACK:
+            lines = lines[len(lines) - Tail.LINES_BACK:]
+        self.lineStarts = LineStore.starts(pos + end - 
+            sum([len(line) + 1 for line in lines]), lines)
+        if "\r" in data:
+            lines = [line.rstrip("\r") for line in lines]
+        if self.rotated and len(lines) < Tail.LINES_BACK:
+            lines = RotationSet(self.fileName).lastLines(
+                Tail.LINES_BACK - len(lines)) + lines
+        return lines
+        
+    def follow(self):
+        
+        """Monitor file for changes: Return lines appended to the file since 
+        last call.
+        
+        All new data is fetched with a single read of at most CHUNK_MAX 
+        bytes, and a partial last line is kept until it is completed. If the 
+        reader falls more than MAX_BACKLOG bytes behind, older data is 
+        skipped and counted in dropped. The offsets of the last lines 
+        returned, followed by the offset after them, are left in lineStarts: 
+        lines without a place in the current file come first. After rotation 
+        or truncation, the lines of the old file are returned, and the next 
+        call continues with the new one."""
+        
+        ret = []
+        starts = array(OFFSET_TYPE)
+        
+        if not self.started:
+            ret = self.start()
+            starts = self.lineStarts
+            self.started = True
+        self.lineStarts = starts
+        
+        where = self.fd.tell()
+        fdResults = os.fstat(self.fd.fileno())
+        backlog = fdResults[6] - where
+        if backlog < 0 or (backlog > 0 and not self.intact(where)):
+            ret.extend(self.truncated(where, fdResults[1]))
+            return ret
+        if backlog == 0:
+            try:
+                stResults = os.stat(self.fileName)
+            except OSError:
+                stResults = fdResults
+            if stResults[1] != fdResults[1]:
+                # Inode of the monitored file has changed
+                ret.extend(self.recover(where, fdResults[1]))
+                self.fd.close()
+                self.fd = open(self.fileName, "rb", 0)
+                self.newFile(Tail.ROTATED)
+            return ret
+            
+        if backlog > Tail.MAX_BACKLOG:
+            skip = backlog - Tail.MAX_BACKLOG
+            self.fd.seek(where + skip)
+            if PROFILER.enabled:
+                PROFILER.add("bytes dropped", skip)
+            self.dropped = self.dropped + skip + len(self.partial)
+            self.partial = ""
+            self.resync = True
+            self.fingerprint = ""
+            backlog = Tail.MAX_BACKLOG
+            where = where + skip
+            
+        data = self.fd.read(min(backlog, Tail.CHUNK_MAX))
+        if PROFILER.enabled:
+            PROFILER.add("bytes read", len(data))
+        if not self.intact(where):
+            # Truncated between the check and the read
+            ret.extend(self.truncated(where, fdResults[1]))
+            return ret
+        if self.hole is not None:
+            # The hole may be written after the truncation was seen
+            skipped = len(data) - len(data.lstrip("\0"))
+            where = where + skipped
+            data = data[skipped:]
+            if not data:
+                self.fd.seek(self.dataStart(self.hole, fdResults[6]))
+                return ret
+            self.hole = None
+        self.fingerprint = (self.fingerprint + 
+            data[-Tail.FINGERPRINT:])[-Tail.FINGERPRINT:]
+        self.index.feed(where, data)
+        base = where - len(self.partial)
+        data = self.partial + data
+        lines = data.split("\n")
+        self.partial = lines.pop()
+        if self.resync:
+            # Skipped to the middle of a line: drop the rest of it
+            if lines:
+                self.dropped = self.dropped + len(lines[0]) + 1
+                base = base + len(lines[0]) + 1
+                del lines[0]
+                self.resync = False
+            else:
+                self.dropped = self.dropped + len(self.partial)
+                self.partial = ""
+        if lines:
+            if len(starts) > 0 and starts[-1] == base:
+                starts = starts[:-1] + LineStore.starts(base, lines)
+            else:
+                starts = LineStore.starts(base, lines)
+            self.lineStarts = starts
+        if "\r" in data:
+            lines = [line.rstrip("\r") for line in lines]
+        if lines:
+            self.changed = True
+            ret.extend(lines)
+                
+        return ret
+        
+    def intact(self, where):
+        """Return True if the data before offset where is still the data 
+        read there."""
+        if not self.fingerprint:
+            return True
+        pos = self.fd.tell()
+        self.fd.seek(where - len(self.fingerprint))
+        data = self.fd.read(len(self.fingerprint))
+        self.fd.seek(pos)
+        return data == self.fingerprint
+        
+    def truncated(self, where, inode):
+        """Handle truncation in place: return the lines recovered from the 
+        copy, and continue with the new data at the beginning."""
+        ret = self.recover(where, inode)
+        self.fd.seek(self.dataStart(where, os.fstat(self.fd.fileno())[6]))
+        self.newFile(Tail.TRUNCATED)
+        self.hole = where
+        return ret
+        
+    def recover(self, where, inode):
+        """Return the lines written to the file after offset where, but 
+        moved away by rotation before they were read, and the partial line 
+        read last. The old file is the rotated sibling with inode number 
+        inode, or for copies, with the data read before where; it is read 
+        from where, and the siblings rotated after it are read whole."""
+        # Newest first: the old file is usually the last one rotated
+        siblings = [path for path, kind in 
+            RotationSet.siblings(self.fileName) if not kind]
+        siblings.reverse()
+        old = None
+        for path in siblings:
+            try:
+                if os.stat(path)[1] == inode:
+                    old = path
+                    break
+            except OSError:
+                pass
+        if old is None and self.fingerprint:
+            for path in siblings:
+                data = Tail.readFile(path, where - len(self.fingerprint), 
+                    len(self.fingerprint))
+                if data == self.fingerprint:
+                    old = path
+                    break
+        chunks = []
+        if old is not None:
+            chunks.append(Tail.readFile(old, where, Tail.MAX_BACKLOG))
+            newer = siblings[:siblings.index(old)]
+            newer.reverse()
+            for path in newer:
+                chunks.append(Tail.readFile(path, 0, Tail.MAX_BACKLOG))
+        ret = []
+        for data in [self.partial + "".join(chunks[:1])] + chunks[1:]:
+            lines = data.split("\n")
+            if self.resync:
+                # The partial line was not read from its start
+                del lines[0]
+                self.resync = False
+            if lines and not lines[-1]:
+                lines.pop()
+            ret.extend([line.rstrip("\r") for line in lines])
+        self.partial = ""
+        if ret:
+            self.changed = True
+        return ret
+        
+    def readFile(path, offset, size):
+        """Return at most size bytes of a file from offset, or "" if it 
+        cannot be read."""
+        try:
+            fd = open(path, "rb")
+            try:
+                fd.seek(offset)
+                return fd.read(size)
+            finally:
+                fd.close()
+        except (IOError, OSError):
+            return ""
+    readFile = staticmethod(readFile)
+        
+    def dataStart(self, where, size):
+        """Return the offset where the data written since truncation starts. 
+        Writers without O_APPEND go on writing at their old offset, leaving a 
+        hole of zero bytes before it."""
+        self.fd.seek(0)
+        if self.fd.read(1) != "\0":
+            return 0
+        pos = min(where, size)
+        self.fd.seek(pos)
+        while pos < size:
+            data = self.fd.read(Tail.BLOCK_SIZE)
+            if not data:
+                break
+            skipped = len(data) - len(data.lstrip("\0"))
+            pos = pos + skipped
+            if skipped < len(data):
+                break
+        return pos
+        
+    def newFile(self, event):
+        """Start reading a new file from the current position: after 
+        rotation or truncation."""
+        self.index = LineIndex()
+        self.lineStarts = array(OFFSET_TYPE)
+        self.partial = ""
+        self.resync = False
+        self.fingerprint = ""
+        self.hole = None
+        self.events.append((self.fileName, event))
+        
+    def takeEvents(self):
+        """Return the rotations and truncations noticed, as (file name, 
+        ROTATED or TRUNCATED) pairs, after the lines returned by follow() 
+        before them."""
+        events = self.events
+        self.events = []
+        return events
+        
+    def getFileName(self):
+        return self.fileName
+        
+    def getFileNames(self):
+        return [self.fileName]
+        
+    def getEncoding(self):
+        """Return the encoding of the file."""
+        return self.encoding or "utf-8"
+        
+    def isChanged(self):
+        changed = self.changed
+        self.changed = False
+        return changed
+        
+    def holding(self):
+        """Return True if complete lines are held back. Tails never hold 
+        lines back."""
+        return False
+        
+    def resume(self, inode, offset, last = None):
+        """Continue reading at offset instead of starting with the last 
+        lines, if the file still has inode number inode, is at least offset 
+        bytes long, and has line last before offset, if given. Return True 
+        if resumed."""
+        st = os.fstat(self.fd.fileno())
+        if self.started or st[1] != inode or st[6] < offset:
+            return False
+        if last is not None:
+            # Truncated and written again since
+            self.fd.seek(max(0, offset - len(last) - 2))
+            data = self.fd.read(offset - self.fd.tell())
+            if not data.endswith("\n") or \
+                data[:-1].rstrip("\r").split("\n")[-1] != last:
+                return False
+        if self.encoding is None:
+            self.fd.seek(max(0, offset - Tail.BLOCK_SIZE))
+            self.encoding = detectEncoding(
+                self.fd.read(min(offset, Tail.BLOCK_SIZE)))
+        self.fd.seek(max(0, offset - Tail.FINGERPRINT))
+        self.fingerprint = self.fd.read(offset - self.fd.tell())
+        self.started = True
+        return True
+        
+    def startAt(self, offset):
+        """Start monitoring at offset, where the last session has stopped 
+        reading, instead of at the end: return the last LINES_BACK lines 
+        before offset, and let follow() read the lines added since."""
+        lines = self.start(offset)
+        self.started = True
+        return lines
+        
+    def inode(self):
+        """Return the inode number of the file being read."""
+        return os.fstat(self.fd.fileno())[1]
+        
+    def offset(self):
+        """Return the offset after the last complete line read."""
+        return self.fd.tell() - len(self.partial)
+        
+    def indexStep(self, budget):
+        """Extend the line index towards the read position, reading at most 
+        budget bytes. Return True if the index has caught up."""
+        if self.index.end >= self.offset():
+            return True
+        where = self.fd.tell()
+        done = self.index.update(self.fd, where, budget)
+        self.fd.seek(where)
+        return done
+        
+    def lineOf(self, offset):
+        """Return the number of lines before offset, in the indexed part of 
+        the file."""
+        where = self.fd.tell()
+        try:
+            return self.index.lineOf(self.fd, offset)
+        finally:
+            self.fd.seek(where)
+        
+    def saveIndex(self, path):
+        """Save the line index and the read position, so the next session 
+        can resume with loadIndex()."""
+        st = os.fstat(self.fd.fileno())
+        f = open(path + ".new", "wb")
+        try:
+            f.write("inode %d\nsize %d\noffset %d\nend %d\ncount %d\n" % 
+                (st[1], st[6], self.offset(), self.index.end, 
+                self.index.count))
+            f.write("checkpoints %s\n" % 
+                " ".join([str(int(c)) for c in self.index.lineCounts]))
+        finally:
+            f.close()
+        os.rename(path + ".new", path)
+        
+    def loadIndex(self, path):
+        """Restore the line index saved by saveIndex(). Return the read 
+        position saved, for startAt(), REPLACED if the file has been rotated 
+        or truncated, or None if there is no saved index. The lines added 
+        since are not read: the index is extended by indexStep()."""
+        try:
+            f = open(path, "rb")
+            try:
+                fields = {}
+                for line in f:
+                    key, value = line.split(" ", 1)
+                    fields[key] = value.split()
+            finally:
+                f.close()
+            inode = int(fields["inode"][0])
+            offset = int(fields["offset"][0])
+            index = LineIndex()
+            index.end = int(fields["end"][0])
+            index.count = int(fields["count"][0])
+            index.lineCounts = array(OFFSET_TYPE, 
+                [int(c) for c in fields["checkpoints"]])
+        except (IOError, KeyError, ValueError):
+            return None
+        st = os.fstat(self.fd.fileno())
+        if st[1] != inode or st[6] < offset or st[6] < index.end:
+            return Tail.REPLACED
+        self.index = index
+        return offset
+
+
+class Merger:
+
+    """
+    Timeline of several files.
+    
+    Lines of several Tails are merged in the order of their syslog style 
+    timestamps (like "Oct 17 12:34:56"). Lines without timestamp stay after 
+    the line before them. The heads of the per-file queues are merged with 
+    a heap, and lines of one file are released in runs, up to the next head 
+    of the other files. Lines are held back until lines stamped REORDER_TIME 
+    seconds later have been read, so late writers are still ordered 
+    correctly. Time is taken from the stamps, not the local clock, which 
+    may be skewed or in another timezone. Lines are released anyway once 
+    they have waited REORDER_TIME seconds, or when more than MAX_BUFFERED 
+    are held. As stamps have no year, stamps going back more than 
+    YEAR_TURN seconds start a new year.
+    """
+
+    REORDER_TIME = 2
+    MAX_BUFFERED = 100000
+    YEAR_TURN = 6 * 31 * 24 * 3600
+    TIMESTAMP = re.compile(r"(\w{3}) ([ \d]\d) (\d\d):(\d\d):(\d\d)")
+    MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, 
+        "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+    def __init__(self, tails):
+        self.tails = tails
+        self.rotated = False
+        self.queues = [collections.deque() for tail in tails]
+        self.stamps = [0] * len(tails)
+        self.buffered = 0
+        self.started = False
+        # Newest stamp read, and (arrival time, newest stamp) of the reads 
+        # not released by time yet
+        self.newest = None
+        self.arrivals = collections.deque()
+        
+    def stamp(month, day, hour, minute, second):
+        """Return a timestamp as seconds since the start of the year, 
+        counting 31 days in each month."""
+        return (((month * 31 + day) * 24 + hour) * 60 + minute) * 60 + second
+    stamp = staticmethod(stamp)
+        
+    def parse(line, last):
+        """Return the timestamp at the start of a line, or last if there is 
+        none."""
+        match = Merger.TIMESTAMP.match(line)
+        if match is None or match.group(1) not in Merger.MONTHS:
+            return last
+        return Merger.stamp(Merger.MONTHS[match.group(1)], 
+            int(match.group(2)), int(match.group(3)), int(match.group(4)), 
+            int(match.group(5)))
+    parse = staticmethod(parse)
+        
+    def follow(self):
+        """Return the new lines of all files that can be released in 
+        timestamp order. Lines read by the first call are all released."""
+        now = time.time()
+        newest = None
+        for i in range(len(self.tails)):
+            lines = self.tails[i].follow()
+            queue = self.queues[i]
+            last = self.stamps[i]
+            prefix = None
+            high = None
+            for line in lines:
+                # Consecutive lines often have the same timestamp
+                if line[:15] != prefix:
+                    prefix = line[:15]
+                    last = self.parse(line, last)
+                    if high is None or last > high:
+                        high = last
+                queue.append((last, line))
+            self.stamps[i] = last
+            self.buffered = self.buffered + len(lines)
+            if high is not None:
+                if self.newest is None or high > self.newest or \
+                    high < self.newest - Merger.YEAR_TURN:
+                    self.newest = high
+                newest = max(newest, high)
+        if not self.started:
+            self.started = True
+            return self.release(float("inf"))
+        if newest is not None:
+            self.arrivals.append((now, newest))
+        watermark = float("-inf")
+        if self.newest is not None:
+            watermark = self.newest - Merger.REORDER_TIME
+        while self.arrivals and \
+            self.arrivals[0][0] <= now - Merger.REORDER_TIME:
+            # Waited long enough, whatever the stamps of other files say
+            watermark = max(watermark, self.arrivals.popleft()[1])
+        return self.release(watermark)
+        
+    def release(self, watermark):
+        """Return the buffered lines up to timestamp watermark, merged. Older 
+        lines are released too while too many are buffered."""
+        ret = []
+        heap = [(queue[0][0], i) for i, queue in enumerate(self.queues) 
+            if queue]
+        heapq.heapify(heap)
+        while heap:
+            force = self.buffered > Merger.MAX_BUFFERED
+            if heap[0][0] > watermark and not force:
+                break
+            i = heapq.heappop(heap)[1]
+            queue = self.queues[i]
+            bound = watermark
+            if force:
+                bound = float("inf")
+            if heap:
+                bound = min(bound, heap[0][0])
+            count = len(ret)
+            ret.append(queue.popleft()[1])
+            while queue and queue[0][0] <= bound:
+                ret.append(queue.popleft()[1])
+            self.buffered = self.buffered - (len(ret) - count)
+            if queue:
+                heapq.heappush(heap, (queue[0][0], i))
+        return ret
+        
+    def holding(self):
+        """Return True if lines are held back for reordering."""
+        return self.buffered > 0
+        
+    def getFileName(self):
+        return " + ".join([os.path.basename(tail.getFileName()) 
+            for tail in self.tails])
+            
+    def getFileNames(self):
+        return [tail.getFileName() for tail in self.tails]
+        
+    def getEncoding(self):
+        """Return the encoding of the files if they agree, FALLBACK_ENCODING 
+        otherwise."""
+        encodings = {}
+        for tail in self.tails:
+            encodings[encodingName(tail.getEncoding())] = True
+        if len(encodings) == 1:
+            return list(encodings.keys())[0]
+        return FALLBACK_ENCODING
+        
+    def takeEvents(self):
+        """Return the rotations and truncations noticed in the files, like 
+        Tail.takeEvents()."""
+        events = []
+        for tail in self.tails:
+            events.extend(tail.takeEvents())
+        return events
+        
+    def close(self):
+        """Stop following the remote files."""
+        for tail in self.tails:
+            if isinstance(tail, RemoteTail):
+                tail.close()
+        
+    def isChanged(self):
+        changed = False
+        for tail in self.tails:
+            changed = tail.isChanged() or changed
+        return changed
+        
+    def indexStep(self, budget):
+        """Extend the line indexes of the files. Return True if they have 
+        all caught up."""
+        done = True
+        for tail in self.tails:
+            done = tail.indexStep(budget) and done
+        return done
+
+
+class RemoteHost:
+
+    """
+    Connection to a remote host, following files there.
+    
+    HELPER runs on the host, started by command (ssh by default): it follows 
+    files like tail -F, and sends the data appended to them in frames tagged 
+    with the file and the offset. All files of a host share one connection, 
+    returned by RemoteHost.get(). Frames are received by a thread. If the 
+    connection is lost, it is made again after a delay doubling from 
+    RETRY_MIN to RETRY_MAX seconds, and the files are followed again from 
+    the offsets received so far.
+    """
+
+    COMMAND = "ssh -T -o BatchMode=yes -o ServerAliveInterval=30 %h"
+    RETRY_MIN = 1
+    RETRY_MAX = 60
+    
+    # Runs on the remote host, with Python 2.6 or later
+    HELPER = r"""
+import os, select, sys
+BLOCK = 1024 * 1024
+MARK = 128
+files = {}
+commands = b""
+
+def send(data):
+    while data:
+        data = data[os.write(1, data):]
+
+def frame(kind, ident, offset, data = b""):
+    send(("%s %d %d %d\n" % (kind, ident, offset, len(data))).encode(
+        "ascii") + data)
+
+def changed(fd, offset, mark):
+    # The data before offset is not what was read there
+    if not mark:
+        return False
+    fd.seek(offset - len(mark))
+    return fd.read(len(mark)) != mark
+
+while True:
+    busy = False
+    for ident in list(files.keys()):
+        path, offset, fd, inode, mark = files[ident]
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if fd is not None and st is not None and st.st_ino != inode:
+            data = fd.read(BLOCK)
+            if data:
+                # Rotated: send the rest of the old file first
+                frame("D", ident, offset, data)
+                files[ident][1] = offset + len(data)
+                busy = True
+                continue
+            fd.close()
+            fd = None
+            offset = 0
+            mark = b""
+            frame("R", ident, 0)
+        if fd is None:
+            if st is None:
+                continue
+            try:
+                fd = open(path, "rb")
+            except IOError:
+                continue
+            st = os.fstat(fd.fileno())
+            inode = st.st_ino
+            if offset < 0:
+                offset = max(0, st.st_size + offset)
+            elif offset > st.st_size:
+                offset = 0
+                frame("R", ident, 0)
+            fd.seek(max(0, offset - MARK))
+            mark = fd.read(offset - fd.tell())
+        elif st is not None and (st.st_size < offset or 
+            (st.st_size > offset and changed(fd, offset, mark))):
+            # Truncated in place
+            offset = 0
+            mark = b""
+            frame("T", ident, 0)
+        fd.seek(offset)
+        data = fd.read(BLOCK)
+        if data:
+            frame("D", ident, offset, data)
+            offset = offset + len(data)
+            mark = (mark + data[-MARK:])[-MARK:]
+            busy = busy or len(data) == BLOCK
+        files[ident] = [path, offset, fd, inode, mark]
+    timeout = 0.5
+    if busy:
+        timeout = 0
+    if select.select([0], [], [], timeout)[0]:
+        data = os.read(0, 65536)
+        if not data:
+            break
+        commands = commands + data
+        while b"\n" in commands:
+            line, commands = commands.split(b"\n", 1)
+            fields = line.split(b" ", 3)
+            if fields[0] == b"W":
+                files[int(fields[1])] = [fields[3], int(fields[2]), None, 
+                    None, b""]
+            elif fields[0] == b"U":
+                files.pop(int(fields[1]), None)
+"""
+    
+    hosts = {}
+    hostsLock = threading.Lock()
+
+    def __init__(self, host, command = COMMAND):
+        self.host = host
+        self.command = command
+        self.tails = {}
+        self.nextIdent = 0
+        self.process = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target = self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        
+    def get(host, command = COMMAND):
+        """Return the shared connection to host."""
+        RemoteHost.hostsLock.acquire()
+        try:
+            key = (host, command)
+            if key not in RemoteHost.hosts:
+                RemoteHost.hosts[key] = RemoteHost(host, command)
+            return RemoteHost.hosts[key]
+        finally:
+            RemoteHost.hostsLock.release()
+    get = staticmethod(get)
+    
+    def split(fileName):
+        """Split a remote file name like host:/path into host and path. 
+        Return None for local file names."""
+        head = fileName.split("/", 1)[0]
+        if ":" not in head:
+            return None
+        host, path = fileName.split(":", 1)
+        if not host or not path:
+            return None
+        return host, path
+    split = staticmethod(split)
+        
+    def args(self):
+        """Return the command line starting HELPER on the host."""
+        remote = "exec $(command -v python3 || command -v python) -u -c " + \
+            pipes.quote(RemoteHost.HELPER)
+        return [arg.replace("%h", self.host) 
+            for arg in self.command.split()] + [remote]
+        
+    def add(self, tail):
+        """Follow the file of a RemoteTail."""
+        self.lock.acquire()
+        try:
+            tail.ident = self.nextIdent
+            self.nextIdent = self.nextIdent + 1
+            self.tails[tail.ident] = tail
+            self.watch(tail)
+        finally:
+            self.lock.release()
+            
+    def remove(self, tail):
+        """Stop following the file of a RemoteTail. The connection is 
+        closed with its last file."""
+        self.lock.acquire()
+        try:
+            if self.tails.pop(tail.ident, None) is None:
+                return
+            self.send("U %d\n" % tail.ident)
+            last = not self.tails
+        finally:
+            self.lock.release()
+        if last:
+            RemoteHost.hostsLock.acquire()
+            try:
+                if RemoteHost.hosts.get((self.host, self.command)) is self:
+                    del RemoteHost.hosts[(self.host, self.command)]
+            finally:
+                RemoteHost.hostsLock.release()
+            self.close()
+            
+    def watch(self, tail):
+        """Ask the helper to follow a file. Call with the lock held."""
+        self.send("W %d %d %s\n" % (tail.ident, tail.resumeOffset(), 
+            tail.path))
+        
+    def send(self, command):
+        """Send a command to the helper, if connected. Call with the lock 
+        held."""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.write(command)
+            self.process.stdin.flush()
+        except (IOError, OSError, ValueError):
+            # The reader thread notices the lost connection
+            pass
+            
+    def run(self):
+        """Reader thread: connect, receive frames, and reconnect with 
+        back-off when the connection is lost."""
+        delay = RemoteHost.RETRY_MIN
+        while not self.closed:
+            began = time.time()
+            try:
+                self.connect()
+                self.receive()
+            except (IOError, OSError, ValueError):
+                pass
+            self.disconnect()
+            if self.closed:
+                break
+            if time.time() - began > RemoteHost.RETRY_MAX:
+                # The connection has worked for a while
+                delay = RemoteHost.RETRY_MIN
+            self.wakeup.wait(delay)
+            delay = min(delay * 2, RemoteHost.RETRY_MAX)
+            
+    def connect(self):
+        """Start the helper, and follow the files from the offsets received 
+        so far."""
+        process = subprocess.Popen(self.args(), stdin = subprocess.PIPE, 
+            stdout = subprocess.PIPE, close_fds = True)
+        self.lock.acquire()
+        try:
+            self.process = process
+            for tail in self.tails.values():
+                self.watch(tail)
+        finally:
+            self.lock.release()
+            
+    def receive(self):
+        """Pass frames to the RemoteTails until the connection is lost."""
+        stdout = self.process.stdout
+        while True:
+            header = stdout.readline()
+            if not header.endswith("\n"):
+                break
+            kind, ident, offset, length = header.split()
+            data = ""
+            if int(length) > 0:
+                data = stdout.read(int(length))
+                if len(data) < int(length):
+                    break
+            tail = self.tails.get(int(ident))
+            if tail is None:
+                continue
+            if kind == "D":
+                tail.receive(int(offset), data)
+            elif kind == "R":
+                tail.reset(Tail.ROTATED)
+            elif kind == "T":
+                tail.reset(Tail.TRUNCATED)
+                
+    def disconnect(self):
+        """Stop the helper."""
+        self.lock.acquire()
+        try:
+            process = self.process
+            self.process = None
+        finally:
+            self.lock.release()
+        if process is None:
+            return
+        for f in (process.stdin, process.stdout):
+            try:
+                f.close()
+            except (IOError, OSError):
+                pass
+        try:
+            os.kill(process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        process.wait()
+        
+    def close(self):
+        """Close the connection for good."""
+        self.closed = True
+        self.wakeup.set()
+        self.disconnect()
+
+
+class RemoteTail:
+
+    """
+    Monitor of a file on a remote host, named like host:/path.
+    
+    Data arrives through the shared RemoteHost connection of the host, 
+    made by the first call of follow(), and resumed from the data received 
+    when reconnected. Like Tail.follow(), follow() returns complete lines, 
+    starting with the last LINES_BACK lines of the file, and stops at 
+    rotation or truncation, reported by the helper. The lines cannot be read 
+    back, so there is no line index.
+    """
+
+    START_BYTES = 256 * 1024
+
+    def __init__(self, fileName, encoding = None, 
+        command = RemoteHost.COMMAND):
+        self.fileName = fileName
+        self.host, self.path = RemoteHost.split(fileName)
+        self.encoding = encoding
+        self.rotated = False
+        self.lock = threading.Lock()
+        self.chunks = []
+        self.received = None
+        self.position = 0
+        self.partial = ""
+        self.resync = False
+        self.started = False
+        self.changed = False
+        self.events = []
+        self.ident = None
+        self.command = command
+        self.connection = None
+        
+    def resumeOffset(self):
+        """Return the offset the helper should send data from: negative to 
+        start with the end of the file."""
+        self.lock.acquire()
+        try:
+            if self.received is None:
+                return -RemoteTail.START_BYTES
+            return self.received
+        finally:
+            self.lock.release()
+        
+    def receive(self, offset, data):
+        """Take data read from offset. Called by the reader thread."""
+        self.lock.acquire()
+        try:
+            if self.received is not None and offset < self.received:
+                # Sent again after reconnecting
+                data = data[self.received - offset:]
+                offset = self.received
+            if data:
+                self.chunks.append((offset, data))
+                self.received = offset + len(data)
+        finally:
+            self.lock.release()
+        if PROFILER.enabled:
+            PROFILER.add("bytes read", len(data))
+            
+    def reset(self, event):
+        """The file has been rotated or truncated, as event tells: data 
+        starts again from offset 0. Called by the reader thread."""
+        self.lock.acquire()
+        try:
+            self.chunks.append(event)
+            self.received = 0
+        finally:
+            self.lock.release()
+            
+    def follow(self):
+        """Return the lines received since last call."""
+        if self.connection is None:
+            self.connection = RemoteHost.get(self.host, self.command)
+            self.connection.add(self)
+        self.lock.acquire()
+        try:
+            chunks = self.chunks
+            self.chunks = []
+        finally:
+            self.lock.release()
+        ret = []
+        for i in range(len(chunks)):
+            if not isinstance(chunks[i], tuple):
+                # The rest of the old file
+                if self.partial and not self.resync:
+                    ret.append(self.partial.rstrip("\r"))
+                self.partial = ""
+                self.resync = False
+                self.position = 0
+                self.events.append((self.fileName, chunks[i]))
+                # Continue with the new file next time
+                self.lock.acquire()
+                try:
+                    self.chunks[:0] = chunks[i + 1:]
+                finally:
+                    self.lock.release()
+                break
+            offset, data = chunks[i]
+            if offset != self.position:
+                # Started from the end of the file, or data was skipped
+                self.partial = ""
+                self.resync = True
+            if self.encoding is None:
+                self.encoding = detectEncoding(data)
+            self.position = offset + len(data)
+            lines = (self.partial + data).split("\n")
+            self.partial = lines.pop()
+            if self.resync:
+                if lines:
+                    del lines[0]
+                    self.resync = False
+                else:
+                    self.partial = ""
+            if "\r" in data:
+                lines = [line.rstrip("\r") for line in lines]
+            ret.extend(lines)
+        if not self.started and chunks:
+            self.started = True
+            ret = ret[max(0, len(ret) - Tail.LINES_BACK):]
+        if ret:
+            self.changed = True
+        return ret
+        
+    def takeEvents(self):
+        """Return the rotations and truncations noticed, like 
+        Tail.takeEvents()."""
+        events = self.events
+        self.events = []
+        return events
+        
+    def close(self):
+        """Stop following the file."""
+        if self.connection is not None:
+            self.connection.remove(self)
+        
+    def getFileName(self):
+        return self.fileName
+        
+    def getFileNames(self):
+        return [self.fileName]
+        
+    def getEncoding(self):
+        """Return the encoding of the file."""
+        return self.encoding or "utf-8"
+        
+    def isChanged(self):
+        changed = self.changed
+        self.changed = False
+        return changed
+        
+    def holding(self):
+        """Return True if complete lines are held back. Remote files never 
+        hold lines back."""
+        return False
+        
+    def offset(self):
+        """Return the offset after the last complete line read."""
+        return self.position - len(self.partial)
+        
+    def indexStep(self, budget):
+        """Remote files are not indexed."""
+        return True
+
+
+def openTail(fileName, rotated = False, encoding = None, 
+    command = RemoteHost.COMMAND):
+    """Return a RemoteTail for remote file names like host:/path, or a Tail 
+    for local ones."""
+    if RemoteHost.split(fileName) is not None:
+        return RemoteTail(fileName, encoding, command)
+    return Tail(fileName, rotated, encoding)
+
+
+class Watcher:
+
+    """
+    Change notification through Linux inotify.
+    
+    Each file is watched together with its directory, so files replaced by 
+    log rotation are noticed too. Wait for fileno() to become readable (with 
+    a socket notifier or select), then call process() to run the callbacks 
+    of the files that have changed.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVE_SELF = 0x00000800
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+    
+    FILE_EVENTS = IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF
+    DIR_EVENTS = IN_CREATE | IN_MOVED_TO
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        if ctypes is None or not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+            use_errno = True)
+        self.fd = self.libc.inotify_init1(Watcher.IN_NONBLOCK | 
+            Watcher.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.callbacks = {}
+        self.fileWatches = {}
+        self.dirWatches = {}
+        
+    def fileno(self):
+        return self.fd
+        
+    def addWatch(self, path, mask):
+        """Add an inotify watch; return the watch descriptor or -1."""
+        return self.libc.inotify_add_watch(self.fd, path, mask)
+        
+    def add(self, fileName, callback):
+        """Call callback whenever fileName changes. Return False if the file 
+        cannot be watched."""
+        fileWd = self.addWatch(fileName, Watcher.FILE_EVENTS)
+        if fileWd < 0:
+            return False
+        dirWd = self.addWatch(os.path.dirname(os.path.abspath(fileName)), 
+            Watcher.DIR_EVENTS)
+        if dirWd < 0:
+            return False
+        self.callbacks.setdefault(fileName, []).append(callback)
+        self.fileWatches.setdefault(fileWd, []).append(fileName)
+        self.dirWatches.setdefault(dirWd, []).append(fileName)
+        return True
+        
+    def remove(self, fileName, callback):
+        """Stop calling callback on changes to fileName."""
+        callbacks = self.callbacks.get(fileName, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if callbacks:
+            return
+        self.callbacks.pop(fileName, None)
+        for watches in (self.fileWatches, self.dirWatches):
+            for wd, fileNames in watches.items():
+                if fileName in fileNames:
+                    fileNames.remove(fileName)
+                if not fileNames:
+                    del watches[wd]
+                    self.libc.inotify_rm_watch(self.fd, wd)
+        
+    def process(self):
+        """Read pending events and run the callbacks of changed files.
+        Callbacks run at most once per call."""
+        changed = {}
+        header = Watcher.EVENT_HEADER
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                if sys.exc_info()[1].errno == errno.EINTR:
+                    continue
+                break
+            if not data:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = header.unpack_from(data, pos)
+                name = data[pos + header.size:pos + header.size + length]
+                name = name.rstrip("\0")
+                pos = pos + header.size + length
+                if mask & Watcher.IN_Q_OVERFLOW:
+                    for fileName in self.callbacks:
+                        changed[fileName] = True
+                elif wd in self.fileWatches:
+                    for fileName in self.fileWatches[wd]:
+                        changed[fileName] = True
+                    if mask & Watcher.IN_IGNORED:
+                        del self.fileWatches[wd]
+                elif wd in self.dirWatches:
+                    for fileName in self.dirWatches[wd]:
+                        if os.path.basename(fileName) == name:
+                            # Rotated: watch the new file as well
+                            self.rewatch(fileName)
+                            changed[fileName] = True
+        for fileName in changed:
+            for callback in self.callbacks.get(fileName, [])[:]:
+                callback()
+                
+    def rewatch(self, fileName):
+        """Watch the file that has replaced fileName."""
+        fileWd = self.addWatch(fileName, Watcher.FILE_EVENTS)
+        if fileWd >= 0:
+            fileNames = self.fileWatches.setdefault(fileWd, [])
+            if fileName not in fileNames:
+                fileNames.append(fileName)
+                
+    def close(self):
+        os.close(self.fd)
+        self.fd = -1
+
+
+class PollScheduler:
+
+    """
+    Polling of files that cannot be watched, at intervals following their 
+    activity.
+    
+    Each polled object has a poll function, the number of files a poll 
+    checks, and a progress function returning a number that changes when 
+    new data is found; polls may complete later, in a worker thread. The 
+    next poll times are kept in a priority queue. Polling after new data is 
+    found again in MIN_INTERVAL, idle polling backs off exponentially up to 
+    MAX_INTERVAL. The visible object is polled at least every 
+    VISIBLE_INTERVAL. At most maxRate files are checked per second: polls 
+    above the limit are put off in the order they are due. polls counts the 
+    files checked, and fixedPolls the files checked by polling everything 
+    every START_INTERVAL seconds.
+    """
+
+    MIN_INTERVAL = 0.5
+    START_INTERVAL = 1.0
+    MAX_INTERVAL = 16.0
+    VISIBLE_INTERVAL = 0.5
+    BACKOFF = 2.0
+    MAX_RATE = 100
+
+    def __init__(self, maxRate = MAX_RATE, now = None):
+        if now is None:
+            now = time.time()
+        self.maxRate = maxRate
+        self.tokens = float(maxRate)
+        self.last = now
+        # Heap of (due, sequence, key); entries rescheduled since are stale
+        self.queue = []
+        self.entries = {}
+        self.sequence = 0
+        self.visible = None
+        self.polls = 0
+        self.fixedPolls = 0.0
+        self.deferrals = 0
+        
+    def add(self, key, poll, progress, cost = 1, now = None):
+        """Start polling key with poll(), START_INTERVAL seconds from now."""
+        if now is None:
+            now = time.time()
+        self.entries[key] = {"poll": poll, "progress": progress, 
+            "cost": cost, "interval": PollScheduler.START_INTERVAL, 
+            "seen": progress()}
+        self.schedule(key, now + PollScheduler.START_INTERVAL)
+        
+    def remove(self, key):
+        """Stop polling key."""
+        self.entries.pop(key, None)
+        if self.visible is key:
+            self.visible = None
+            
+    def setVisible(self, key, now = None):
+        """Poll key, the object shown, at least every VISIBLE_INTERVAL 
+        seconds, starting now."""
+        if now is None:
+            now = time.time()
+        self.visible = key
+        entry = self.entries.get(key)
+        if entry is not None and \
+            entry["due"] > now + PollScheduler.VISIBLE_INTERVAL:
+            entry["interval"] = PollScheduler.VISIBLE_INTERVAL
+            self.schedule(key, now)
+            
+    def schedule(self, key, due):
+        """Poll key next at time due."""
+        self.sequence = self.sequence + 1
+        entry = self.entries[key]
+        entry["due"] = due
+        entry["sequence"] = self.sequence
+        heapq.heappush(self.queue, (due, self.sequence, key))
+        
+    def head(self):
+        """Return the entry polled next, or None. Drop stale queue items."""
+        while self.queue:
+            due, sequence, key = self.queue[0]
+            entry = self.entries.get(key)
+            if entry is not None and entry["sequence"] == sequence:
+                return entry
+            heapq.heappop(self.queue)
+        return None
+        
+    def refill(self, now):
+        """Add the checks allowed since the last call."""
+        elapsed = max(0.0, now - self.last)
+        self.last = now
+        self.tokens = min(float(self.maxRate), 
+            self.tokens + elapsed * self.maxRate)
+        cost = 0
+        for entry in self.entries.values():
+            cost = cost + entry["cost"]
+        self.fixedPolls = self.fixedPolls + \
+            elapsed * cost / PollScheduler.START_INTERVAL
+            
+    def run(self, now = None):
+        """Poll the objects that are due, within the rate limit."""
+        if now is None:
+            now = time.time()
+        self.refill(now)
+        due = []
+        while True:
+            entry = self.head()
+            if entry is None or entry["due"] > now:
+                break
+            if entry["cost"] > self.tokens and self.tokens < self.maxRate:
+                self.deferrals = self.deferrals + len([item for item in 
+                    self.queue if item[0] <= now])
+                break
+            key = heapq.heappop(self.queue)[2]
+            self.tokens = self.tokens - entry["cost"]
+            self.polls = self.polls + entry["cost"]
+            seen = entry["progress"]()
+            if seen != entry["seen"]:
+                entry["interval"] = PollScheduler.MIN_INTERVAL
+            else:
+                entry["interval"] = min(PollScheduler.MAX_INTERVAL, 
+                    entry["interval"] * PollScheduler.BACKOFF)
+            entry["seen"] = seen
+            if key is self.visible:
+                entry["interval"] = min(entry["interval"], 
+                    PollScheduler.VISIBLE_INTERVAL)
+            self.schedule(key, now + entry["interval"])
+            due.append(entry["poll"])
+        for poll in due:
+            poll()
+            
+    def wait(self, now = None):
+        """Return the number of seconds until run() has polls to do, or 
+        None if nothing is polled."""
+        if now is None:
+            now = time.time()
+        entry = self.head()
+        if entry is None:
+            return None
+        wait = entry["due"] - now
+        if entry["cost"] > self.tokens and self.tokens < self.maxRate:
+            # Until the rate limit allows the poll
+            wait = max(wait, (min(entry["cost"], self.maxRate) - 
+                self.tokens) / self.maxRate - (now - self.last))
+        return max(0.0, wait)
+
+
+class Classifier:
+
+    """
+    Line severity classifier.
+    
+    All error and warning keywords are compiled into a single case 
+    insensitive regular expression, so a line is classified in one pass.
+    """
+
+    NORMAL = 0
+    WARNING = 1
+    ERROR = 2
+    
+    WARNINGS = "warn, can't, cannot, unable"
+    ERRORS = "error, fail, badness"
+    
+    parser = None
+
+    def __init__(self, errors, warnings):
+        errors = [e for e in errors if e]
+        warnings = [w for w in warnings if w]
+        self.errors = errors
+        self.warnings = warnings
+        self.parsed = {}
+        self.regex = None
+        self.errorRegex = None
+        if errors:
+            self.errorRegex = re.compile(Classifier.alternatives(errors), 
+                re.IGNORECASE)
+        alternatives = []
+        if errors:
+            alternatives.append("(?P<error>%s)" % 
+                Classifier.alternatives(errors))
+        if warnings:
+            alternatives.append("(?P<warning>%s)" % 
+                Classifier.alternatives(warnings))
+        if alternatives:
+            self.regex = re.compile("|".join(alternatives), re.IGNORECASE)
+            
+    def alternatives(keywords):
+        """Return a regular expression matching any of the keywords."""
+        keywords = list(keywords)
+        keywords.sort(key = len, reverse = True)
+        return "|".join([re.escape(k) for k in keywords])
+    alternatives = staticmethod(alternatives)
+    
+    def keywords(text):
+        """Return the list of keywords in a comma separated string."""
+        ret = []
+        for s in text.split(","):
+            if s.strip():
+                ret.append(s.strip())
+        return ret
+    keywords = staticmethod(keywords)
+    
+    def withParser(self, parser):
+        """Return a FieldClassifier with the same keywords for lines parsed 
+        by parser, or self if parser is None. The same one is returned for 
+        each parser, so stores can tell when it changes."""
+        if parser is None:
+            return self
+        ret = self.parsed.get(parser)
+        if ret is None:
+            ret = self.parsed.setdefault(parser, 
+                FieldClassifier(self.errors, self.warnings, parser))
+        return ret
+        
+    def parse(self, line):
+        """Return the fields of a line. Plain lines have none."""
+        return None
+        
+    def parseLines(self, lines):
+        """Return the fields of lines, or None if they are not parsed."""
+        return None
+    
+    def classifyLines(self, lines, records = None):
+        """Return the severities of lines in a byte array. records are 
+        ignored: plain lines are classified by their keywords."""
+        return array("B", [self.classify(line) for line in lines])
+        
+    def classify(self, line):
+        """Return the severity of a line."""
+        if self.regex is None:
+            return Classifier.NORMAL
+        match = self.regex.search(line)
+        if match is None:
+            return Classifier.NORMAL
+        if match.lastgroup == "error":
+            return Classifier.ERROR
+        # Errors win over warnings, even if they come later in the line
+        if self.errorRegex is not None and \
+            self.errorRegex.search(line, match.start() + 1):
+            return Classifier.ERROR
+        return Classifier.WARNING
+        
+    def select(self, lines, severity):
+        """Return the indexes of the lines at least as severe as severity.
+        
+        A line with an error keyword is an error, and one with a warning 
+        keyword at least a warning, so the lines are found by searching for 
+        the keywords in all lines at once, lowercased: much faster than 
+        matching the regular expression line by line. Keywords other than 
+        ASCII are left to classify()."""
+        if severity <= Classifier.NORMAL:
+            return range(len(lines))
+        keywords = self.errors
+        if severity <= Classifier.WARNING:
+            keywords = keywords + self.warnings
+        try:
+            keywords = [k.encode("ascii").lower() for k in keywords]
+        except UnicodeError:
+            classify = self.classify
+            return [i for i in range(len(lines)) 
+                if classify(lines[i]) >= severity]
+        data = "\n".join(lines).lower()
+        # Start and end offsets of the lines with keywords
+        found = {}
+        for keyword in keywords:
+            pos = data.find(keyword)
+            while pos >= 0:
+                start = data.rfind("\n", 0, pos) + 1
+                end = found.get(start)
+                if end is None:
+                    end = data.find("\n", pos)
+                    if end < 0:
+                        end = len(data)
+                    found[start] = end
+                pos = data.find(keyword, end)
+        starts = found.keys()
+        starts.sort()
+        ret = []
+        index = 0
+        last = 0
+        for start in starts:
+            index = index + data.count("\n", last, start)
+            last = start
+            ret.append(index)
+        return ret
+
+
+class JsonParser:
+
+    """
+    Parser of JSON lines, like {"level": "error", "msg": "failed"}.
+    
+    Nested objects are flattened to fields like "http.status". Values other 
+    than strings are kept as JSON text.
+    """
+    
+    NAME = "json"
+    # Start of the lines that can have a level field
+    LEVEL_PREFIX = ""
+    CONSTANTS = {True: "true", False: "false", None: "null"}
+    
+    def flatten(value, prefix, record):
+        """Add the members of a JSON object to record."""
+        for key, item in value.items():
+            key = prefix + key.encode("utf-8")
+            kind = type(item)
+            # Most values are strings and numbers
+            if kind is unicode:
+                record[key] = item.encode("utf-8")
+            elif kind is int or kind is long:
+                record[key] = str(item)
+            elif kind is dict:
+                JsonParser.flatten(item, key + ".", record)
+            elif kind is bool or item is None:
+                record[key] = JsonParser.CONSTANTS[item]
+            else:
+                record[key] = json.dumps(item)
+    flatten = staticmethod(flatten)
+    
+    def parse(self, line):
+        """Return the fields of a line as a dictionary, or None if it is not 
+        a JSON object."""
+        if not line.lstrip().startswith("{"):
+            return None
+        try:
+            value = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(value, dict):
+            return None
+        record = {}
+        JsonParser.flatten(value, "", record)
+        return record
+        
+
+class SyslogParser:
+
+    """
+    Parser of syslog lines, in RFC 5424 or RFC 3164 format.
+    
+    The priority, if present, gives the facility and the level fields; the 
+    traditional format without priority is the one of syslog files.
+    """
+    
+    NAME = "syslog"
+    # Only the priority gives a level
+    LEVEL_PREFIX = "<"
+    LEVELS = ["emerg", "alert", "crit", "err", "warning", "notice", "info", 
+        "debug"]
+    RFC5424 = re.compile(r"<(\d{1,3})>1 (\S+) (\S+) (\S+) (\S+) (\S+) "
+        r"(-|(?:\[(?:[^\]\\\"]|\\.|\"(?:[^\"\\]|\\.)*\")*\])+) ?(.*)")
+    RFC5424_FIELDS = ["time", "host", "program", "pid", "msgid", "data", 
+        "message"]
+    RFC3164 = re.compile(r"(?:<(\d{1,3})>)?(\w{3} [ \d]\d \d\d:\d\d:\d\d) "
+        r"(\S+) ([^\s:\[]+)(?:\[(\d+)\])?: ?(.*)")
+    RFC3164_FIELDS = ["time", "host", "program", "pid", "message"]
+    
+    def parse(self, line):
+        """Return the fields of a line as a dictionary, or None if it is not 
+        a syslog line."""
+        match = SyslogParser.RFC5424.match(line)
+        names = SyslogParser.RFC5424_FIELDS
+        if match is None:
+            match = SyslogParser.RFC3164.match(line)
+            names = SyslogParser.RFC3164_FIELDS
+            if match is None:
+                return None
+        record = {}
+        values = match.groups()
+        for i in range(len(names)):
+            # "-" stands for a missing value in RFC 5424
+            if values[i + 1] is not None and values[i + 1] != "-":
+                record[names[i]] = values[i + 1]
+        if values[0] is not None:
+            priority = int(values[0])
+            record["facility"] = str(priority >> 3)
+            record["level"] = SyslogParser.LEVELS[priority & 7]
+        return record
+        
+
+class LogfmtParser:
+
+    """
+    Parser of logfmt lines, like level=warn msg="disk full" used=97.
+    """
+    
+    NAME = "logfmt"
+    LEVEL_PREFIX = ""
+    PAIR = re.compile(r'\s*([^\s="]+)=("(?:[^"\\]|\\.)*"|[^\s"]*)(?=\s|$)')
+    ESCAPE = re.compile(r"\\(.)")
+    
+    def parse(self, line):
+        """Return the fields of a line as a dictionary, or None if it is not 
+        made of key=value pairs."""
+        record = {}
+        pos = 0
+        end = len(line.rstrip())
+        match = LogfmtParser.PAIR.match
+        while pos < end:
+            pair = match(line, pos)
+            if pair is None:
+                return None
+            key, value = pair.groups()
+            if value.startswith('"'):
+                value = LogfmtParser.ESCAPE.sub(r"\1", value[1:-1])
+            record[key] = value
+            pos = pair.end()
+        if not record:
+            return None
+        return record
+
+
+PARSERS = [JsonParser(), SyslogParser(), LogfmtParser()]
+DETECT_LINES = 20
+
+
+def detectParser(lines):
+    """Return the parser of PARSERS that can parse at least four in five of 
+    the last DETECT_LINES non-empty lines, or None."""
+    sample = [line for line in lines[-DETECT_LINES:] if line.strip()]
+    if not sample:
+        return None
+    for parser in PARSERS:
+        parsed = len([line for line in sample 
+            if parser.parse(line) is not None])
+        if parsed * 5 >= len(sample) * 4:
+            return parser
+    return None
+
+
+class FieldClassifier(Classifier):
+
+    """
+    Severity classifier of parsed lines.
+    
+    The level field of a line gives its severity, like "error" or "warn", 
+    or a number as in Bunyan (50 is an error, 40 a warning). Lines without a 
+    level are classified by their keywords.
+    """
+    
+    LEVEL_FIELDS = ["level", "lvl", "severity", "loglevel", "levelname", 
+        "log.level"]
+    LEVELS = {"emerg": Classifier.ERROR, "emergency": Classifier.ERROR, 
+        "alert": Classifier.ERROR, "crit": Classifier.ERROR, 
+        "critical": Classifier.ERROR, "fatal": Classifier.ERROR, 
+        "panic": Classifier.ERROR, "err": Classifier.ERROR, 
+        "error": Classifier.ERROR, "severe": Classifier.ERROR, 
+        "warn": Classifier.WARNING, "warning": Classifier.WARNING, 
+        "notice": Classifier.NORMAL, "info": Classifier.NORMAL, 
+        "information": Classifier.NORMAL, "debug": Classifier.NORMAL, 
+        "trace": Classifier.NORMAL, "verbose": Classifier.NORMAL}
+    
+    def __init__(self, errors, warnings, parser):
+        Classifier.__init__(self, errors, warnings)
+        self.parser = parser
+        
+    def level(record):
+        """Return the severity given by the level field of record, or None 
+        if there is none."""
+        if record is None:
+            return None
+        for name in FieldClassifier.LEVEL_FIELDS:
+            value = record.get(name)
+            if value is None:
+                continue
+            severity = FieldClassifier.LEVELS.get(value.strip('"').lower())
+            if severity is not None:
+                return severity
+            try:
+                number = float(value)
+            except ValueError:
+                continue
+            if number >= 50:
+                return Classifier.ERROR
+            if number >= 40:
+                return Classifier.WARNING
+            return Classifier.NORMAL
+        return None
+    level = staticmethod(level)
+        
+    def parse(self, line):
+        return self.parser.parse(line)
+        
+    def parseLines(self, lines):
+        parse = self.parser.parse
+        return [parse(line) for line in lines]
+        
+    def classifyLines(self, lines, records = None):
+        """Return the severities of lines in a byte array. records are the 
+        fields of the lines, if already parsed."""
+        if records is None:
+            records = self.parseLines(lines)
+        ret = array("B")
+        level = FieldClassifier.level
+        classify = Classifier.classify
+        for i in range(len(lines)):
+            severity = level(records[i])
+            if severity is None:
+                severity = classify(self, lines[i])
+            ret.append(severity)
+        return ret
+        
+    def classify(self, line):
+        """Return the severity of a line."""
+        severity = FieldClassifier.level(self.parser.parse(line))
+        if severity is None:
+            return Classifier.classify(self, line)
+        return severity
+        
+    def select(self, lines, severity):
+        """Return the indexes of the lines at least as severe as severity. 
+        Lines without a level are selected by their keywords."""
+        if severity <= Classifier.NORMAL:
+            return range(len(lines))
+        ret = []
+        rest = []
+        level = FieldClassifier.level
+        parse = self.parser.parse
+        prefix = self.parser.LEVEL_PREFIX
+        for i in range(len(lines)):
+            line = lines[i]
+            lineLevel = None
+            if line.startswith(prefix):
+                lineLevel = level(parse(line))
+            if lineLevel is None:
+                rest.append(i)
+            elif lineLevel >= severity:
+                ret.append(i)
+        if rest:
+            ret.extend([rest[i] for i in Classifier.select(self, 
+                [lines[i] for i in rest], severity)])
+            ret.sort()
+        return ret
+
+
+class FieldQuery:
+
+    """
+    Query on the fields of parsed lines, like "status>=500 host=db3".
+    
+    All the terms, separated by spaces, must hold. A term compares a field 
+    with a value: = and != compare text, <, <=, > and >= compare numbers, 
+    and ~ searches a regular expression. Values with spaces are quoted. 
+    Lines lacking the field only pass != terms.
+    """
+    
+    TERM = re.compile(r'\s*([^\s=!<>~"]+)\s*(>=|<=|!=|=|<|>|~)\s*'
+        r'("(?:[^"\\]|\\.)*"|[^\s"]+)\s*')
+    COMPARISONS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, 
+        ">=": operator.ge}
+
+    def __init__(self, text):
+        """Parse a query. Raise ValueError if it is invalid."""
+        self.text = text
+        self.terms = []
+        pos = 0
+        while pos < len(text.rstrip()):
+            match = FieldQuery.TERM.match(text, pos)
+            if match is None:
+                raise ValueError("invalid query term: %s" % 
+                    text[pos:].split()[0])
+            name, op, value = match.groups()
+            if value.startswith('"'):
+                value = LogfmtParser.ESCAPE.sub(r"\1", value[1:-1])
+            self.terms.append((name, op, FieldQuery.test(op, value)))
+            pos = match.end()
+        if not self.terms:
+            raise ValueError("empty query")
+            
+    def number(value):
+        """Return a field value as a number, or None."""
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    number = staticmethod(number)
+            
+    def test(op, value):
+        """Return a function telling if a field value satisfies a term."""
+        if op == "=":
+            return lambda v: v == value
+        if op == "!=":
+            return lambda v: v != value
+        if op == "~":
+            try:
+                regex = re.compile(value)
+            except re.error:
+                raise ValueError("invalid regular expression: %s" % 
+                    sys.exc_info()[1])
+            return lambda v: regex.search(v) is not None
+        limit = FieldQuery.number(value)
+        if limit is None:
+            raise ValueError("not a number: %s" % value)
+        compare = FieldQuery.COMPARISONS[op]
+        number = FieldQuery.number
+        
+        def ret(v):
+            v = number(v)
+            return v is not None and compare(v, limit)
+        return ret
+    test = staticmethod(test)
+    
+    def holds(term, record):
+        """Return True if a term holds for the fields of a line."""
+        name, op, test = term
+        value = None
+        if record is not None:
+            value = record.get(name)
+        if value is None:
+            return op == "!="
+        return test(value)
+    holds = staticmethod(holds)
+        
+    def match(self, record):
+        """Return True if the fields of a line satisfy the query."""
+        for term in self.terms:
+            if not FieldQuery.holds(term, record):
+                return False
+        return True
+
+
+class LineFilter:
+
+    """
+    Line filter.
+    
+    Lines pass if they match the include regular expression, do not match 
+    the exclude regular expression, are at least as severe as severity, and 
+    their fields satisfy the FieldQuery query. Empty expressions and 
+    queries are ignored, and lines are only classified if there is a 
+    severity threshold.
+    """
+
+    def __init__(self, include = "", exclude = "", 
+        severity = Classifier.NORMAL, query = ""):
+        self.include = include
+        self.exclude = exclude
+        self.severity = severity
+        self.query = query
+        self.includeRegex = None
+        self.excludeRegex = None
+        self.fieldQuery = None
+        if include:
+            self.includeRegex = re.compile(include)
+        if exclude:
+            self.excludeRegex = re.compile(exclude)
+        if query.strip():
+            self.fieldQuery = FieldQuery(query)
+            
+    def isEmpty(self):
+        return self.includeRegex is None and self.excludeRegex is None and \
+            self.severity == Classifier.NORMAL and self.fieldQuery is None
+            
+    def apply(self, lines, classifier, severities = None, queried = False):
+        """Return the lines passing the filter. If the severities of the 
+        lines are given, the lines are not classified again, and the 
+        severities of the lines passing are returned too. Lines are parsed 
+        by classifier for the query, unless queried tells that they are 
+        known to satisfy it."""
+        if severities is not None:
+            pairs = zip(lines, severities)
+            if self.fieldQuery is not None and not queried:
+                match = self.fieldQuery.match
+                parse = classifier.parse
+                pairs = [p for p in pairs if match(parse(p[0]))]
+            if self.includeRegex is not None:
+                search = self.includeRegex.search
+                pairs = [p for p in pairs if search(p[0])]
+            if self.excludeRegex is not None:
+                search = self.excludeRegex.search
+                pairs = [p for p in pairs if not search(p[0])]
+            if self.severity != Classifier.NORMAL:
+                severity = self.severity
+                pairs = [p for p in pairs if p[1] >= severity]
+            return [p[0] for p in pairs], [p[1] for p in pairs]
+        if self.includeRegex is not None:
+            search = self.includeRegex.search
+            lines = [line for line in lines if search(line)]
+        if self.excludeRegex is not None:
+            search = self.excludeRegex.search
+            lines = [line for line in lines if not search(line)]
+        if self.severity != Classifier.NORMAL:
+            lines = [lines[i] for i in classifier.select(lines, 
+                self.severity)]
+        if self.fieldQuery is not None and not queried:
+            match = self.fieldQuery.match
+            parse = classifier.parse
+            lines = [line for line in lines if match(parse(line))]
+        return lines
+
+
+class LineIndex:
+
+    """
+    Sparse line index of a file.
+
+    The file is divided into blocks of BLOCK_SIZE bytes, and the number of
+    line breaks before each block is recorded. Any line can be found by
+    reading at most one block, while the index of a 10 GB file takes about
+    1 MB. The index is built incrementally with update().
+    """
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self):
+        self.lineCounts = array(OFFSET_TYPE)
+        self.end = 0
+        self.count = 0
+
+    def update(self, fd, size, budget = None):
+        """Index file fd up to size, reading at most budget bytes. Return
+        True if the index is complete."""
+        stop = size
+        if budget is not None:
+            stop = min(size, self.end + budget)
+        fd.seek(self.end)
+        while self.end < stop:
+            data = fd.read(min(LineIndex.BLOCK_SIZE, stop - self.end))
+            if not data:
+                break
+            self.feed(self.end, data)
+        return self.end >= size
+
+    def feed(self, offset, data):
+        """Index data read from offset, as far as it extends the indexed
+        part of the file."""
+        pos = self.end - offset
+        if pos < 0 or pos >= len(data):
+            return
+        while pos < len(data):
+            block = self.end // LineIndex.BLOCK_SIZE
+            if len(self.lineCounts) <= block:
+                self.lineCounts.append(self.count)
+            length = min((block + 1) * LineIndex.BLOCK_SIZE - self.end,
+                len(data) - pos)
+            self.count = self.count + data.count("\n", pos, pos + length)
+            self.end = self.end + length
+            pos = pos + length
+
+    def offsetOf(self, fd, lineNo):
+        """Return the offset of a line (counting from 0) in the indexed part
+        of the file."""
+        lineNo = min(lineNo, self.count)
+        if lineNo <= 0:
+            return 0
+        block = bisect.bisect_left(self.lineCounts, lineNo) - 1
+        offset = block * LineIndex.BLOCK_SIZE
+        fd.seek(offset)
+        data = fd.read(min(LineIndex.BLOCK_SIZE, self.end - offset))
+        pos = -1
+        for i in range(lineNo - int(self.lineCounts[block])):
+            pos = data.find("\n", pos + 1)
+        return offset + pos + 1
+
+    def lineOf(self, fd, offset):
+        """Return the number of the line containing offset, in the indexed
+        part of the file."""
+        offset = min(offset, self.end)
+        block = offset // LineIndex.BLOCK_SIZE
+        if block >= len(self.lineCounts):
+            return self.count
+        start = block * LineIndex.BLOCK_SIZE
+        fd.seek(start)
+        return int(self.lineCounts[block]) + \
+            fd.read(offset - start).count("\n")
+
+    def readLines(self, fd, size, first, count):
+        """Read count lines starting with line number first. Return a list
+        of (offset, line) pairs."""
+        return LineIndex.readFrom(fd, size, self.offsetOf(fd, first), count)
+        
+    def readFrom(fd, size, offset, count):
+        """Read count lines starting at offset, which need not be indexed. 
+        Return a list of (offset, line) pairs."""
+        ret = []
+        fd.seek(offset)
+        data = ""
+        while len(ret) < count:
+            want = min(LineIndex.BLOCK_SIZE, size - offset - len(data))
+            chunk = ""
+            if want > 0:
+                chunk = fd.read(want)
+            if not chunk:
+                if data:
+                    # Last line without line break
+                    ret.append((offset, data.rstrip("\r")))
+                break
+            lines = (data + chunk).split("\n")
+            data = lines.pop()
+            for line in lines[:count - len(ret)]:
+                ret.append((offset, line.rstrip("\r")))
+                offset = offset + len(line) + 1
+        return ret
+    readFrom = staticmethod(readFrom)
+        
+    def startBefore(fd, offset, count):
+        """Return the offset of the line count lines before the one 
+        containing offset, reading backwards from offset a block at a time, 
+        so the file need not be indexed."""
+        pos = offset
+        while pos > 0:
+            start = max(0, pos - LineIndex.BLOCK_SIZE)
+            fd.seek(start)
+            data = fd.read(pos - start)
+            end = len(data)
+            while True:
+                end = data.rfind("\n", 0, end)
+                if end < 0:
+                    break
+                if count == 0:
+                    return start + end + 1
+                count = count - 1
+            pos = start
+        return 0
+    startBefore = staticmethod(startBefore)
+
+
+class FieldStore:
+
+    """
+    Fields of the parsed lines of a LineStore, in columns.
+    
+    Each field is a column of value codes, an array of unsigned shorts 
+    parallel to the arrays of the LineStore, with a table of its distinct 
+    values; code 0 means that the line lacks the field. A query term is 
+    tested once per distinct value, then only the codes of the lines are 
+    looked up. Fields with more than MAX_VALUES distinct values, like 
+    messages or timestamps, are dropped; queries on them parse the lines 
+    again.
+    """
+    
+    MAX_VALUES = 65535
+    
+    def __init__(self, size):
+        self.size = size
+        self.columns = {}
+        self.values = {}
+        self.codes = {}
+        self.dropped = {}
+        self.names = []
+        
+    def store(self, slot, record):
+        """Set the fields of the line in slot, growing the columns if slot 
+        is new."""
+        columns = self.columns
+        if slot == self.size:
+            for column in columns.values():
+                column.append(0)
+            self.size = self.size + 1
+        else:
+            for column in columns.values():
+                column[slot] = 0
+        if record is None:
+            return
+        for name, value in record.items():
+            column = columns.get(name)
+            if column is None:
+                if name in self.dropped:
+                    continue
+                column = array("H", [0]) * self.size
+                columns[name] = column
+                self.values[name] = []
+                self.codes[name] = {}
+                self.names.append(name)
+            codes = self.codes[name]
+            code = codes.get(value)
+            if code is None:
+                values = self.values[name]
+                if len(values) >= FieldStore.MAX_VALUES:
+                    self.drop(name)
+                    continue
+                values.append(intern(value))
+                code = len(values)
+                codes[value] = code
+            column[slot] = code
+            
+    def drop(self, name):
+        """Stop keeping the values of a field."""
+        del self.columns[name]
+        del self.values[name]
+        del self.codes[name]
+        self.dropped[name] = True
+        
+    def select(self, query, numbers, capacity, parseLines):
+        """Return the line numbers passing a FieldQuery, from a sorted list 
+        of line numbers. parseLines(numbers) returns the fields of lines 
+        whose columns were dropped."""
+        for term in query.terms:
+            if not numbers:
+                break
+            name, op, test = term
+            column = self.columns.get(name)
+            if column is not None:
+                passing = array("B", [op == "!="])
+                passing.extend([test(v) for v in self.values[name]])
+                numbers = [n for n in numbers 
+                    if passing[column[n % capacity]]]
+            elif name in self.dropped:
+                records = parseLines(numbers)
+                holds = FieldQuery.holds
+                numbers = [numbers[i] for i in range(len(numbers)) 
+                    if holds(term, records[i])]
+            elif op != "!=":
+                # No line has the field
+                numbers = []
+        return numbers
+        
+
+class LineStore:
+
+    """
+    Lines read from a file.
+    
+    The last capacity lines are kept in a ring buffer of arrays: the file 
+    offset and the length of each line, and its severity. The text of a 
+    line is read back from the file when needed, so a line takes 13 bytes. 
+    The text of the newest cacheLines lines, and of the lines that are not 
+    in the file (such as lines of rotated or merged files, or of a file 
+    replaced since) is kept in a cache of interned strings. Lines are 
+    numbered in the order they were added: first is the number of the oldest 
+    line kept, end is one more than the number of the newest.
+    
+    When the classifier changes, the lines numbered below stale still have 
+    their old severities. They are classified again newest first, by 
+    reclassify() in slices, and by select() as far as it reaches. The 
+    fields of parsed lines are kept in a FieldStore, for select() to 
+    answer field queries without parsing the lines again.
+    """
+
+    CAPACITY = 1000000
+    CACHE_LINES = 1000
+    READ_SIZE = 1024 * 1024
+    MAX_GAP = 64 * 1024
+    RECLASSIFY_LINES = 1000
+    NO_LENGTH = -1
+
+    def __init__(self, capacity = CAPACITY, cacheLines = CACHE_LINES):
+        self.capacity = capacity
+        self.cacheLines = cacheLines
+        self.offsets = array(OFFSET_TYPE)
+        self.lengths = array("i")
+        self.severities = array("B")
+        self.texts = {}
+        self.first = 0
+        self.end = 0
+        self.fd = None
+        self.inode = None
+        self.classifier = None
+        self.stale = 0
+        self.fields = None
+        self.lock = threading.Lock()
+        
+    def starts(offset, lines):
+        """Return the offsets of lines read from offset, followed by the 
+        offset after them."""
+        ret = array(OFFSET_TYPE, [offset])
+        for line in lines:
+            offset = offset + len(line) + 1
+            ret.append(offset)
+        return ret
+    starts = staticmethod(starts)
+        
+    def __len__(self):
+        return self.end - self.first
+        
+    def append(self, lines, classifier, severities, starts = None, 
+        fileName = None, inode = None, records = None):
+        """Add lines and their severities given by classifier. If starts is 
+        given, the last len(starts) - 1 lines are in file fileName with 
+        inode number inode, at the offsets in starts. records are the 
+        fields of parsed lines."""
+        self.lock.acquire()
+        try:
+            if self.classifier is None:
+                self.classifier = classifier
+            if records is not None and self.fields is None:
+                self.fields = FieldStore(len(self.offsets))
+            fields = self.fields
+            known = 0
+            if starts is not None and len(starts) > 1:
+                if inode != self.inode:
+                    self.openFile(fileName, inode)
+                if self.fd is not None:
+                    known = len(starts) - 1
+            unknown = len(lines) - known
+            cached = len(lines) - self.cacheLines
+            end = self.end
+            for i in range(len(lines)):
+                if i < unknown:
+                    offset = 0
+                    length = LineStore.NO_LENGTH
+                else:
+                    offset = starts[i - unknown]
+                    length = int(starts[i - unknown + 1] - offset) - 1
+                if len(self.offsets) < self.capacity:
+                    slot = len(self.offsets)
+                    self.offsets.append(offset)
+                    self.lengths.append(length)
+                    self.severities.append(severities[i])
+                else:
+                    if self.end - self.first >= self.capacity:
+                        self.texts.pop(self.first, None)
+                        self.first = self.first + 1
+                    slot = self.end % self.capacity
+                    self.offsets[slot] = offset
+                    self.lengths[slot] = length
+                    self.severities[slot] = severities[i]
+                if fields is not None:
+                    fields.store(slot, records and records[i])
+                if i >= cached or length == LineStore.NO_LENGTH:
+                    self.texts[self.end] = intern(lines[i])
+                self.end = self.end + 1
+            # Forget the text of lines that have left the cache, unless 
+            # they cannot be read back
+            for n in range(max(self.first, end - self.cacheLines), 
+                self.end - self.cacheLines):
+                if self.lengths[n % self.capacity] != LineStore.NO_LENGTH:
+                    self.texts.pop(n, None)
+            if classifier is not self.classifier:
+                # Classified before the classifier has changed
+                self.stale = self.end
+        finally:
+            self.lock.release()
+            
+    def setClassifier(self, classifier):
+        """Use classifier from now on. Return True if it is a new one: the 
+        lines in the store are then stale."""
+        self.lock.acquire()
+        try:
+            if classifier is self.classifier:
+                return False
+            stale = self.classifier is not None
+            self.classifier = classifier
+            if stale:
+                self.stale = self.end
+            return stale
+        finally:
+            self.lock.release()
+            
+    def classify(self, start, end):
+        """Classify the lines numbered from start to end again. Call with 
+        the lock held."""
+        numbers = range(start, end)
+        severities = self.classifier.classifyLines(self.read(numbers))
+        for i in range(len(numbers)):
+            self.severities[numbers[i] % self.capacity] = severities[i]
+            
+    def reclassify(self, budget):
+        """Classify stale lines again, newest first, RECLASSIFY_LINES at a 
+        time, for about budget seconds. Return True if no stale lines are 
+        left."""
+        stop = time.time() + budget
+        while True:
+            self.lock.acquire()
+            try:
+                if self.stale <= self.first:
+                    return True
+                start = max(self.first, 
+                    self.stale - LineStore.RECLASSIFY_LINES)
+                self.classify(start, self.stale)
+                self.stale = start
+            finally:
+                self.lock.release()
+            if time.time() >= stop:
+                return False
+            
+    def openFile(self, fileName, inode):
+        """Read lines back from file fileName from now on, if its inode 
+        number is still inode. Call with the lock held."""
+        if self.inode is not None:
+            self.forget()
+        self.inode = inode
+        self.fd = None
+        try:
+            fd = open(fileName, "rb")
+            if os.fstat(fd.fileno())[1] == inode:
+                self.fd = fd
+            else:
+                fd.close()
+        except (IOError, OSError, TypeError):
+            pass
+            
+    def forget(self):
+        """Stop reading back the lines added so far: the file has been 
+        replaced or truncated. They are only kept while they are cached. 
+        Call with the lock held."""
+        self.first = max(self.first, self.end - self.cacheLines)
+        for n in range(self.first, self.end):
+            self.lengths[n % self.capacity] = LineStore.NO_LENGTH
+        for n in list(self.texts.keys()):
+            if n < self.first:
+                del self.texts[n]
+                
+    def truncated(self):
+        """The file has been truncated: forget where the lines added so far 
+        were."""
+        self.lock.acquire()
+        try:
+            self.forget()
+        finally:
+            self.lock.release()
+            
+    def read(self, numbers):
+        """Return the text of lines, given by a sorted list of line numbers. 
+        Lines close to each other in the file are read at once. Call with 
+        the lock held."""
+        ret = []
+        offsets = self.offsets
+        lengths = self.lengths
+        capacity = self.capacity
+        i = 0
+        while i < len(numbers):
+            text = self.texts.get(numbers[i])
+            if text is not None:
+                ret.append(text)
+                i = i + 1
+                continue
+            slot = numbers[i] % capacity
+            start = offsets[slot]
+            stop = start + lengths[slot]
+            j = i + 1
+            while j < len(numbers) and stop - start < LineStore.READ_SIZE:
+                if numbers[j] in self.texts:
+                    break
+                slot = numbers[j] % capacity
+                if offsets[slot] < stop or \
+                    offsets[slot] - stop > LineStore.MAX_GAP:
+                    break
+                stop = offsets[slot] + lengths[slot]
+                j = j + 1
+            self.fd.seek(int(start))
+            data = self.fd.read(int(stop - start))
+            for n in numbers[i:j]:
+                slot = n % capacity
+                pos = int(offsets[slot] - start)
+                ret.append(data[pos:pos + lengths[slot]].rstrip("\r"))
+            i = j
+        return ret
+        
+    def newest(self, count):
+        """Return the newest count lines, their severities, and the offsets 
+        of as many of the last of them as are in the file one after the 
+        other, followed by the offset after them, like append() takes them 
+        (or None)."""
+        self.lock.acquire()
+        try:
+            numbers = range(max(self.first, self.end - count), self.end)
+            lines = self.read(numbers)
+            severities = array("B", 
+                [self.severities[n % self.capacity] for n in numbers])
+            starts = []
+            if self.fd is not None:
+                for n in reversed(numbers):
+                    slot = n % self.capacity
+                    if self.lengths[slot] == LineStore.NO_LENGTH:
+                        break
+                    stop = self.offsets[slot] + self.lengths[slot] + 1
+                    if starts and starts[-1] != stop:
+                        break
+                    if not starts:
+                        starts.append(stop)
+                    starts.append(self.offsets[slot])
+            starts.reverse()
+            if not starts:
+                return lines, severities, None
+            return lines, severities, array(OFFSET_TYPE, starts)
+        finally:
+            self.lock.release()
+            
+    def newestLine(self):
+        """Return the inode number of the file, and the offset and the text 
+        of the newest line, or None if it is not in the file."""
+        self.lock.acquire()
+        try:
+            if self.end == self.first or self.fd is None:
+                return None
+            slot = (self.end - 1) % self.capacity
+            if self.lengths[slot] == LineStore.NO_LENGTH:
+                return None
+            return self.inode, int(self.offsets[slot]), \
+                self.read([self.end - 1])[0]
+        finally:
+            self.lock.release()
+            
+    def select(self, lineFilter, start, end, want = None):
+        """Return the last want lines numbered from start to end that pass 
+        lineFilter, and their severities. Stale lines in the range are 
+        classified first. Severity thresholds and field queries are checked 
+        before any text is read."""
+        self.lock.acquire()
+        try:
+            start = max(start, self.first)
+            end = min(end, self.end)
+            if start < self.stale:
+                self.classify(start, min(end, self.stale))
+                if end >= self.stale:
+                    self.stale = start
+            numbers = range(start, max(start, end))
+            if lineFilter.severity != Classifier.NORMAL:
+                severities = self.severities
+                capacity = self.capacity
+                threshold = lineFilter.severity
+                numbers = [n for n in numbers 
+                    if severities[n % capacity] >= threshold]
+            queried = lineFilter.fieldQuery is not None and \
+                self.fields is not None
+            if queried:
+                parse = self.classifier.parse
+                numbers = self.fields.select(lineFilter.fieldQuery, numbers, 
+                    self.capacity, lambda numbers: 
+                        [parse(line) for line in self.read(numbers)])
+            if want is not None and lineFilter.includeRegex is None and \
+                lineFilter.excludeRegex is None and \
+                (lineFilter.fieldQuery is None or queried):
+                numbers = numbers[max(0, len(numbers) - want):]
+            lines = self.read(numbers)
+            severities = [self.severities[n % self.capacity] 
+                for n in numbers]
+        finally:
+            self.lock.release()
+        lines, severities = lineFilter.apply(lines, self.classifier, 
+            severities, queried)
+        if want is not None:
+            lines = lines[max(0, len(lines) - want):]
+            severities = severities[max(0, len(severities) - want):]
+        return lines, severities
+
+
+class Snapshot:
+
+    """
+    Newest lines of a monitored file, saved at the end of a session.
+    
+    The next session can show them at once, and resume reading the file 
+    after offset. Lines are saved with their severities and the keywords 
+    they were classified with; starts holds the offsets of the last 
+    len(starts) - 1 of them, like LineStore.append() takes them.
+    """
+
+    def __init__(self, lines, severities, starts = None, inode = None, 
+        offset = None, errors = [], warnings = []):
+        self.lines = lines
+        self.severities = severities
+        self.starts = starts
+        self.inode = inode
+        self.offset = offset
+        self.errors = errors
+        self.warnings = warnings
+        
+    def save(self, path):
+        """Save the snapshot, replacing the file at path atomically."""
+        starts = self.starts
+        if starts is None:
+            starts = []
+        f = open(path + ".new", "wb")
+        try:
+            f.write("inode %d\noffset %d\n" % (self.inode, self.offset))
+            f.write("errors %s\n" % ",".join(self.errors))
+            f.write("warnings %s\n" % ",".join(self.warnings))
+            f.write("starts %s\n" % " ".join([str(int(s)) for s in starts]))
+            f.write("severities %s\n" % 
+                "".join([str(s) for s in self.severities]))
+            f.write("lines\n")
+            for line in self.lines:
+                f.write(line + "\n")
+        finally:
+            f.close()
+        os.rename(path + ".new", path)
+        
+    def load(path):
+        """Return the snapshot saved at path, or None if there is none."""
+        try:
+            f = open(path, "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            fields = {}
+            pos = 0
+            while True:
+                end = data.index("\n", pos)
+                line = data[pos:end]
+                pos = end + 1
+                if line == "lines":
+                    break
+                key, value = (line + " ").split(" ", 1)
+                fields[key] = value.strip()
+            lines = data[pos:].split("\n")[:-1]
+            severities = array("B", [int(s) for s in fields["severities"]])
+            starts = None
+            if fields["starts"]:
+                starts = array(OFFSET_TYPE, 
+                    [int(s) for s in fields["starts"].split()])
+            if len(severities) != len(lines) or \
+                (starts is not None and len(starts) > len(lines) + 1):
+                return None
+            return Snapshot(lines, severities, starts, int(fields["inode"]), 
+                int(fields["offset"]), Classifier.keywords(fields["errors"]), 
+                Classifier.keywords(fields["warnings"]))
+        except (IOError, KeyError, ValueError):
+            return None
+    load = staticmethod(load)
+
+
+class PlainMember:
+
+    """Uncompressed member of a rotation set."""
+
+    def __init__(self, path):
+        self.fd = open(path, "rb")
+        
+    def getSize(self):
+        return os.fstat(self.fd.fileno())[6]
+        
+    def measure(self, budget = None):
+        return True
+        
+    def read(self, offset, length):
+        self.fd.seek(offset)
+        return self.fd.read(length)
+
+
+class CompressedMember:
+
+    """
+    Compressed member of a rotation set, decompressed as a stream.
+    
+    The size of the member is only known after it has been decompressed 
+    once. gzip decompressor states are saved every SEEK_SPACING bytes of 
+    output, so reading at any offset decompresses at most SEEK_SPACING bytes 
+    before it. bzip2 and xz decompressors cannot be saved: reading back 
+    further than WINDOW bytes starts again from the beginning of the member.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    SEEK_SPACING = 16 * 1024 * 1024
+    WINDOW = 1024 * 1024
+
+    def __init__(self, path, kind):
+        self.kind = kind
+        self.fd = open(path, "rb")
+        self.size = None
+        self.seekOffsets = []
+        self.seekPoints = []
+        self.rewind()
+        
+    def isAvailable(kind):
+        """Return True if members compressed with kind can be read."""
+        return {"gz": zlib, "bz2": bz2, "xz": lzma}[kind] is not None
+    isAvailable = staticmethod(isAvailable)
+        
+    def newDecompressor(self):
+        if self.kind == "gz":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.kind == "bz2":
+            return bz2.BZ2Decompressor()
+        else:
+            return lzma.LZMADecompressor()
+        
+    def rewind(self):
+        """Start decompressing from the beginning of the member."""
+        self.decompressor = self.newDecompressor()
+        self.inPos = 0
+        self.outPos = 0
+        self.buffer = ""
+        
+    def restore(self, offset):
+        """Prepare for reading at offset: continue from the current state if 
+        possible, otherwise from the last seek point before offset."""
+        i = bisect.bisect_right(self.seekOffsets, offset) - 1
+        if self.outPos <= offset and (i < 0 or 
+            self.seekOffsets[i] <= self.outPos + len(self.buffer)):
+            return
+        if i < 0:
+            self.rewind()
+        else:
+            self.inPos, decompressor = self.seekPoints[i]
+            self.decompressor = decompressor.copy()
+            self.outPos = self.seekOffsets[i]
+            self.buffer = ""
+        
+    def advance(self):
+        """Append the next chunk of output to the buffer. Return False at the 
+        end of the member."""
+        self.fd.seek(self.inPos)
+        data = self.fd.read(CompressedMember.CHUNK_SIZE)
+        if not data:
+            self.size = self.outPos + len(self.buffer)
+            return False
+        self.inPos = self.inPos + len(data)
+        out = [self.buffer]
+        try:
+            while data:
+                try:
+                    out.append(self.decompressor.decompress(data))
+                except EOFError:
+                    # The next stream starts at the chunk boundary
+                    self.decompressor = self.newDecompressor()
+                    continue
+                data = self.decompressor.unused_data
+                if data:
+                    # Concatenated streams
+                    self.decompressor = self.newDecompressor()
+        except Exception:
+            # Corrupt or trailing data ends the member
+            self.inPos = os.fstat(self.fd.fileno())[6]
+        self.buffer = "".join(out)
+        end = self.outPos + len(self.buffer)
+        if self.kind == "gz" and (not self.seekOffsets or 
+            end >= self.seekOffsets[-1] + CompressedMember.SEEK_SPACING):
+            self.seekOffsets.append(end)
+            self.seekPoints.append((self.inPos, self.decompressor.copy()))
+        return True
+        
+    def getSize(self):
+        return self.size
+        
+    def measure(self, budget = None):
+        """Decompress up to budget bytes towards the end of the member, to 
+        learn its size. Return True if the size is known."""
+        if self.size is None:
+            if self.seekOffsets and \
+                self.outPos + len(self.buffer) < self.seekOffsets[-1]:
+                self.restore(self.seekOffsets[-1])
+            stop = None
+            if budget is not None:
+                stop = self.outPos + len(self.buffer) + budget
+            while self.size is None and (stop is None or self.outPos < stop):
+                self.outPos = self.outPos + len(self.buffer)
+                self.buffer = ""
+                self.advance()
+        return self.size is not None
+        
+    def read(self, offset, length):
+        self.restore(offset)
+        while self.outPos + len(self.buffer) < offset + length:
+            # Keep at most WINDOW bytes before offset, for reading back
+            cut = min(offset - self.outPos, len(self.buffer)) - \
+                CompressedMember.WINDOW
+            if cut > 0:
+                self.buffer = self.buffer[cut:]
+                self.outPos = self.outPos + cut
+            if not self.advance():
+                break
+        start = offset - self.outPos
+        return self.buffer[start:start + length]
+
+
+class RotationSet:
+
+    """
+    A log file and its rotated siblings (name.1, name.2.gz and so on), read 
+    like a single file, oldest first.
+    
+    Compressed members are decompressed lazily, and their sizes are only 
+    known after they have been decompressed once: size() covers the members 
+    up to the first one of unknown size, and measure() extends it.
+    """
+
+    SUFFIXES = ("gz", "bz2", "xz")
+
+    def __init__(self, fileName, rotated = True):
+        self.fileName = fileName
+        self.rotated = rotated
+        self.pos = 0
+        self.scan()
+        
+    def kindOf(fileName):
+        """Return the compression of a file from its suffix, or "" if it is 
+        not compressed."""
+        suffix = os.path.splitext(fileName)[1][1:]
+        if suffix in RotationSet.SUFFIXES:
+            return suffix
+        return ""
+    kindOf = staticmethod(kindOf)
+        
+    def siblings(fileName):
+        """Return the readable rotated siblings of a file, oldest first, as 
+        (path, kind) pairs."""
+        directory, base = os.path.split(os.path.abspath(fileName))
+        found = []
+        for name in os.listdir(directory):
+            if not name.startswith(base + "."):
+                continue
+            number, dot, kind = name[len(base) + 1:].partition(".")
+            if not number.isdigit() or (kind and 
+                (kind not in RotationSet.SUFFIXES or 
+                not CompressedMember.isAvailable(kind))):
+                continue
+            found.append((int(number), os.path.join(directory, name), kind))
+        found.sort()
+        found.reverse()
+        return [(path, kind) for number, path, kind in found]
+    siblings = staticmethod(siblings)
+        
+    def openMember(path, kind):
+        if kind:
+            return CompressedMember(path, kind)
+        return PlainMember(path)
+    openMember = staticmethod(openMember)
+        
+    def scan(self):
+        """Find the members of the set, again after rotation."""
+        self.members = []
+        if self.rotated:
+            for path, kind in RotationSet.siblings(self.fileName):
+                try:
+                    self.members.append(RotationSet.openMember(path, kind))
+                except IOError:
+                    # Rotated away meanwhile
+                    pass
+        self.members.append(RotationSet.openMember(self.fileName, 
+            RotationSet.kindOf(self.fileName)))
+        
+    def isRotated(self):
+        """Return True if the file has been replaced since the last scan()."""
+        try:
+            return os.stat(self.fileName)[1] != \
+                os.fstat(self.members[-1].fd.fileno())[1]
+        except OSError:
+            return False
+        
+    def size(self):
+        """Return the size of the members up to the first one of unknown 
+        size."""
+        total = 0
+        for member in self.members:
+            size = member.getSize()
+            if size is None:
+                break
+            total = total + size
+        return total
+        
+    def measure(self, budget = None):
+        """Decompress up to budget bytes to learn the size of the first 
+        member of unknown size. Return True if all sizes are known."""
+        for member in self.members:
+            if not member.measure(budget):
+                return False
+        return True
+        
+    def seek(self, offset):
+        self.pos = offset
+        
+    def tell(self):
+        return self.pos
+        
+    def read(self, length):
+        ret = []
+        start = 0
+        for member in self.members:
+            size = member.getSize()
+            if size is not None and self.pos >= start + size:
+                start = start + size
+                continue
+            data = member.read(self.pos - start, length)
+            ret.append(data)
+            self.pos = self.pos + len(data)
+            length = length - len(data)
+            if length <= 0 or size is None or self.pos < start + size:
+                break
+            start = start + size
+        return "".join(ret)
+        
+    def lastLines(self, count):
+        """Return the last count lines of the rotated siblings of the file. 
+        Members are read from their ends, in windows growing four-fold until 
+        they contain enough lines."""
+        lines = []
+        for member in self.members[-2::-1]:
+            want = count - len(lines)
+            if want <= 0:
+                break
+            member.measure()
+            size = member.getSize()
+            length = Tail.BLOCK_SIZE
+            while True:
+                start = max(0, size - length)
+                memberLines = member.read(start, size - start).split("\n")
+                if memberLines[-1] == "":
+                    del memberLines[-1]
+                if start > 0:
+                    # Partial first line
+                    del memberLines[0]
+                if start == 0 or len(memberLines) >= want:
+                    break
+                length = length * 4
+            lines = memberLines[max(0, len(memberLines) - want):] + lines
+        return [line.rstrip("\r") for line in lines]
+
+
+class Bookmark:
+
+    """
+    Line of a log file marked by the user.
+    
+    Bookmarks hold the place of the line by its byte offset, with the inode 
+    number of the file and the start of the line, so they cost nothing 
+    to keep and need no line index to jump to. See locate().
+    """
+
+    MAX_TEXT = 256
+
+    def __init__(self, fileName, inode, offset, stamp, text):
+        self.fileName = fileName
+        self.inode = inode
+        self.offset = offset
+        self.stamp = stamp
+        self.text = text
+        
+    def getFileName(self):
+        return self.fileName
+        
+    def at(fileName, offset):
+        """Return a bookmark of the line of a file containing offset. Raise 
+        IOError or OSError if the file cannot be read."""
+        fileName = os.path.abspath(fileName)
+        inode = os.stat(fileName)[1]
+        fd = RotationSet(fileName, False)
+        start = LineIndex.startBefore(fd, offset, 0)
+        fd.seek(start)
+        text = fd.read(Bookmark.MAX_TEXT).split("\n")[0].rstrip("\r")
+        return Bookmark(fileName, inode, start, time.time(), text)
+    at = staticmethod(at)
+        
+    def matches(self, path, kind):
+        """Return True if the bookmarked line is at its offset in file path 
+        compressed with kind."""
+        start = max(0, self.offset - 1)
+        try:
+            member = RotationSet.openMember(path, kind)
+            try:
+                data = member.read(start, self.offset - start + 
+                    len(self.text))
+            finally:
+                member.fd.close()
+        except (IOError, OSError):
+            return False
+        return data == "\n"[:self.offset - start] + self.text
+        
+    def locate(self):
+        """Return the path of the file holding the bookmarked line now, or 
+        None if it is gone. After rotation, the line is looked for in the 
+        rotated siblings, newest first: by inode number, then for copies and 
+        compressed siblings by content, decompressing up to the offset."""
+        candidates = [(self.fileName, RotationSet.kindOf(self.fileName))]
+        siblings = RotationSet.siblings(self.fileName)
+        siblings.reverse()
+        candidates.extend(siblings)
+        for path, kind in candidates:
+            try:
+                inode = os.stat(path)[1]
+            except OSError:
+                continue
+            if inode == self.inode and self.matches(path, kind):
+                return path
+        if not self.text:
+            # Empty lines are everywhere
+            return None
+        for path, kind in candidates:
+            if self.matches(path, kind):
+                return path
+        return None
+
+
+class BookmarkStore:
+
+    """
+    Bookmarks of all files, oldest first, saved in a file of one line per 
+    bookmark, with the text of the line escaped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.bookmarks = []
+        self.load()
+        
+    def load(self):
+        """Read the saved bookmarks. Unreadable lines are skipped."""
+        try:
+            f = open(self.path, "rb")
+        except IOError:
+            return
+        try:
+            for line in f:
+                try:
+                    stamp, inode, offset, fileName, text = \
+                        line[:-1].split("\t", 4)
+                    self.bookmarks.append(Bookmark(fileName, int(inode), 
+                        int(offset), float(stamp), 
+                        text.decode("string_escape")))
+                except ValueError:
+                    pass
+        finally:
+            f.close()
+            
+    def save(self):
+        """Save the bookmarks, replacing the file atomically."""
+        f = open(self.path + ".new", "wb")
+        try:
+            for bookmark in self.bookmarks:
+                f.write("%.3f\t%d\t%d\t%s\t%s\n" % (bookmark.stamp, 
+                    bookmark.inode, bookmark.offset, bookmark.fileName, 
+                    bookmark.text.encode("string_escape")))
+        finally:
+            f.close()
+        os.rename(self.path + ".new", self.path)
+        
+    def add(self, bookmark):
+        """Add a bookmark and save. Raise IOError or OSError if the 
+        bookmarks cannot be saved."""
+        self.bookmarks.append(bookmark)
+        self.save()
+        
+    def remove(self, bookmark):
+        """Remove a bookmark and save."""
+        self.bookmarks.remove(bookmark)
+        self.save()
+
+
+def searchRange(regex, fd, start, end, chunkSize):
+    """Search the lines of file fd between offsets start and end, reading 
+    chunkSize bytes at a time. start must be at the beginning of a line. 
+    Return arrays of match offsets and lengths, and the offset after the 
+    last complete line searched."""
+    starts = array(OFFSET_TYPE)
+    lengths = array("L")
+    pos = start
+    while pos < end:
+        fd.seek(pos)
+        data = fd.read(min(chunkSize, end - pos))
+        if not data:
+            break
+        cut = data.rfind("\n") + 1
+        if cut == 0:
+            if len(data) < chunkSize:
+                # Incomplete last line
+                break
+            cut = len(data)
+        for match in regex.finditer(data, 0, cut):
+            starts.append(pos + match.start())
+            lengths.append(match.end() - match.start())
+        pos = pos + cut
+    return starts, lengths, pos
+
+
+def searchPart(args):
+    """Search part of a file in a separate process. See Searcher."""
+    fileName, pattern, flags, start, end = args
+    fd = open(fileName, "rb")
+    try:
+        starts, lengths, pos = searchRange(re.compile(pattern, flags), fd, 
+            start, end, Searcher.CHUNK_SIZE)
+    finally:
+        fd.close()
+    return starts.tostring(), lengths.tostring(), pos
+    
+    
+def splitRanges(fd, start, end, parts):
+    """Split the part of file fd between start and end into about equal 
+    ranges, starting at line boundaries. Return a list of (start, end) 
+    pairs."""
+    points = [start]
+    for i in range(1, parts):
+        fd.seek(start + (end - start) * i // parts)
+        fd.readline()
+        if points[-1] < fd.tell() < end:
+            points.append(fd.tell())
+    points.append(end)
+    return [(points[i], points[i + 1]) for i in range(len(points) - 1)]
+
+
+class Searcher:
+
+    """
+    Full file search.
+    
+    The file is searched in chunks of CHUNK_SIZE bytes with a compiled 
+    regular expression, in PROCESSES processes if there is a lot to search. 
+    The offsets of the matches are cached, and update() searches only the 
+    data appended since the previous call, so stepping through the matches 
+    is a lookup in the cache. A rotated or truncated file is searched again.
+    If rotated, the file is searched together with its rotated siblings, as 
+    a RotationSet, in a single process.
+    """
+
+    CHUNK_SIZE = 4 * 1024 * 1024
+    PARALLEL_SIZE = 256 * 1024 * 1024
+    PROCESSES = 4
+
+    def __init__(self, fileName, pattern, flags = 0, rotated = False):
+        self.fileName = fileName
+        self.pattern = pattern
+        self.flags = flags
+        self.rotated = rotated
+        self.regex = re.compile(pattern, flags)
+        if rotated:
+            self.fd = RotationSet(fileName)
+        else:
+            self.fd = open(fileName, "rb")
+        self.lock = threading.Lock()
+        self.reset()
+        
+    def reset(self):
+        """Forget all matches."""
+        self.starts = array(OFFSET_TYPE)
+        self.lengths = array("L")
+        self.end = 0
+        self.current = -1
+        
+    def getFileName(self):
+        return self.fileName
+        
+    def update(self):
+        """Search the data appended to the file since the last call. Can be 
+        called from any thread. Return the number of matches."""
+        self.lock.acquire()
+        try:
+            if self.rotated:
+                if self.fd.isRotated():
+                    self.fd.scan()
+                    self.reset()
+                self.fd.measure()
+                size = self.fd.size()
+            else:
+                try:
+                    if os.stat(self.fileName)[1] != \
+                        os.fstat(self.fd.fileno())[1]:
+                        self.fd.close()
+                        self.fd = open(self.fileName, "rb")
+                        self.reset()
+                except OSError:
+                    pass
+                size = os.fstat(self.fd.fileno())[6]
+            if size < self.end:
+                self.reset()
+            if multiprocessing is not None and not self.rotated and \
+                size - self.end > Searcher.PARALLEL_SIZE:
+                jobs = []
+                for start, end in splitRanges(self.fd, self.end, size, 
+                    Searcher.PROCESSES):
+                    jobs.append((self.fileName, self.pattern, self.flags, 
+                        start, end))
+                pool = multiprocessing.Pool(Searcher.PROCESSES)
+                try:
+                    for starts, lengths, pos in pool.map(searchPart, jobs):
+                        self.starts.fromstring(starts)
+                        self.lengths.fromstring(lengths)
+                        self.end = pos
+                finally:
+                    # Reap the workers, or each update leaves them behind
+                    pool.close()
+                    pool.join()
+            else:
+                starts, lengths, self.end = searchRange(self.regex, self.fd, 
+                    self.end, size, Searcher.CHUNK_SIZE)
+                self.starts.extend(starts)
+                self.lengths.extend(lengths)
+            return len(self.starts)
+        finally:
+            self.lock.release()
+            
+    def find(self, offset, backward):
+        """Return the (offset, length) of the next match after offset, or 
+        the previous one if backward, wrapping around at the ends of the 
+        file. Return None if there are no matches."""
+        count = len(self.starts)
+        if count == 0:
+            return None
+        if 0 <= self.current < count and self.starts[self.current] == offset:
+            current = self.current
+        elif backward:
+            current = bisect.bisect_left(self.starts, offset)
+        else:
+            current = bisect.bisect_right(self.starts, offset) - 1
+        if backward:
+            self.current = (current - 1) % count
+        else:
+            self.current = (current + 1) % count
+        return int(self.starts[self.current]), int(self.lengths[self.current])
+
+
+def exportPart(args):
+    """Filter part of a file in a separate process. See Exporter. Return 
+    the lines passing as one string, and their number."""
+    fileName, start, end, errors, warnings, parserName, include, exclude, \
+        severity, query = args
+    classifier = Classifier(errors, warnings)
+    for parser in PARSERS:
+        if parser.NAME == parserName:
+            classifier = classifier.withParser(parser)
+    lineFilter = LineFilter(include, exclude, severity, query)
+    ret = []
+    count = 0
+    fd = open(fileName, "rb")
+    try:
+        pos = start
+        fd.seek(pos)
+        while pos < end:
+            data = fd.read(min(Exporter.CHUNK_SIZE, end - pos))
+            if not data:
+                break
+            cut = data.rfind("\n") + 1
+            while cut == 0 and pos + len(data) < end:
+                # A line longer than a chunk
+                more = fd.read(min(Exporter.CHUNK_SIZE, 
+                    end - pos - len(data)))
+                if not more:
+                    break
+                cut = more.rfind("\n") + 1
+                if cut:
+                    cut = cut + len(data)
+                data = data + more
+            if cut == 0:
+                # The last line of the file, without a line break
+                cut = len(data)
+            fd.seek(pos + cut)
+            pos = pos + cut
+            lines = data[:cut].split("\n")
+            if data[cut - 1] == "\n":
+                lines.pop()
+            lines = lineFilter.apply(lines, classifier)
+            if lines:
+                ret.append("\n".join(lines) + "\n")
+                count = count + len(lines)
+    finally:
+        fd.close()
+    return "".join(ret), count
+    
+    
+def ignoreInterrupt():
+    """Leave interrupts to the parent process, which cancels the export: 
+    a worker process stopped by one would never return its result."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Exporter:
+
+    """
+    Export of the lines of whole files passing a LineFilter.
+    
+    Files are split into ranges of about RANGE_SIZE bytes starting at line 
+    boundaries, and the ranges are filtered by exportPart(), in PROCESSES 
+    processes if there are more than PARALLEL_SIZE bytes to filter. Results 
+    are written in file and offset order as they arrive, with at most 
+    WINDOW ranges in flight, so memory use stays bounded. With several 
+    files, the lines of each are headed by its name, like by tail(1).
+    
+    With since, only the lines stamped since then are exported. The files 
+    must be in time order: the first such line is found by binary search on 
+    the syslog style timestamps, so older data is not read. Files without 
+    timestamps near the start are exported whole, as are all files when 
+    since is in the previous year, as the timestamps have no year.
+    
+    run() can be cancelled from another thread. done and total tell the 
+    progress in bytes, and lines the number of lines written.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    RANGE_SIZE = 8 * 1024 * 1024
+    PARALLEL_SIZE = 16 * 1024 * 1024
+    PROCESSES = 4
+    WINDOW = 2 * PROCESSES
+    PROBE_SIZE = 64 * 1024
+    PROBE_LINES = 100
+    PROGRESS_TIMEOUT = 0.2
+
+    def __init__(self, fileNames, outputName, lineFilter, classifier, 
+        since = None):
+        self.fileNames = fileNames
+        self.outputName = outputName
+        self.lineFilter = lineFilter
+        self.classifier = classifier
+        self.since = None
+        if since is not None:
+            now = time.localtime()
+            then = time.localtime(since)
+            if then[0] == now[0]:
+                self.since = Merger.stamp(then[1], then[2], then[3], then[4], 
+                    then[5])
+        self.cancelled = False
+        self.done = 0
+        self.total = 0
+        self.lines = 0
+        
+    def cancel(self):
+        """Stop run() at the next range."""
+        self.cancelled = True
+        
+    def probe(self, fd):
+        """Return the timestamp of the first stamped line of the next 
+        PROBE_LINES lines of file fd, and the offset of the line. Return 
+        None, None if there is none."""
+        for i in range(Exporter.PROBE_LINES):
+            offset = fd.tell()
+            line = fd.readline()
+            if not line:
+                break
+            stamp = Merger.parse(line, None)
+            if stamp is not None:
+                return stamp, offset
+        return None, None
+        
+    def findStart(self, fd, size):
+        """Return the offset of the first line of file fd stamped since 
+        the start of the export. Lines without timestamp go with the line 
+        before them."""
+        fd.seek(0)
+        if self.probe(fd)[0] is None:
+            return 0
+        low = 0
+        high = size
+        while high - low > Exporter.PROBE_SIZE:
+            middle = (low + high) // 2
+            fd.seek(middle)
+            fd.readline()
+            stamp, offset = self.probe(fd)
+            if stamp is not None and stamp < self.since:
+                low = offset
+            else:
+                high = middle
+        fd.seek(low)
+        pos = low
+        while pos < size:
+            line = fd.readline()
+            if not line:
+                break
+            stamp = Merger.parse(line, None)
+            if stamp is not None and stamp >= self.since:
+                return pos
+            pos = pos + len(line)
+        return size
+        
+    def plan(self):
+        """Return the jobs of exportPart(), and set total."""
+        jobs = []
+        lineFilter = self.lineFilter
+        for fileName in self.fileNames:
+            fd = open(fileName, "rb")
+            try:
+                size = os.fstat(fd.fileno())[6]
+                start = 0
+                if self.since is not None:
+                    start = self.findStart(fd, size)
+                fd.seek(0)
+                parser = detectParser(fd.read(Exporter.PROBE_SIZE).split(
+                    "\n")[:-1][:DETECT_LINES])
+                parserName = None
+                if parser is not None:
+                    parserName = parser.NAME
+                parts = max(1, (size - start) // Exporter.RANGE_SIZE)
+                for begin, end in splitRanges(fd, start, size, parts):
+                    jobs.append((fileName, begin, end, 
+                        self.classifier.errors, self.classifier.warnings, 
+                        parserName, lineFilter.include, lineFilter.exclude, 
+                        lineFilter.severity, lineFilter.query))
+                    self.total = self.total + end - begin
+            finally:
+                fd.close()
+        return jobs
+        
+    def run(self):
+        """Filter the files and write the lines passing. Return False if 
+        cancelled: the output is removed then. Raise IOError or OSError if 
+        a file cannot be read or written."""
+        jobs = self.plan()
+        output = open(self.outputName, "wb")
+        pool = None
+        try:
+            try:
+                if multiprocessing is not None and \
+                    self.total > Exporter.PARALLEL_SIZE:
+                    pool = multiprocessing.Pool(Exporter.PROCESSES, 
+                        ignoreInterrupt)
+                pending = collections.deque()
+                written = [None]
+                for job in jobs:
+                    if self.cancelled:
+                        break
+                    if pool is None:
+                        self.write(output, job, exportPart(job), written)
+                        continue
+                    pending.append((job, pool.apply_async(exportPart, 
+                        (job,))))
+                    if len(pending) >= Exporter.WINDOW:
+                        job, result = pending.popleft()
+                        self.write(output, job, result.get(), written)
+                while pending and not self.cancelled:
+                    job, result = pending.popleft()
+                    self.write(output, job, result.get(), written)
+            finally:
+                output.close()
+                if pool is not None:
+                    # terminate() can hang while results wait in the pipe; 
+                    # at most WINDOW ranges are left to finish
+                    pool.close()
+                    pool.join()
+        except:
+            os.unlink(self.outputName)
+            raise
+        if self.cancelled:
+            os.unlink(self.outputName)
+            return False
+        return True
+        
+    def write(self, output, job, result, written):
+        """Write the result of a job; written holds the name of the last 
+        file with lines written."""
+        data, count = result
+        if data:
+            if len(self.fileNames) > 1 and written[0] != job[0]:
+                if written[0] is not None:
+                    output.write("\n")
+                output.write("==> %s <==\n" % job[0])
+                written[0] = job[0]
+            output.write(data)
+        self.lines = self.lines + count
+        self.done = self.done + job[2] - job[1]
+
+
+class WorkerPool:
+
+    """
+    Pool of worker threads.
+    
+    Jobs are submitted with a hashable key, and a key accepts no new job 
+    until the result of the previous one has been collected, so results of 
+    the same key arrive in order. Results go through a bounded queue: 
+    workers block when it is full, until collect() makes room. A byte is 
+    written to a pipe for each result, so the GUI thread can wait for 
+    fileno() with a socket notifier.
+    """
+
+    THREADS = 4
+    MAX_RESULTS = 16
+
+    def __init__(self, threads = THREADS, maxResults = MAX_RESULTS):
+        self.jobs = Queue.Queue()
+        self.results = Queue.Queue(maxResults)
+        self.busy = {}
+        self.lock = threading.Lock()
+        self.readFd, self.writeFd = os.pipe()
+        fcntl.fcntl(self.readFd, fcntl.F_SETFL, os.O_NONBLOCK)
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target = self.run)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+            
+    def fileno(self):
+        return self.readFd
+        
+    def submit(self, key, job):
+        """Run job() in a worker thread. Return False if the previous job of 
+        key is still pending."""
+        self.lock.acquire()
+        try:
+            if key in self.busy:
+                return False
+            self.busy[key] = True
+        finally:
+            self.lock.release()
+        self.jobs.put((key, job))
+        return True
+        
+    def isBusy(self, key):
+        """Return True if a job of key is pending."""
+        return key in self.busy
+        
+    def run(self):
+        """Worker thread: run jobs until stopped."""
+        while True:
+            key, job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                result = (key, job(), None)
+            except:
+                result = (key, None, sys.exc_info()[1])
+            self.results.put(result)
+            os.write(self.writeFd, "r")
+            
+    def collect(self):
+        """Return the list of finished jobs as (key, result, exception) 
+        tuples. Their keys accept new jobs again."""
+        try:
+            while os.read(self.readFd, 4096):
+                pass
+        except OSError:
+            pass
+        ret = []
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except Queue.Empty:
+                break
+            self.lock.acquire()
+            try:
+                del self.busy[result[0]]
+            finally:
+                self.lock.release()
+            ret.append(result)
+        return ret
+        
+    def stop(self):
+        """Stop the worker threads once the queued jobs are done."""
+        for thread in self.threads:
+            self.jobs.put((None, None))
+
+
+class RateMeter:
+
+    """
+    Line rates of a file.
+    
+    Lines are counted per second and severity in ring buffers of SECONDS 
+    entries, so the memory used is fixed. Counts are added by worker threads 
+    and read by the GUI thread.
+    """
+
+    SECONDS = 120
+    RATE_SECONDS = 5
+
+    def __init__(self, seconds = SECONDS):
+        self.seconds = seconds
+        self.counts = [array("L", [0] * seconds) for i in range(3)]
+        self.now = int(time.time())
+        self.lock = threading.Lock()
+        
+    def advance(self, now):
+        """Move on to second now, clearing the seconds passed. Call with the 
+        lock held."""
+        if now <= self.now:
+            return
+        for second in range(max(self.now + 1, now - self.seconds + 1), 
+            now + 1):
+            slot = second % self.seconds
+            for counts in self.counts:
+                counts[slot] = 0
+        self.now = now
+        
+    def add(self, counts, now = None):
+        """Add the number of lines of each severity read at time now."""
+        if now is None:
+            now = time.time()
+        now = int(now)
+        self.lock.acquire()
+        try:
+            self.advance(now)
+            if now > self.now - self.seconds:
+                slot = now % self.seconds
+                for severity in range(3):
+                    self.counts[severity][slot] = \
+                        self.counts[severity][slot] + counts[severity]
+        finally:
+            self.lock.release()
+            
+    def history(self, severity = None, seconds = None, now = None):
+        """Return the number of lines of a severity, or of all lines, in 
+        each of the last seconds complete seconds, oldest first."""
+        if now is None:
+            now = time.time()
+        now = int(now)
+        if seconds is None or seconds >= self.seconds:
+            seconds = self.seconds - 1
+        self.lock.acquire()
+        try:
+            self.advance(now)
+            ret = []
+            for second in range(now - seconds, now):
+                slot = second % self.seconds
+                if severity is None:
+                    ret.append(int(self.counts[0][slot] + 
+                        self.counts[1][slot] + self.counts[2][slot]))
+                else:
+                    ret.append(int(self.counts[severity][slot]))
+            return ret
+        finally:
+            self.lock.release()
+            
+    def rate(self, severity = None, seconds = RATE_SECONDS, now = None):
+        """Return the number of lines of a severity, or of all lines, per 
+        second over the last seconds complete seconds."""
+        history = self.history(severity, seconds, now)
+        return sum(history) / float(max(1, len(history)))
+
+
+class Profiler:
+
+    """
+    Timers, counters and histograms of the hot paths.
+    
+    Disabled by default. Instrumented code tests enabled before anything 
+    else, so it costs one attribute lookup then. Stages are timed by the 
+    laps of a ProfileTimer. Histograms count values in power of two buckets: 
+    bucket b holds the values from b to 2 * b - 1. Updated by worker threads 
+    and read by the GUI thread.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+        
+    def reset(self):
+        """Clear the data recorded."""
+        self.lock.acquire()
+        try:
+            # Name: [count, total, maximum]
+            self.timers = {}
+            self.counters = {}
+            # Name: {bucket: count}
+            self.histograms = {}
+            self.since = time.time()
+        finally:
+            self.lock.release()
+        
+    def timer(self):
+        """Return a ProfileTimer started now."""
+        return ProfileTimer(self)
+        
+    def time(self, name, seconds):
+        """Record seconds spent in stage name."""
+        self.lock.acquire()
+        try:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] = timer[0] + 1
+                timer[1] = timer[1] + seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+        finally:
+            self.lock.release()
+            
+    def add(self, name, count):
+        """Add count to counter name."""
+        self.lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + count
+        finally:
+            self.lock.release()
+            
+    def sample(self, name, value):
+        """Count value in histogram name."""
+        bucket = 0
+        if value > 0:
+            bucket = 1 << (int(value).bit_length() - 1)
+        self.lock.acquire()
+        try:
+            histogram = self.histograms.setdefault(name, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        finally:
+            self.lock.release()
+            
+    def stats(self):
+        """Return the data recorded as a dictionary of plain types."""
+        self.lock.acquire()
+        try:
+            timers = {}
+            for name, (count, total, maximum) in self.timers.items():
+                timers[name] = {"count": count, "total": total, 
+                    "max": maximum}
+            histograms = {}
+            for name, histogram in self.histograms.items():
+                histograms[name] = dict([(str(bucket), count) for 
+                    bucket, count in histogram.items()])
+            return {"seconds": time.time() - self.since, "timers": timers, 
+                "counters": dict(self.counters), "histograms": histograms}
+        finally:
+            self.lock.release()
+            
+    def save(self, path):
+        """Write the data recorded to path, as JSON."""
+        f = open(path, "w")
+        try:
+            json.dump(self.stats(), f, indent = 1, sort_keys = True)
+            f.write("\n")
+        finally:
+            f.close()
+
+
+class ProfileTimer:
+
+    """Timer of consecutive stages: each lap records the time since the 
+    previous one, or since the timer was started."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.last = time.time()
+        
+    def lap(self, name):
+        """Record the time spent in stage name."""
+        now = time.time()
+        self.profiler.time(name, now - self.last)
+        self.last = now
+
+
+# Instrumentation of the hot paths, shared by the engine and the views
+PROFILER = Profiler()
+
+
+def profiled(path, function, *args):
+    """Call function with the profiler enabled and under cProfile. Write 
+    the cProfile stats to path and the profiler data to path.json when it 
+    returns. cProfile sees the calling thread only: the stages run by 
+    worker threads are in the profiler data."""
+    PROFILER.enabled = True
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args)
+    finally:
+        profile.dump_stats(path)
+        PROFILER.save(path + ".json")
+
+
+def renderLines(lines, classifier, severities = None, encoding = None):
+    """Return lines as rich text, coloured by severity. If the severities of 
+    the lines are given, the lines are not classified again. With an 
+    encoding, the lines are decoded to Unicode, replacing invalid bytes."""
+    ret = []
+    if severities is None:
+        severities = classifier.classifyLines(lines)
+    for i in range(len(lines)):
+        severity = severities[i]
+        line = lines[i]
+        if encoding is not None:
+            line = line.decode(encoding, "replace")
+        line = line.replace("&", "&amp;").replace("<", "&lt;").replace(">", 
+            "&gt;")
+        if severity == Classifier.ERROR:
+            line = '<font color="red">' + line + '</font>'
+        elif severity == Classifier.WARNING:
+            line = '<font color="blue">' + line + '</font>'
+        ret.append(line)
+    return ret
+
+
+def renderSeparator(text):
+    """Return a separator line labelled with text, as rich text."""
+    return '<font color="blue">' + text + " " + "-" * 56 + '</font>'
+
+
+TERMINAL_COLORS = {Classifier.ERROR: "\033[31m", 
+    Classifier.WARNING: "\033[34m"}
+TERMINAL_RESET = "\033[0m"
+POLL_INTERVAL = 1.0
+
+
+def transcode(lines, encoding, output):
+    """Return lines converted from encoding to output encoding, replacing 
+    characters that cannot be converted. Lines are returned as they are if 
+    the encodings are the same, or the output encoding is unknown."""
+    output = encodingName(output)
+    if output is None or encodingName(encoding) == output:
+        return lines
+    return [line.decode(encoding, "replace").encode(output, "replace") 
+        for line in lines]
+    
+
+def renderTerminal(lines, classifier):
+    """Return lines coloured by severity with ANSI escape sequences."""
+    ret = []
+    classify = classifier.classify
+    for line in lines:
+        severity = classify(line)
+        if severity == Classifier.NORMAL:
+            ret.append(line)
+        else:
+            ret.append(TERMINAL_COLORS[severity] + line + TERMINAL_RESET)
+    return ret
+    
+    
+def configPath():
+    """Return the path of the configuration file written by the GUI."""
+    kdeHome = os.environ.get("KDEHOME", os.path.expanduser("~/.kde"))
+    return os.path.join(kdeHome, "share", "config", "lovirc")
+    
+    
+def readFilters(fileName):
+    """Return the error and warning keywords of a configuration file, as 
+    comma separated strings. Keywords not configured are None."""
+    filters = {}
+    try:
+        f = open(fileName, "rb")
+    except IOError:
+        return None, None
+    try:
+        group = None
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                group = line
+            elif group == "[Filters]" and "=" in line:
+                key, value = line.split("=", 1)
+                filters[key.strip()] = value.strip()
+    finally:
+        f.close()
+    return filters.get("filterErrors"), filters.get("filterWarnings")
+    
+    
+def exportFiles(fileNames, outputName, hours, lineFilter, classifier):
+    """Export the lines of files passing a filter, stamped in the last 
+    hours if not None, showing the progress on a terminal. Return the exit 
+    status."""
+    for fileName in fileNames:
+        if RemoteHost.split(fileName) is not None:
+            sys.stderr.write("lovi: cannot export remote file %s\n" % 
+                fileName)
+            return 1
+    since = None
+    if hours is not None:
+        since = time.time() - 3600 * hours
+    exporter = Exporter(fileNames, outputName, lineFilter, classifier, since)
+    result = []
+    
+    def run():
+        try:
+            result.append(exporter.run())
+        except (IOError, OSError):
+            result.append(sys.exc_info()[1])
+            
+    thread = threading.Thread(target = run)
+    thread.start()
+    progress = sys.stderr.isatty()
+    try:
+        # Joined with a timeout, so Ctrl-C is seen
+        while thread.isAlive():
+            thread.join(Exporter.PROGRESS_TIMEOUT)
+            if progress and exporter.total:
+                sys.stderr.write("\rlovi: exporting: %d%%" % 
+                    (100 * exporter.done // exporter.total))
+    except KeyboardInterrupt:
+        exporter.cancel()
+        thread.join()
+    if progress:
+        sys.stderr.write("\n")
+    if result[0] is False:
+        sys.stderr.write("lovi: export cancelled\n")
+        return 1
+    if result[0] is not True:
+        sys.stderr.write("lovi: cannot export: %s\n" % result[0])
+        return 1
+    sys.stderr.write("lovi: exported %d lines to %s\n" % 
+        (exporter.lines, outputName))
+    return 0
+
+
+def headless(args):
+
+    """Follow files on the terminal, coloured by severity. args are the 
+    command line arguments, without --headless. Return the exit status."""
+
+    parser = optparse.OptionParser(prog = "lovi", 
+        usage = "%prog --headless [options] file|host:file...")
+    parser.add_option("-n", "--lines", type = "int", default = 10,
+        help = "show the last N lines first (at most %d)" % Tail.LINES_BACK)
+    parser.add_option("-e", "--errors", 
+        help = "comma separated error keywords")
+    parser.add_option("-w", "--warnings", 
+        help = "comma separated warning keywords")
+    parser.add_option("-r", "--rotated", action = "store_true", 
+        default = False, help = "start with lines from rotated siblings")
+    parser.add_option("-m", "--merge", action = "store_true", 
+        default = False, help = "merge the files into one timeline")
+    parser.add_option("-g", "--include", default = "", 
+        help = "show only lines matching a regular expression")
+    parser.add_option("-v", "--exclude", default = "", 
+        help = "hide lines matching a regular expression")
+    parser.add_option("-s", "--severity", type = "choice", default = "all",
+        choices = ["all", "warning", "error"], 
+        help = "show only lines at least this severe: all, warning or error")
+    parser.add_option("-q", "--query", default = "", 
+        help = "show only JSON, syslog or logfmt lines with these fields, "
+        "like 'status>=500 host=db3'")
+    parser.add_option("--encoding", 
+        help = "encoding of the files (default: detect)")
+    parser.add_option("--remote-command", default = RemoteHost.COMMAND, 
+        help = "command running a shell command on %h, for host:file names "
+        "(default: %default)")
+    parser.add_option("--export", metavar = "FILE", 
+        help = "write the lines of the whole files passing the filter to "
+        "FILE, and exit")
+    parser.add_option("--since", type = "float", metavar = "HOURS", 
+        help = "export only the lines stamped in the last HOURS hours")
+    parser.add_option("--profile", metavar = "FILE", 
+        help = "write cProfile stats to FILE, and timers of the stages to "
+        "FILE.json, on exit")
+    parser.add_option("--color", action = "store_true", dest = "color", 
+        default = sys.stdout.isatty(), help = "colour lines (default on a "
+        "terminal)")
+    parser.add_option("--no-color", action = "store_false", dest = "color", 
+        help = "do not colour lines")
+    options, fileNames = parser.parse_args(args)
+    if not fileNames:
+        parser.error("no files to monitor")
+    if options.encoding is not None and \
+        encodingName(options.encoding) is None:
+        parser.error("unknown encoding: %s" % options.encoding)
+    # Set for terminals only: bytes written elsewhere are left as they are
+    output = getattr(sys.stdout, "encoding", None)
+        
+    # Keywords from the command line, the configuration file, or defaults
+    errors, warnings = readFilters(configPath())
+    if options.errors is not None:
+        errors = options.errors
+    if options.warnings is not None:
+        warnings = options.warnings
+    if errors is None:
+        errors = Classifier.ERRORS
+    if warnings is None:
+        warnings = Classifier.WARNINGS
+    classifier = Classifier(Classifier.keywords(errors), 
+        Classifier.keywords(warnings))
+    try:
+        lineFilter = LineFilter(options.include, options.exclude, 
+            {"all": Classifier.NORMAL, "warning": Classifier.WARNING, 
+            "error": Classifier.ERROR}[options.severity], options.query)
+    except re.error:
+        parser.error("invalid regular expression: %s" % sys.exc_info()[1])
+    except ValueError:
+        parser.error("invalid query: %s" % sys.exc_info()[1])
+    if options.export is not None:
+        return exportFiles(fileNames, options.export, options.since, 
+            lineFilter, classifier)
+    elif options.since is not None:
+        parser.error("--since is for --export only")
+        
+    tails = []
+    for fileName in fileNames:
+        try:
+            tails.append(openTail(fileName, options.rotated, 
+                options.encoding, options.remote_command))
+        except IOError:
+            sys.stderr.write("lovi: cannot open %s: %s\n" % 
+                (fileName, sys.exc_info()[1].strerror))
+            return 1
+    if options.merge:
+        tails = [Merger(tails)]
+    shown = [None]
+    # Classifiers of the files, for their format detected from the first 
+    # lines
+    classifiers = {}
+    # Lines read from the files, telling the scheduler which are active
+    received = {}
+    
+    def show(tail):
+        # Remote files start when their first data arrives
+        first = not tail.started
+        timer = PROFILER.enabled and PROFILER.timer()
+        lines = tail.follow()
+        if timer:
+            timer.lap("follow")
+            PROFILER.sample("lines per tick", len(lines))
+        received[tail] = received.get(tail, 0) + len(lines) + \
+            tail.holding()
+        if tail not in classifiers and lines:
+            classifiers[tail] = classifier.withParser(detectParser(lines))
+        tailClassifier = classifiers.get(tail, classifier)
+        lines = lineFilter.apply(lines, tailClassifier)
+        if first:
+            lines = lines[max(0, len(lines) - options.lines):]
+        if timer:
+            timer.lap("filter")
+        if lines:
+            if len(tails) > 1 and shown[0] is not tail:
+                # Name the file, like tail(1)
+                sys.stdout.write("==> %s <==\n" % tail.getFileName())
+                shown[0] = tail
+            if options.color:
+                lines = renderTerminal(lines, tailClassifier)
+            lines = transcode(lines, tail.getEncoding(), output)
+            if timer:
+                timer.lap("render")
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+            if timer:
+                timer.lap("write")
+        for fileName, event in tail.takeEvents():
+            sys.stderr.write("lovi: %s: file %s\n" % (fileName, event))
+        
+    def run():
+        for tail in tails:
+            show(tail)
+            
+        # Change notification: inotify where available, polling otherwise
+        try:
+            watcher = Watcher()
+        except OSError:
+            watcher = None
+        polled = []
+        for tail in tails:
+            for fileName in tail.getFileNames():
+                if (watcher is None or not watcher.add(fileName, 
+                    lambda tail = tail: show(tail))) and tail not in polled:
+                    polled.append(tail)
+        if options.merge:
+            # Release the lines held back for reordering too
+            polled = tails
+        scheduler = PollScheduler()
+        for tail in polled:
+            scheduler.add(tail, lambda tail = tail: show(tail), 
+                lambda tail = tail: received.get(tail, 0), 
+                len(tail.getFileNames()))
+        try:
+            while True:
+                timeout = scheduler.wait()
+                if watcher is None:
+                    time.sleep(timeout)
+                elif select.select([watcher], [], [], timeout)[0]:
+                    watcher.process()
+                scheduler.run()
+        except KeyboardInterrupt:
+            pass
+            
+    if options.profile:
+        profiled(options.profile, run)
+    else:
+        run()
+    return 0
@@ -34,16 +34,38 @@ copyright holder.
 """
 
 import datetime
+import hashlib
+import mmap
 import os
+import re
 import sys
-from qt import QButtonGroup, QFont, QFrame, QGridLayout, QIconSet, QLabel, \
-    QLineEdit, QPopupMenu, QRadioButton, QSize, QString, QStringList, Qt, \
-    QTabWidget, QTextEdit, QTimer, QVBoxLayout, QVButtonGroup, QWhatsThis, \
-    QWidget, SIGNAL
+import threading
+import time
+
+# lovicore is installed with the application data
+sys.path.append("/usr/share/lovi")
+from lovicore import Bookmark, BookmarkStore, Classifier, detectEncoding, \
+    detectParser, encodingName, Exporter, headless, LineFilter, LineIndex, \
+    LineStore, Merger, openTail, PollScheduler, profiled, PROFILER, \
+    RateMeter, RemoteHost, renderLines, renderSeparator, RotationSet, \
+    Searcher, Snapshot, Tail, Watcher, WorkerPool
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    # Follow files on the terminal, without loading Qt and KDE
+    args = sys.argv[1:]
+    args.remove("--headless")
+    sys.exit(headless(args))
+    
+from qt import QButtonGroup, QCheckBox, QColor, QColorGroup, QComboBox, \
+    QFont, QFrame, QGridLayout, QIconSet, QLabel, QLineEdit, QListView, \
+    QListViewItem, QPainter, QPixmap, QPopupMenu, QRadioButton, \
+    QScrollBar, QSize, QSocketNotifier, QSpinBox, QString, QStringList, \
+    Qt, QTabWidget, QTextEdit, QTimer, QVBoxLayout, QVButtonGroup, \
+    QWhatsThis, QWidget, SIGNAL
 from kdecore import i18n, KApplication, KAboutData, KCmdLineArgs, \
-    KConfigSkeleton, KGlobalSettings, KIcon, KIconLoader
-from kdeui import KConfigDialog, KDialogBase, KEdFind, KFontChooser, \
-    KMainWindow, KMessageBox, KStdAction
+    KConfigSkeleton, KGlobal, KGlobalSettings, KIcon, KIconLoader, KShortcut
+from kdeui import KAction, KConfigDialog, KDialogBase, KEdFind, \
+    KFontChooser, KGuiItem, KInputDialog, KMainWindow, KMessageBox, \
+    KProgressDialog, KStdAction
 from kfile import KFileDialog
 
 
@@ -52,181 +74,739 @@ def makeCaption(title):
     return KApplication.kApplication().makeStdCaption(i18n(title))
     
 
-class Tail:
+def configuredFont(cfg):
+    """Return the log font selected in the configuration."""
+    if cfg.fontDefault[0].property().toInt():
+        return KGlobalSettings.generalFont()
+    elif cfg.fontFixed[0].property().toInt():
+        return KGlobalSettings.fixedFont()
+    else:
+        return cfg.font.property().toFont()
+        
+        
+def drawSparkline(meter, width, height, background):
+    """Return a pixmap plotting the line rates of a RateMeter over the last 
+    width seconds: all lines in grey, errors in red."""
+    pix = QPixmap(width, height)
+    pix.fill(background)
+    painter = QPainter(pix)
+    lines = meter.history(None, width)
+    top = max(1, max(lines))
+    x = width - len(lines)
+    for severity, color in ((None, "grey"), (Classifier.ERROR, "red")):
+        painter.setPen(QColor(color))
+        for i, count in enumerate(meter.history(severity, width)):
+            h = (count * (height - 1) + top - 1) // top
+            if h:
+                painter.drawLine(x + i, height - 1, x + i, height - h)
+    painter.end()
+    return pix
+
+
+class Monitor(QTextEdit):
 
     """
-    File monitor.
+    File monitor widget.
     
-    Based on code contributed to Python Cookbook by Ed Pascoe (2003).
+    The lines read are kept in a LineStore, and the widget is a view of the 
+    newest ones passing a LineFilter. When the filter changes, the lines in 
+    the store are filtered again in the background, newest first, 
+    HISTORY_LINES at a time, until the widget is full. Merged timelines and 
+    remote files cannot be read back, so only MERGED_LINES of them are kept.
+    
+    Files are not read until start() is called. A Snapshot of the last 
+    session is then shown at once, or else the lines before the read 
+    position of the last session, and reading resumes after them. If the 
+    first lines are JSON, syslog or logfmt, the lines are parsed: their 
+    level field gives their severity, and their fields are kept in the 
+    store for field queries.
     """
 
-    LINES_BACK = 700
-    LINES_AT_ONCE = 700
-
-    def __init__(self, fileName):
-        self.fileName = fileName
-        self.fd = open(fileName, "r")
+    MAX_LOG_LINES = 1000
+    FRAME_TIME = 40
+    HOLD_TIME = 1000
+    INDEX_BUDGET = 8 * 1024 * 1024
+    HISTORY_LINES = 100000
+    MERGED_LINES = 100000
+    EVENTS = {Tail.ROTATED: "%s was rotated", 
+        Tail.TRUNCATED: "%s was truncated"}
+    
+    def __init__(self, parent, tailer, pool, snapshot = None):
+        QTextEdit.__init__(self, parent, "")
+        self.tailer = tailer
+        self.pool = pool
+        self.snapshot = snapshot
         self.started = False
-        self.changed = False
+        self.sizes = self.fileSizes()
+        self.again = False
+        self.received = 0
+        self.searcher = None
+        self.cfg = LoviConfig().getInstance()
+        self.pending = []
+        self.lineFilter = LineFilter()
+        self.parser = None
+        self.detected = False
+        if isinstance(tailer, Tail):
+            self.store = LineStore()
+        else:
+            self.store = LineStore(Monitor.MERGED_LINES)
+        self.meter = RateMeter()
+        self.alarms = {}
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.history = None
+        self.recent = []
+        self.nextScan = None
+        # Offsets of the lines added since the last session, until counted
+        self.session = None
+        self.newLines = None
+        self.flushTimer = QTimer(self)
+        self.connect(self.flushTimer, SIGNAL("timeout()"), self.flush)
+        self.holdTimer = QTimer(self)
+        self.connect(self.holdTimer, SIGNAL("timeout()"), self.follow)
+        self.setTextFormat(QTextEdit.LogText)
+        self.setMaxLogLines(Monitor.MAX_LOG_LINES)
+        QWhatsThis.add(self, 
+            str(i18n("<qt>This page is monitoring changes to <b>%s</b></qt>")) 
+                % self.tailer.getFileName())
+        self.reconfigure()
         
-    def start(self):
+    def start(self, offset = None):
+        """Start reading the file. offset is where the last session has 
+        stopped reading it, if known. If the snapshot of the last session is 
+        still valid, it is shown, otherwise the lines before offset are, and 
+        only the lines added since are read, however many."""
+        self.started = True
+        snapshot = self.snapshot
+        self.snapshot = None
+        last = None
+        if snapshot is not None and snapshot.lines:
+            last = snapshot.lines[-1]
+        if snapshot is not None and isinstance(self.tailer, Tail) and \
+            self.tailer.resume(snapshot.inode, snapshot.offset, last):
+            lines = snapshot.lines
+            self.detect(lines)
+            classifier = self.getClassifier()
+            records = classifier.parseLines(lines)
+            severities = snapshot.severities
+            if snapshot.errors != classifier.errors or \
+                snapshot.warnings != classifier.warnings:
+                severities = classifier.classifyLines(lines, records)
+            self.showSession(lines, classifier, severities, records, 
+                snapshot.starts, snapshot.inode, snapshot.offset)
+        elif offset is not None and isinstance(self.tailer, Tail):
+            lines = self.tailer.startAt(offset)
+            self.detect(lines)
+            classifier = self.getClassifier()
+            records = classifier.parseLines(lines)
+            severities = classifier.classifyLines(lines, records)
+            self.showSession(lines, classifier, severities, records, 
+                self.tailer.lineStarts, self.tailer.inode(), offset)
+        self.follow()
         
-        """Start monitoring; return the last 400 or so lines of the file."""
-    
-        avgCharsPerLine = 75
-
-        while 1:
+    def showSession(self, lines, classifier, severities, records, starts, 
+        inode, offset):
+        """Store and show the last lines of the last session, which has 
+        stopped reading at offset."""
+        self.store.append(lines, classifier, severities, starts, 
+            self.tailer.getFileName(), inode, records)
+        lines = renderLines(lines, classifier, severities, 
+            self.tailer.getEncoding())
+        size = self.fileSizes()[0]
+        if size > offset:
+            # Mark where the last session has stopped
+            lines.append(renderSeparator(str(i18n("Last session"))))
+            self.session = (offset, size)
+        self.setText("\n".join(lines))
+        self.scrollToBottom()
+        
+    def takeSnapshot(self):
+        """Return a Snapshot of the newest lines read."""
+        lines, severities, starts = self.store.newest(Monitor.MAX_LOG_LINES)
+        classifier = self.store.classifier or self.getClassifier()
+        inode = self.tailer.inode()
+        if self.store.inode != inode:
+            starts = None
+        return Snapshot(lines, severities, starts, inode, 
+            self.tailer.offset(), classifier.errors, classifier.warnings)
+        
+    def fileSizes(self):
+        """Return the sizes of the files, or None for the missing ones."""
+        ret = []
+        for fileName in self.getFileNames():
             try:
-                self.fd.seek(-1 * avgCharsPerLine * Tail.LINES_BACK, 2)
-            except IOError:
-                self.fd.seek(0)
-    
-            if self.fd.tell() == 0:
-                atStart = 1
+                ret.append(os.stat(fileName)[6])
+            except OSError:
+                ret.append(None)
+        return ret
+        
+    def follow(self):
+        """Update widget with file changes. New lines are read and rendered 
+        by fetch() in a worker thread, then passed to receive()."""
+        if not self.started:
+            # isChanged() notices changes until the file is read
+            return
+        if not self.pool.submit((self, self.receive), self.fetch):
+            # Follow again when the pending job is done
+            self.again = True
+            
+    def fetch(self):
+        """Read new lines, add them to the store and render the ones to be 
+        shown, and extend the line index of the file by a slice. Runs in a 
+        worker thread. Return the rendered lines, whether there is more to 
+        index, whether lines are held back, the filter generation the lines 
+        belong to, and the rotations and truncations after them. The lines 
+        added since the last session are counted once they are indexed."""
+        timer = PROFILER.enabled and PROFILER.timer()
+        lines = self.tailer.follow()
+        events = self.tailer.takeEvents()
+        if timer:
+            timer.lap("follow")
+            PROFILER.sample("lines per tick", len(lines))
+        detected = self.detect(lines)
+        classifier = self.getClassifier()
+        records = classifier.parseLines(lines)
+        severities = classifier.classifyLines(lines, records)
+        if timer:
+            timer.lap("classify")
+        self.lock.acquire()
+        try:
+            if detected:
+                self.store.setClassifier(classifier)
+            if isinstance(self.tailer, Tail):
+                self.store.append(lines, classifier, severities, 
+                    self.tailer.lineStarts, self.tailer.getFileName(), 
+                    self.tailer.inode(), records)
             else:
-                atStart = 0
-    
-            lines = self.fd.read().split("\n")
-            if (len(lines) > (Tail.LINES_BACK + 1)) or atStart:
-                break
-    
-            avgCharsPerLine = avgCharsPerLine * 1.3
+                self.store.append(lines, classifier, severities, 
+                    records = records)
+            if isinstance(self.tailer, Tail) and \
+                (self.tailer.getFileName(), Tail.TRUNCATED) in events:
+                # The offsets of the lines are no longer valid
+                self.store.truncated()
+            generation = self.generation
+            lineFilter = self.lineFilter
+        finally:
+            self.lock.release()
+        self.meter.add([severities.count(s) for s in range(3)])
+        if timer:
+            timer.lap("store")
+        indexing = not self.tailer.indexStep(Monitor.INDEX_BUDGET)
+        if events:
+            self.session = None
+        elif self.session is not None and \
+            self.tailer.index.end >= self.session[1]:
+            # Indexed up to where the file ended: count the new lines
+            offset, size = self.session
+            self.session = None
+            self.newLines = self.tailer.lineOf(size) - \
+                self.tailer.lineOf(offset)
+        if lines and self.searcher is not None:
+            self.searcher.update()
+        if timer:
+            timer.lap("index")
+        if not lineFilter.isEmpty():
+            lines, severities = lineFilter.apply(lines, classifier, 
+                severities)
+        # The widget would discard the rest anyway
+        lines = lines[max(0, len(lines) - Monitor.MAX_LOG_LINES):]
+        severities = severities[max(0, len(severities) - 
+            Monitor.MAX_LOG_LINES):]
+        if timer:
+            timer.lap("filter")
+        rendered = renderLines(lines, classifier, severities, 
+            self.tailer.getEncoding())
+        if timer:
+            timer.lap("render")
+        return rendered, indexing, self.tailer.holding(), generation, events
+            
+    def receive(self, result):
+        """Buffer lines rendered by fetch() for insertion at the next frame 
+        by flush()."""
+        lines, indexing, holding, generation, events = result
+        self.received = self.received + len(lines) + len(events)
+        if self.again or indexing:
+            self.again = False
+            self.follow()
+        elif holding and not self.holdTimer.isActive():
+            # Follow again to release the lines held back
+            self.holdTimer.start(Monitor.HOLD_TIME, True)
+        if generation != self.generation:
+            # Read before the filter has changed: part of the history
+            return
+        for fileName, event in events:
+            lines.append(renderSeparator(str(i18n(Monitor.EVENTS[event])) % 
+                os.path.basename(fileName)))
+        if not lines:
+            return
+        self.pending.extend(lines)
+        if len(self.pending) > Monitor.MAX_LOG_LINES:
+            # The widget would discard the rest anyway
+            del self.pending[:len(self.pending) - Monitor.MAX_LOG_LINES]
+        if not self.flushTimer.isActive():
+            self.flushTimer.start(Monitor.FRAME_TIME, True)
+            
+    def flush(self):
+        """Insert pending lines with a single append, then repaint once."""
+        self.flushTimer.stop()
+        if not self.pending:
+            return
+        text = "\n".join(self.pending)
+        if self.history is not None:
+            # Keep new lines to show after the history being filtered
+            self.recent.extend(self.pending)
+            del self.recent[:-Monitor.MAX_LOG_LINES]
+        timer = PROFILER.enabled and PROFILER.timer()
+        if timer:
+            PROFILER.sample("lines per append", len(self.pending))
+        self.pending = []
+        self.setUpdatesEnabled(False)
+        self.append(text)
+        self.setUpdatesEnabled(True)
+        self.viewport().update()
+        if timer:
+            timer.lap("append")
+        
+    def setFilter(self, lineFilter):
+        """Show only the lines passing lineFilter, starting with the lines 
+        in the store."""
+        self.setText("")
+        self.restart(lineFilter)
+        
+    def restart(self, lineFilter):
+        """Show the lines in the store passing lineFilter again. The text 
+        shown is replaced once the newest of them are rendered."""
+        self.lock.acquire()
+        try:
+            self.lineFilter = lineFilter
+            self.generation = self.generation + 1
+            end = self.store.end
+        finally:
+            self.lock.release()
+        self.pending = []
+        self.history = []
+        self.recent = []
+        self.scanHistory(end)
+            
+    def scanHistory(self, end):
+        """Filter the lines in the store before line number end in a worker 
+        thread, HISTORY_LINES at a time. receiveHistory() then shows 
+        them."""
+        generation = self.generation
+        lineFilter = self.lineFilter
+        classifier = self.getClassifier()
+        store = self.store
+        encoding = self.tailer.getEncoding()
+        want = Monitor.MAX_LOG_LINES - len(self.history) - len(self.recent)
+        
+        def job():
+            start = max(store.first, end - Monitor.HISTORY_LINES)
+            lines, severities = store.select(lineFilter, start, end, want)
+            return generation, renderLines(lines, classifier, severities, 
+                encoding), start
             
-        if len(lines) > Tail.LINES_BACK:
-            start = len(lines) - Tail.LINES_BACK - 1
+        if not self.pool.submit((self, self.receiveHistory), job):
+            # Scan when the job of the previous filter is done
+            self.nextScan = end
         else:
-            start = 0
-    
-        return lines[start:len(lines) - 1]
+            self.nextScan = None
+            
+    def receiveHistory(self, result):
+        """Show the lines filtered by scanHistory(), and scan further back 
+        until the widget is full."""
+        generation, lines, start = result
+        if generation != self.generation:
+            if self.nextScan is not None:
+                self.scanHistory(self.nextScan)
+            return
+        self.flush()
+        self.history[:0] = lines
+        if start > self.store.first and len(self.history) + \
+            len(self.recent) < Monitor.MAX_LOG_LINES:
+            self.scanHistory(start)
+        self.setUpdatesEnabled(False)
+        self.setText("\n".join(self.history + self.recent))
+        self.setUpdatesEnabled(True)
+        self.scrollToBottom()
+        self.viewport().update()
+        if start <= self.store.first or len(self.history) + \
+            len(self.recent) >= Monitor.MAX_LOG_LINES:
+            self.history = None
+            self.recent = []
+            
+    def getFileName(self):
+        return self.tailer.getFileName()
         
-    def follow(self):
+    def getFileNames(self):
+        return self.tailer.getFileNames()
         
-        """Monitor file for changes: Return text appended to the file since 
-        last call."""
+    def progress(self):
+        """Return a number growing when new lines are read."""
+        return self.received
         
-        ret = []
+    def findOffset(self):
+        """Return the file offset where searching starts."""
+        return self.tailer.offset()
         
+    def isChanged(self):
         if not self.started:
-            ret = self.start()
-            self.started = True
-        
-        for cnt in range(0, Tail.LINES_AT_ONCE):
-            where = self.fd.tell()
-            line = self.fd.readline()
-            if not line:
-                fdResults = os.fstat(self.fd.fileno())
-                try:
-                    stResults = os.stat(self.fileName)
-                except OSError:
-                    stResults = fdResults
-                if stResults[1] == fdResults[1]:
-                    self.fd.seek(where)
-                else:
-                    # Inode of the monitored file has changed
-                    self.fd = open(self.fileName, "r")
-                break
-            else:
-                self.changed = True
-                ret.append(line.strip("\r\n"))
-                
-        return ret
+            sizes = self.fileSizes()
+            changed = sizes != self.sizes
+            self.sizes = sizes
+            return changed
+        return self.tailer.isChanged()
         
-    def getFileName(self):
-        return self.fileName
+    def reconfigure(self):
+        """Update with configuration changes. If the error and warning 
+        keywords have changed, the lines shown are coloured again, and the 
+        rest of the store is classified again in the background."""
+        self.setFont(configuredFont(self.cfg))
+        if self.store.setClassifier(self.getClassifier()):
+            self.restart(self.lineFilter)
+            self.reclassify()
+            
+    def detect(self, lines):
+        """Detect the format of the file from the first lines read. Return 
+        True if they are parsed from now on."""
+        if self.detected or not lines:
+            return False
+        self.detected = True
+        self.parser = detectParser(lines)
+        return self.parser is not None
         
-    def isChanged(self):
-        changed = self.changed
-        self.changed = False
-        return changed
+    def getClassifier(self):
+        """Return the configured classifier, for parsed lines if the format 
+        of the file is known."""
+        return self.cfg.classifier.withParser(self.parser)
+        
+    def fieldRows(self, count):
+        """Return the names of the fields of the lines in the store, and the 
+        fields and severities of the newest count lines passing the 
+        filter."""
+        store = self.store
+        if store.fields is None:
+            return [], []
+        lines, severities = store.select(self.lineFilter, store.first, 
+            store.end, count)
+        parse = store.classifier.parse
+        return list(store.fields.names), \
+            [(parse(lines[i]), severities[i]) for i in range(len(lines))]
+            
+    def reclassify(self):
+        """Classify the stale lines in the store in a worker thread, one 
+        frame time at a time, so that even many monitors reclassifying at 
+        once leave the GUI thread responsive."""
+        store = self.store
+        self.pool.submit((self, self.receiveReclassified), 
+            lambda: store.reclassify(Monitor.FRAME_TIME / 1000.0))
+            
+    def receiveReclassified(self, done):
+        """Continue reclassifying until no stale lines are left."""
+        if not done:
+            self.reclassify()
 
 
-class Monitor(QTextEdit):
+class FileView(QWidget):
 
-    """File monitor widget."""
+    """
+    Whole file viewer widget.
 
-    MAX_LOG_LINES = 1000
-    
-    def __init__(self, parent, tailer):
-        QTextEdit.__init__(self, parent, "")
-        self.tailer = tailer
+    The file is memory-mapped, and only the lines in the visible part of
+    the widget are read and painted, so files of any size can be viewed in
+    constant memory. New lines are followed while the view is at the bottom.
+    Compressed files, and files viewed with their rotated siblings, are read 
+    through a RotationSet instead of a memory map. Unless configured, the 
+    encoding is detected from the first lines painted, like the format of 
+    parsed lines.
+    """
+
+    INDEX_BUDGET = 8 * 1024 * 1024
+
+    def __init__(self, parent, fileName, rotated = False):
+        QWidget.__init__(self, parent, "")
+        self.fileName = fileName
+        self.rotated = rotated
+        self.fd = open(fileName, "rb")
+        self.rotation = None
+        if rotated or RotationSet.kindOf(fileName):
+            self.rotation = RotationSet(fileName, rotated)
+        self.map = None
+        self.size = 0
+        self.index = LineIndex()
+        self.top = 0
+        # Offset of the top line, when shown before it is indexed
+        self.anchor = None
+        # Offset and length to go to once the data there is measured
+        self.jump = None
+        self.highlight = None
+        self.changed = False
         self.cfg = LoviConfig().getInstance()
-        self.setTextFormat(QTextEdit.LogText)
-        self.setMaxLogLines(Monitor.MAX_LOG_LINES)
-        self.follow()
-        QWhatsThis.add(self, 
-            str(i18n("<qt>This page is monitoring changes to <b>%s</b></qt>")) 
-                % self.tailer.getFileName())
+        self.encoding = self.cfg.encodingName
+        self.parser = None
+        self.detected = False
+        self.setBackgroundMode(Qt.PaletteBase)
+        self.setFocusPolicy(QWidget.StrongFocus)
+        self.scrollBar = QScrollBar(Qt.Vertical, self)
+        self.connect(self.scrollBar, SIGNAL("valueChanged(int)"),
+            self.onScroll)
+        self.indexTimer = QTimer(self)
+        self.connect(self.indexTimer, SIGNAL("timeout()"), self.onIndex)
+        QWhatsThis.add(self,
+            str(i18n("<qt>This page is showing the whole of <b>%s</b></qt>"))
+                % fileName)
         self.reconfigure()
-        self.findIndex = 0
-        self.findPara = 0
-        
+        if self.rotation is not None:
+            # Measure compressed members
+            self.indexTimer.start(0)
+        self.follow()
+
+    def remap(self):
+        """Map the file again if its size has changed. Return True if it
+        has changed."""
+        if self.rotation is not None:
+            size = self.rotation.size()
+        else:
+            size = os.fstat(self.fd.fileno())[6]
+        if size == self.size:
+            return False
+        if size < self.size:
+            # Truncated: start again
+            self.index = LineIndex()
+            self.anchor = None
+            self.jump = None
+            self.highlight = None
+        if self.map is not None and self.rotation is None:
+            self.map.close()
+        self.map = None
+        if size > 0 and self.rotation is not None:
+            self.map = self.rotation
+        elif size > 0:
+            self.map = mmap.mmap(self.fd.fileno(), size,
+                access = mmap.ACCESS_READ)
+        self.size = size
+        return True
+
     def follow(self):
+        """Update view with file changes."""
+        replaced = False
+        try:
+            if os.stat(self.fileName)[1] != os.fstat(self.fd.fileno())[1]:
+                # Inode of the viewed file has changed
+                fd = open(self.fileName, "rb")
+                if self.map is not None and self.rotation is None:
+                    self.map.close()
+                self.map = None
+                self.fd.close()
+                self.fd = fd
+                if self.rotation is not None:
+                    self.rotation.scan()
+                self.size = 0
+                self.index = LineIndex()
+                self.anchor = None
+                self.jump = None
+                self.highlight = None
+                # Cleared even if the new file is empty
+                replaced = True
+        except (OSError, IOError):
+            pass
+        if self.remap() or replaced:
+            self.changed = True
+            if not self.indexTimer.isActive():
+                self.indexTimer.start(0)
 
-        """Update widget with file changes."""
-        
-        for line in self.tailer.follow():
-            hasErrors = False
-            hasWarnings = False
-            loLine = line.lower()
-            for err in self.cfg.filterErrorList:
-                if loLine.find(err.lower()) != -1:
-                    hasErrors = True
-                    break
-            if not hasErrors:
-                for warn in self.cfg.filterWarningList:
-                    if loLine.find(warn.lower()) != -1:
-                        hasWarnings = True
-                        break
-            line = line.replace("<", "&lt;").replace(">", "&gt;")
-            if hasErrors:
-                line = '<font color="red">' + line + '</font>'
-            elif hasWarnings:
-                line = '<font color="blue">' + line + '</font>'
-                    
-            self.append(line)
-            
-    def getFileName(self):
-        return self.tailer.getFileName()
+    def onIndex(self):
+        """Index the next part of the file, then update the scroll bar. 
+        Compressed members are measured first, a slice at a time."""
+        measured = True
+        if self.rotation is not None:
+            measured = self.rotation.measure(FileView.INDEX_BUDGET)
+            self.remap()
+        if (self.map is None or self.index.update(self.map, self.size, 
+            FileView.INDEX_BUDGET)) and measured:
+            self.indexTimer.stop()
+        if self.jump is not None and self.map is not None and \
+            (self.jump[0] <= self.size or measured):
+            offset, length = self.jump
+            self.jump = None
+            self.gotoOffset(min(offset, self.size), length)
+        if self.anchor is not None and self.index.end >= self.anchor:
+            # Indexed up to the lines shown: scroll by line numbers again
+            self.top = self.index.lineOf(self.map, self.anchor)
+            self.anchor = None
+            self.scrollBar.setRange(0, 
+                max(0, self.lineCount() - self.pageLines()))
+            self.gotoLine(self.top)
+        self.updateScrollBar()
+
+    def lineCount(self):
+        """Return the number of lines indexed so far."""
+        count = self.index.count
+        if self.index.end == self.size and self.size > 0:
+            self.map.seek(self.size - 1)
+            if self.map.read(1) != "\n":
+                count = count + 1
+        return count
+
+    def pageLines(self):
+        """Return the number of lines fitting in the view."""
+        return max(1, self.height() // self.fontMetrics().lineSpacing())
+
+    def updateScrollBar(self):
+        """Update scroll bar range, keeping the view at the bottom if it was
+        there."""
+        atBottom = self.scrollBar.value() >= self.scrollBar.maxValue()
+        page = self.pageLines()
+        self.scrollBar.setRange(0, max(0, self.lineCount() - page))
+        self.scrollBar.setSteps(1, page)
+        if atBottom and self.anchor is None:
+            self.scrollBar.setValue(self.scrollBar.maxValue())
+        self.update()
+
+    def onScroll(self, value):
+        if value != self.top:
+            self.anchor = None
+        self.top = value
+        self.update()
         
+    def scrollLines(self, count):
+        """Scroll by count lines, back if count is negative. Lines shown 
+        before they are indexed are found by reading around them."""
+        if self.anchor is None:
+            self.scrollBar.setValue(self.scrollBar.value() + count)
+        elif count < 0:
+            self.anchor = LineIndex.startBefore(self.map, self.anchor, -count)
+            self.update()
+        else:
+            lines = LineIndex.readFrom(self.map, self.size, self.anchor, 
+                count + 1)
+            if lines:
+                self.anchor = lines[-1][0]
+            self.update()
+
+    def gotoLine(self, lineNo):
+        """Scroll to a line (counting from 0)."""
+        self.scrollBar.setValue(lineNo)
+
+    def gotoOffset(self, offset, length = 0):
+        """Scroll to the line containing a file offset, and highlight length
+        bytes there. Beyond the indexed part of the file, the lines around 
+        offset are shown at once, and scrolled to by number once indexed. 
+        Offsets in compressed members not measured yet are gone to once 
+        they are."""
+        if self.map is None or offset > self.size:
+            self.jump = (offset, length)
+            if not self.indexTimer.isActive():
+                self.indexTimer.start(0)
+            return
+        self.jump = None
+        if length:
+            self.highlight = (offset, length)
+        if offset > self.index.end:
+            self.anchor = LineIndex.startBefore(self.map, offset, 
+                self.pageLines() // 2)
+            if not self.indexTimer.isActive():
+                self.indexTimer.start(0)
+        else:
+            self.anchor = None
+            self.gotoLine(max(0, self.index.lineOf(self.map, offset) -
+                self.pageLines() // 2))
+        self.update()
+
+    def paintEvent(self, e):
+        """Paint the visible lines."""
+        if self.map is None:
+            return
+        painter = QPainter(self)
+        fm = self.fontMetrics()
+        normal = self.colorGroup().text()
+        colors = {Classifier.WARNING: QColor("blue"),
+            Classifier.ERROR: QColor("red")}
+        y = 0
+        if self.anchor is not None:
+            lines = LineIndex.readFrom(self.map, self.size, self.anchor, 
+                self.pageLines() + 1)
+        else:
+            lines = self.index.readLines(self.map, self.size, self.top, 
+                self.pageLines() + 1)
+        if self.encoding is None and lines:
+            self.encoding = detectEncoding("\n".join([l for o, l in lines]))
+        if not self.detected and lines:
+            self.detected = True
+            self.parser = detectParser([l for o, l in lines])
+        classify = self.cfg.classifier.withParser(self.parser).classify
+        for offset, line in lines:
+            painter.setPen(colors.get(classify(line), normal))
+            if self.highlight is not None:
+                start = self.highlight[0] - offset
+                if 0 <= start <= len(line):
+                    x = fm.width(self.decode(line[:start]))
+                    w = fm.width(self.decode(line[start:start +
+                        self.highlight[1]]))
+                    painter.fillRect(2 + x, y, w, fm.lineSpacing(),
+                        self.colorGroup().highlight())
+            painter.drawText(2, y + fm.ascent(), self.decode(line))
+            y = y + fm.lineSpacing()
+        painter.end()
+
+    def decode(self, data):
+        """Return bytes of the file as Unicode, with tabs expanded."""
+        return data.decode(self.encoding, "replace").expandtabs()
+
+    def resizeEvent(self, e):
+        width = self.scrollBar.sizeHint().width()
+        self.scrollBar.setGeometry(self.width() - width, 0, width,
+            self.height())
+        self.updateScrollBar()
+
+    def wheelEvent(self, e):
+        self.scrollLines(-e.delta() // 40)
+
+    def keyPressEvent(self, e):
+        steps = {Qt.Key_Up: -1, Qt.Key_Down: 1,
+            Qt.Key_Prior: -self.pageLines(), Qt.Key_Next: self.pageLines()}
+        if e.key() in steps:
+            self.scrollLines(steps[e.key()])
+        elif e.key() == Qt.Key_Home:
+            self.anchor = None
+            self.scrollBar.setValue(0)
+            self.update()
+        elif e.key() == Qt.Key_End:
+            self.anchor = None
+            self.scrollBar.setValue(self.scrollBar.maxValue())
+            self.update()
+        else:
+            e.ignore()
+
+    def getFileName(self):
+        return self.fileName
+
+    def getFileNames(self):
+        return [self.fileName]
+
+    def progress(self):
+        """Return a number changing when the file changes."""
+        return self.size
+
     def isChanged(self):
-        return self.tailer.isChanged()
-        
+        changed = self.changed
+        self.changed = False
+        return changed
+
     def reconfigure(self):
         """Update with configuration changes."""
-        if self.cfg.fontDefault[0].property().toInt():
-            self.setFont(KGlobalSettings.generalFont())
-        elif self.cfg.fontFixed[0].property().toInt():
-            self.setFont(KGlobalSettings.fixedFont())
-        else:
-            self.setFont(self.cfg.font.property().toFont())
-            
-    def find(self, text, caseSensitive, backward):
-        """Find text."""
-        if self.hasSelectedText():
-            paraFrom, indexFrom, paraTo, indexTo = self.getSelection(0)
-            if backward:
-                if indexFrom == 0:
-                    if para == 0:
-                        index = 0
-                        para = 0
-                    else:
-                        para = para - 1
-                        index = self.paragraphLength(para) - 1
-                else:
-                    index = indexFrom - 1
-                    para = paraFrom
-            else:
-                index = indexTo
-                para = paraTo
-        else:
-            if backward:
-                para = self.paragraphs() - 1
-                index = self.paragraphLength(para) - 1
-            else:
-                index = 0
-                para = 0
-        QTextEdit.find(self, text, caseSensitive, False, not backward, 
-            para, index)
+        self.setFont(configuredFont(self.cfg))
+        self.updateScrollBar()
+
+    def findOffset(self):
+        """Return the file offset where searching starts: the current match
+        or the top of the view."""
+        if self.highlight is not None:
+            return self.highlight[0]
+        if self.anchor is not None:
+            return self.anchor
+        if self.map is None:
+            return 0
+        return self.index.offsetOf(self.map, self.top)
 
 
 class BellButton(QLabel):
@@ -248,13 +828,23 @@ class MainWin(KMainWindow):
 
     SB_TEXT = 1
     SB_TIMEOUT = 10000
-    MON_TIMEOUT = 1000
     CHANGE_TIMEOUT = 3001
+    RATE_TIMEOUT = 1000
+    EXPORT_TIMEOUT = 200
+    TAB_GRAPH_SIZE = (32, 16)
+    STATUS_GRAPH_SIZE = (60, 16)
 
     def __init__(self, *args):
         apply(KMainWindow.__init__, (self,) + args)
         
         self.lastDir = "/var/log"
+        self.lastRemote = ""
+        self.ringing = []
+        self.searchers = {}
+        self.findRequest = None
+        self.indexDir = str(KGlobal.dirs().saveLocation("appdata", "index/"))
+        self.bookmarks = BookmarkStore(os.path.join(
+            str(KGlobal.dirs().saveLocation("appdata")), "bookmarks"))
         self.monitors = []
         self.currentPage = None
         self.tab = QTabWidget(self)
@@ -264,6 +854,11 @@ class MainWin(KMainWindow):
             QIconSet(KIconLoader().loadIcon("idea", KIcon.Small, 11))
         self.noIcon = QIconSet()
         self.findDlg = KEdFind(self, "find", False)
+        self.filterDlg = FilterDlg(self)
+        self.exportDlg = ExportDlg(self)
+        self.performanceDlg = None
+        self.exporter = None
+        self.exportResult = None
         self.connect(self.findDlg, SIGNAL("search()"), self.doFind)
         
         self.setCentralWidget(self.tab)
@@ -272,9 +867,29 @@ class MainWin(KMainWindow):
         self.setGeometry(0, 0, 600, 400)
         self.setCaption(makeCaption("(none)"))
 
+        # Change notification: inotify where available, polling otherwise
+        try:
+            self.watcher = Watcher()
+            self.watchNotifier = QSocketNotifier(self.watcher.fileno(), 
+                QSocketNotifier.Read, self)
+            self.connect(self.watchNotifier, SIGNAL("activated(int)"), 
+                self.onWatch)
+        except OSError:
+            self.watcher = None
+            
+        # Worker threads reading and rendering monitored files
+        self.pool = WorkerPool()
+        self.poolNotifier = QSocketNotifier(self.pool.fileno(), 
+            QSocketNotifier.Read, self)
+        self.connect(self.poolNotifier, SIGNAL("activated(int)"), 
+            self.onResults)
+
+        # Polling of the files inotify cannot watch
+        self.scheduler = PollScheduler()
+        self.pollTimer = QTimer(self)
+        self.connect(self.pollTimer, SIGNAL("timeout()"), self.onPollTimeout)
+
         # Timers
-        self.timer = QTimer(self)
-        self.timer.start(MainWin.MON_TIMEOUT)
         self.statusTimer = QTimer(self)
         self.connect(self.statusTimer, SIGNAL("timeout()"), 
             self.onStatusTimeout)
@@ -282,6 +897,12 @@ class MainWin(KMainWindow):
         self.changeTimer.start(MainWin.CHANGE_TIMEOUT)
         self.connect(self.changeTimer, SIGNAL("timeout()"),
             self.onChangeTimeout)
+        self.rateTimer = QTimer(self)
+        self.rateTimer.start(MainWin.RATE_TIMEOUT)
+        self.connect(self.rateTimer, SIGNAL("timeout()"), self.onRateTimeout)
+        self.exportTimer = QTimer(self)
+        self.connect(self.exportTimer, SIGNAL("timeout()"), 
+            self.onExportTimeout)
 
         # Initialize actions
         actions = self.actionCollection()
@@ -298,6 +919,8 @@ class MainWin(KMainWindow):
         self.addBookmarkAction = \
             KStdAction.addBookmark(self.onAddBookmark, actions)
         self.addBookmarkAction.setEnabled(False)
+        self.bookmarksAction = KAction(i18n("Show &Bookmarks..."), 
+            "bookmark", KShortcut(), self.onBookmarks, actions, "bookmarks")
         self.settingsAction = KStdAction.preferences(self.onSettings, actions)
         self.findAction = KStdAction.find(self.onFind, actions)
         self.findAction.setEnabled(False)
@@ -305,11 +928,40 @@ class MainWin(KMainWindow):
         self.findNextAction.setEnabled(False)
         self.findPrevAction = KStdAction.findPrev(self.onFindPrev, actions)
         self.findPrevAction.setEnabled(False)
+        self.gotoLineAction = KStdAction.gotoLine(self.onGotoLine, actions)
+        self.gotoLineAction.setEnabled(False)
+        self.filterAction = KAction(i18n("&Filter..."), "filter", 
+            KShortcut(), self.onFilter, actions, "filter")
+        self.filterAction.setEnabled(False)
+        self.fieldsAction = KAction(i18n("Show Fi&elds..."), "view_detailed", 
+            KShortcut(), self.onFields, actions, "fields")
+        self.fieldsAction.setEnabled(False)
+        self.fullViewAction = KAction(i18n("Open &Whole File"), "viewmag",
+            KShortcut(), self.onFullView, actions, "full_view")
+        self.fullViewAction.setEnabled(False)
+        self.openRotatedAction = KAction(i18n("Open &Rotated Logs..."), 
+            "fileopen", KShortcut(), self.onOpenRotated, actions, 
+            "open_rotated")
+        self.mergeAction = KAction(i18n("&Merge Files..."), "fileopen", 
+            KShortcut(), self.onMerge, actions, "merge")
+        self.openRemoteAction = KAction(i18n("Open Re&mote Log..."), 
+            "network", KShortcut(), self.onOpenRemote, actions, 
+            "open_remote")
+        self.performanceAction = KAction(i18n("Show &Performance..."), 
+            "history", KShortcut(), self.onPerformance, actions, 
+            "performance")
+        self.exportAction = KAction(i18n("E&xport Lines..."), "filesaveas", 
+            KShortcut(), self.onExport, actions, "export")
         
         # Initialize menus
         
         fileMenu = QPopupMenu(self)
         self.openAction.plug(fileMenu)
+        self.openRotatedAction.plug(fileMenu)
+        self.mergeAction.plug(fileMenu)
+        self.openRemoteAction.plug(fileMenu)
+        self.fullViewAction.plug(fileMenu)
+        self.exportAction.plug(fileMenu)
         self.closeAction.plug(fileMenu)
         fileMenu.insertSeparator()
         self.quitAction.plug(fileMenu)
@@ -321,14 +973,19 @@ class MainWin(KMainWindow):
         editMenu.insertSeparator()
         self.selectAllAction.plug(editMenu)
         self.addBookmarkAction.plug(editMenu)
+        self.bookmarksAction.plug(editMenu)
         editMenu.insertSeparator()
         self.findAction.plug(editMenu)
         self.findNextAction.plug(editMenu)
         self.findPrevAction.plug(editMenu)
+        self.gotoLineAction.plug(editMenu)
+        self.filterAction.plug(editMenu)
+        self.fieldsAction.plug(editMenu)
         self.menuBar().insertItem(i18n("&Edit"), editMenu)
         
         settingsMenu = QPopupMenu(self)
         self.settingsAction.plug(settingsMenu)
+        self.performanceAction.plug(settingsMenu)
         self.menuBar().insertItem(i18n("&Settings"), settingsMenu)
         
         helpMenu = self.helpMenu("")
@@ -337,6 +994,10 @@ class MainWin(KMainWindow):
         # Initialize status bar
         self.sb = self.statusBar()
         self.bell = BellButton(None)
+        self.rateGraph = QLabel(self.sb)
+        self.rateText = QLabel(self.sb)
+        self.sb.addWidget(self.rateGraph, 0, True)
+        self.sb.addWidget(self.rateText, 0, True)
         self.displayStatus(False, "")
         
     def displayStatus(self, changed, msg):
@@ -359,36 +1020,88 @@ class MainWin(KMainWindow):
             fileName = str(fileName)
             self.lastDir = os.path.dirname(fileName)
             self.monitor(fileName)
+            
+    def onOpenRotated(self, id = -1):
+        """Open file for monitoring, together with its rotated siblings."""
+        fileName = KFileDialog.getOpenFileName(self.lastDir, "*", self, 
+            str(i18n("Open Rotated Logs")))
+        if not fileName.isEmpty():
+            fileName = str(fileName)
+            self.lastDir = os.path.dirname(fileName)
+            self.monitor(fileName, True)
+            
+    def onMerge(self, id = -1):
+        """Open files for monitoring, merged into one timeline."""
+        fileNames = KFileDialog.getOpenFileNames(self.lastDir, "*", self, 
+            str(i18n("Merge Log Files")))
+        if fileNames.count() > 0:
+            fileNames = [str(f) for f in fileNames]
+            self.lastDir = os.path.dirname(fileNames[0])
+            self.merge(fileNames)
+    
+    def onOpenRemote(self, id = -1):
+        """Open a file on a remote host for monitoring."""
+        fileName, ok = KInputDialog.getText(makeCaption("Open Remote Log"), 
+            i18n("File to monitor, like host:/var/log/messages:"), 
+            self.lastRemote, self)
+        if not ok:
+            return
+        fileName = str(fileName).strip()
+        if RemoteHost.split(fileName) is None:
+            KMessageBox.error(self, 
+                str(i18n("Not a remote file name:\n%s")) % fileName, 
+                makeCaption("Error"))
+            return
+        self.lastRemote = fileName
+        self.monitor(fileName)
     
     def onClose(self, id = -1):
         """Close a monitored file."""
         self.monitors.remove(self.currentPage)
+        self.unwatch(self.currentPage)
+        self.saveIndex(self.currentPage)
+        if isinstance(self.currentPage, Monitor) and \
+            not isinstance(self.currentPage.tailer, Tail):
+            # Stop following remote files
+            self.currentPage.tailer.close()
+        fileName = self.currentPage.getFileName()
+        if fileName not in [mon.getFileName() for mon in self.monitors]:
+            self.searchers.pop((fileName, False), None)
+            self.searchers.pop((fileName, True), None)
+        if self.currentPage in self.ringing:
+            self.ringing.remove(self.currentPage)
         self.currentPage.close()
         self.tab.removePage(self.currentPage)
         self.displayStatus(False, "")
         self.saveFileList()
         if len(self.monitors) == 0:
             # Update interface when the last page is deleted
+            self.currentPage = None
             self.setCaption(makeCaption("(none)"))
-            self.closeAction.setEnabled(False)
-            self.copyAction.setEnabled(False)
-            self.selectAllAction.setEnabled(False)
-            self.clearAction.setEnabled(False)
-            self.addBookmarkAction.setEnabled(False)
-            self.findAction.setEnabled(False)
-            self.findNextAction.setEnabled(False)
-            self.findPrevAction.setEnabled(False)
+            self.updateActions()
 
     def onQuit(self, id = -1):
         """Quit application."""
         self.close()
         
+    def queryClose(self):
+        """Save line indexes and snapshots before the main window is 
+        closed."""
+        for mon in self.monitors:
+            self.saveIndex(mon)
+            self.saveSnapshot(mon)
+        if self.exporter is not None:
+            # Do not leave a partial export behind
+            self.exporter.cancel()
+        return True
+        
     def onCopy(self, id = -1):
         """Copy text to clipboard."""
         self.currentPage.copy()
         
     def onClear(self, id = -1):
         """Clear text window."""
+        self.currentPage.flush()
         self.currentPage.setText("")
         
     def onSelectAll(self, id = -1):
@@ -396,12 +1109,67 @@ class MainWin(KMainWindow):
         self.currentPage.selectAll(True)
         
     def onAddBookmark(self, id = -1):
-        """Add a bookmark to the log."""
-        bookmark = "<font color=\"blue\">"
-        bookmark += datetime.datetime.now().strftime("%b %d %H:%M:%S ")
-        bookmark += "--------------------------------------------------------"
-        bookmark += "</font>"
-        self.currentPage.append(bookmark)
+        """Bookmark the last line of a monitored file, marking the place in 
+        the log, or the current line of a whole file view."""
+        page = self.currentPage
+        try:
+            if isinstance(page, Monitor):
+                separator = renderSeparator(
+                    datetime.datetime.now().strftime("%b %d %H:%M:%S"))
+                page.flush()
+                page.append(separator)
+                # The store is read under its lock, unlike the position of 
+                # the tailer, which a worker may be moving. Merged timelines 
+                # and remote files only get the mark.
+                newest = page.store.newestLine()
+                if newest is None:
+                    return
+                inode, offset, text = newest
+                bookmark = Bookmark(os.path.abspath(page.getFileName()), 
+                    inode, offset, time.time(), text[:Bookmark.MAX_TEXT])
+            elif not page.rotated:
+                bookmark = Bookmark.at(page.getFileName(), page.findOffset())
+            else:
+                return
+            self.bookmarks.add(bookmark)
+        except (IOError, OSError):
+            KMessageBox.error(self, 
+                str(i18n("Cannot save bookmark:\n%s")) % sys.exc_info()[1], 
+                makeCaption("Error"))
+            return
+        self.displayStatus(False, str(i18n("Bookmarked line of %s")) % 
+            page.getFileName())
+        
+    def onBookmarks(self, id = -1):
+        """List the bookmarks, and jump to the one chosen. It is located in 
+        a worker thread, see onLocated()."""
+        dlg = BookmarksDlg(self, self.bookmarks)
+        if not dlg.exec_loop() or dlg.selected is None:
+            return
+        bookmark = dlg.selected
+        self.pool.submit((bookmark, self.onLocated), 
+            lambda: (bookmark, bookmark.locate()))
+            
+    def onLocated(self, result):
+        """Show the line of a bookmark in a whole file view. In compressed 
+        rotated files, the view goes there once it is decompressed."""
+        bookmark, path = result
+        if path is None:
+            KMessageBox.sorry(self, 
+                str(i18n("The bookmarked line is no longer in %s or its "
+                "rotated files.")) % bookmark.fileName, 
+                makeCaption("Bookmarks"))
+            return
+        self.showOffset(path, bookmark.offset, len(bookmark.text))
+        page = self.currentPage
+        if isinstance(page, FileView) and page.jump is not None:
+            self.displayStatus(False, 
+                str(i18n("Decompressing %s to show the bookmarked line")) % 
+                    path)
+        elif path != bookmark.fileName:
+            self.displayStatus(False, 
+                str(i18n("Bookmarked line of %s found in %s")) % 
+                    (bookmark.fileName, path))
     
     def onSettings(self, id = -1):
         """Display settings dialog"""
@@ -411,17 +1179,24 @@ class MainWin(KMainWindow):
             self.reconfigure()
         
     def onPageChange(self, page):
-        """Update widget when the top level tab changes."""
+        """Update widget when the top level tab changes. Monitors start 
+        reading their files when first shown."""
         self.currentPage = page
+        if isinstance(page, Monitor):
+            self.startMonitor(page)
+        self.scheduler.setVisible(page)
+        self.schedulePoll()
         self.setCaption(makeCaption(os.path.basename(page.getFileName())))
-        self.copyAction.setEnabled(page.hasSelectedText())
+        self.updateActions()
         # self.tab.setTabIconSet(page, self.noIcon)
                         
     def onStatusTimeout(self):
         """Clear status bar on timeout."""
         self.displayStatus(False, "")
+        self.ringing = []
         for m in self.monitors:
             self.tab.setTabIconSet(m, self.noIcon)
+        self.onRateTimeout()
         
     def onChangeTimeout(self):
         """Look for changes in monitored files. """
@@ -429,7 +1204,7 @@ class MainWin(KMainWindow):
         for m in self.monitors:
             if m.isChanged():
                 changeList.append(os.path.basename(m.getFileName()))
-                self.tab.setTabIconSet(m, self.bellIcon)
+                self.ring(m)
         if len(changeList):
             msg = changeList[0]
             for f in changeList[1:]:
@@ -437,10 +1212,230 @@ class MainWin(KMainWindow):
             msg = str(i18n("Change to %s")) % msg
             self.displayStatus(True, msg)
             
+    def onRateTimeout(self):
+        """Update the line rate graphs, and check the alarms."""
+        background = self.tab.paletteBackgroundColor()
+        for m in self.monitors:
+            if isinstance(m, Monitor):
+                if m not in self.ringing:
+                    self.tab.setTabIconSet(m, QIconSet(drawSparkline(m.meter, 
+                        MainWin.TAB_GRAPH_SIZE[0], MainWin.TAB_GRAPH_SIZE[1], 
+                        background)))
+                self.checkAlarms(m)
+                if m.newLines is not None:
+                    self.displayStatus(True, 
+                        str(i18n("%d new lines in %s since last session")) % 
+                        (m.newLines, m.getFileName()))
+                    m.newLines = None
+        page = self.currentPage
+        if isinstance(page, Monitor):
+            self.rateGraph.setPixmap(drawSparkline(page.meter, 
+                MainWin.STATUS_GRAPH_SIZE[0], MainWin.STATUS_GRAPH_SIZE[1], 
+                background))
+            self.rateText.setText(str(i18n("%.1f lines/s, %.1f errors/s")) % 
+                (page.meter.rate(), page.meter.rate(Classifier.ERROR)))
+        else:
+            self.rateGraph.clear()
+            self.rateText.setText("")
+            
+    def checkAlarms(self, mon):
+        """Raise an alarm if a line rate of a monitor is above its 
+        configured limit. The alarm is raised again only after the rate has 
+        dropped below the limit."""
+        for severity, limit, unit in (
+            (Classifier.ERROR, self.cfg.alarmErrorLimit, i18n("errors/s")), 
+            (Classifier.WARNING, self.cfg.alarmWarningLimit, 
+                i18n("warnings/s")), 
+            (None, self.cfg.alarmLineLimit, i18n("lines/s"))):
+            if limit <= 0:
+                continue
+            rate = mon.meter.rate(severity)
+            if rate <= limit:
+                mon.alarms.pop(severity, None)
+            elif severity not in mon.alarms:
+                mon.alarms[severity] = True
+                self.ring(mon)
+                self.displayStatus(True, str(i18n("Alarm: %s: %.1f %s")) % 
+                    (os.path.basename(mon.getFileName()), rate, str(unit)))
+                if self.cfg.alarmBeep:
+                    KApplication.kApplication().beep()
+                    
+    def ring(self, page):
+        """Show the bell icon on the tab of a page."""
+        if page not in self.ringing:
+            self.ringing.append(page)
+        self.tab.setTabIconSet(page, self.bellIcon)
+            
+    def onPollTimeout(self):
+        """Poll the files that are due."""
+        self.scheduler.run()
+        self.schedulePoll()
+        
+    def schedulePoll(self):
+        """Wake up for the next poll."""
+        wait = self.scheduler.wait()
+        if wait is None:
+            self.pollTimer.stop()
+        else:
+            self.pollTimer.start(int(wait * 1000) + 1, True)
+            
+    def onWatch(self, fd):
+        """Follow the monitored files reported changed by inotify."""
+        self.watcher.process()
+            
+    def onResults(self, fd):
+        """Pass results from the worker threads to their receivers. Jobs 
+        are submitted with (owner, receiver) keys."""
+        for (owner, receive), result, error in self.pool.collect():
+            if owner not in self.monitors and \
+                owner not in self.searchers.values() and \
+                owner not in self.bookmarks.bookmarks:
+                # Closed page, abandoned search or removed bookmark
+                continue
+            if error is None:
+                receive(result)
+            else:
+                self.displayStatus(True, str(i18n("Cannot read %s: %s")) % 
+                    (owner.getFileName(), error))
+            
     def onCopyAvailable(self, available):
         """Update Copy menu item when there is a selection available."""
         self.copyAction.setEnabled(available)
         
+    def onGotoLine(self):
+        """Scroll whole file view to a line."""
+        lineNo, ok = KInputDialog.getInteger(makeCaption("Go to Line"),
+            i18n("Go to line:"), self.currentPage.top + 1, 1,
+            max(1, self.currentPage.lineCount()), 1, self)
+        if ok:
+            self.currentPage.gotoLine(lineNo - 1)
+
+    def onFullView(self):
+        """Open the whole of the current page's file."""
+        self.view(self.currentPage.getFileName(), 
+            self.currentPage.tailer.rotated)
+
+    def onFields(self):
+        """Show the fields of the newest lines of the current page passing 
+        its filter, in sortable columns."""
+        page = self.currentPage
+        names, rows = page.fieldRows(FieldsDlg.MAX_ROWS)
+        if not names:
+            KMessageBox.information(self, 
+                str(i18n("The lines of %s are not JSON, syslog or logfmt.")) %
+                    page.getFileName(), makeCaption("Fields"))
+            return
+        FieldsDlg(self, names, rows, page.tailer.getEncoding()).exec_loop()
+
+    def onPerformance(self):
+        """Show the timers and histograms of the hot paths."""
+        if self.performanceDlg is None:
+            self.performanceDlg = PerformanceDlg(self)
+        self.performanceDlg.show()
+        self.performanceDlg.raiseW()
+
+    def askFilter(self, dlg, lineFilter):
+        """Show a filter dialog until it is cancelled or its settings are 
+        valid. Return the filter set, or None if cancelled."""
+        dlg.setFilter(lineFilter)
+        while dlg.exec_loop():
+            try:
+                return dlg.getFilter()
+            except re.error:
+                KMessageBox.error(self, 
+                    str(i18n("Invalid regular expression:\n%s")) % 
+                        sys.exc_info()[1], makeCaption("Error"))
+            except ValueError:
+                KMessageBox.error(self, 
+                    str(i18n("Invalid field query:\n%s")) % 
+                        sys.exc_info()[1], makeCaption("Error"))
+        return None
+
+    def onFilter(self):
+        """Filter the lines of the current page."""
+        page = self.currentPage
+        lineFilter = self.askFilter(self.filterDlg, page.lineFilter)
+        if lineFilter is None:
+            return
+        page.setFilter(lineFilter)
+        if lineFilter.isEmpty():
+            self.displayStatus(False, str(i18n("Showing all lines")))
+        else:
+            self.displayStatus(False, str(i18n("Filtering %s")) % 
+                page.getFileName())
+
+    def onExport(self, id = -1):
+        """Write the lines of whole files passing a filter to a file. The 
+        files are filtered in a separate thread, see onExportTimeout()."""
+        fileNames = KFileDialog.getOpenFileNames(self.lastDir, "*", self, 
+            str(i18n("Export Lines From")))
+        if fileNames.count() == 0:
+            return
+        fileNames = [str(f) for f in fileNames]
+        self.lastDir = os.path.dirname(fileNames[0])
+        lineFilter = LineFilter()
+        if self.currentPage is not None:
+            lineFilter = self.currentPage.lineFilter
+        lineFilter = self.askFilter(self.exportDlg, lineFilter)
+        if lineFilter is None:
+            return
+        outputName = str(KFileDialog.getSaveFileName(self.lastDir, "*", self, 
+            str(i18n("Export Lines To"))))
+        if not outputName:
+            return
+        if os.path.exists(outputName) and KMessageBox.warningContinueCancel(
+            self, str(i18n("Overwrite %s?")) % outputName, 
+            makeCaption("Export Lines"), KGuiItem(i18n("Overwrite"))) != \
+            KMessageBox.Continue:
+            return
+        since = None
+        if self.exportDlg.getHours():
+            since = time.time() - 3600 * self.exportDlg.getHours()
+        self.exporter = Exporter(fileNames, outputName, lineFilter, 
+            self.cfg.classifier, since)
+        self.exportResult = None
+        self.exportAction.setEnabled(False)
+        self.progressDlg = KProgressDialog(self, "progress", 
+            makeCaption("Export Lines"), 
+            str(i18n("Exporting to %s")) % outputName, True)
+        self.progressDlg.setAutoClose(False)
+        self.progressDlg.progressBar().setTotalSteps(1000)
+        threading.Thread(target = self.export, args = (self.exporter,)).start()
+        self.exportTimer.start(MainWin.EXPORT_TIMEOUT)
+        self.progressDlg.show()
+        
+    def export(self, exporter):
+        """Export thread: run the exporter and keep its result."""
+        try:
+            self.exportResult = (exporter.run(), None)
+        except (IOError, OSError):
+            self.exportResult = (False, sys.exc_info()[1])
+            
+    def onExportTimeout(self):
+        """Show the progress of the export, and its result once done."""
+        exporter = self.exporter
+        if self.progressDlg.wasCancelled():
+            exporter.cancel()
+        if exporter.total:
+            self.progressDlg.progressBar().setProgress(
+                int(1000 * exporter.done // exporter.total))
+        if self.exportResult is None:
+            return
+        self.exportTimer.stop()
+        self.progressDlg.close()
+        self.exportAction.setEnabled(True)
+        done, error = self.exportResult
+        self.exporter = None
+        if error is not None:
+            KMessageBox.error(self, 
+                str(i18n("Cannot export lines:\n%s")) % error, 
+                makeCaption("Error"))
+        elif done:
+            self.displayStatus(False, str(i18n("Exported %d lines to %s")) % 
+                (exporter.lines, exporter.outputName))
+        else:
+            self.displayStatus(False, str(i18n("Export cancelled")))
+
     def onFind(self):
         self.findDlg.show()
     
@@ -448,54 +1443,270 @@ class MainWin(KMainWindow):
         if self.findDlg.getText() == "":
             self.onFind()
         else:
-            self.currentPage.find(self.findDlg.getText(), 
-                self.findDlg.case_sensitive(), True)
+            self.find(True)
     
     def onFindNext(self):
         if self.findDlg.getText() == "":
             self.onFind()
         else:
-            self.currentPage.find(self.findDlg.getText(), 
-                self.findDlg.case_sensitive(), False)
+            self.find(False)
+            
+    def find(self, backward):
+        """Search the whole file of the current page in a worker thread. 
+        onSearched() then shows the match."""
+        page = self.currentPage
+        fileName = page.getFileName()
+        # Monitors search their file; rotated views, the whole rotation set
+        rotated = isinstance(page, FileView) and page.rotated
+        pattern = re.escape(str(self.findDlg.getText()))
+        flags = re.MULTILINE
+        if not self.findDlg.case_sensitive():
+            flags = flags | re.IGNORECASE
+        searcher = self.searchers.get((fileName, rotated))
+        if searcher is None or searcher.pattern != pattern or \
+            searcher.flags != flags:
+            try:
+                searcher = Searcher(fileName, pattern, flags, rotated)
+            except (IOError, OSError):
+                KMessageBox.error(self, 
+                    str(i18n("Cannot open file for searching:\n%s")) % 
+                        fileName, makeCaption("Error"))
+                return
+            self.searchers[(fileName, rotated)] = searcher
+            for mon in self.monitors:
+                if isinstance(mon, Monitor) and not rotated and \
+                    mon.getFileName() == fileName:
+                    mon.searcher = searcher
+            self.displayStatus(False, str(i18n("Searching %s")) % fileName)
+        self.findRequest = (searcher, page, page.findOffset(), backward)
+        self.pool.submit((searcher, self.onSearched), 
+            lambda: (searcher, searcher.update()))
+            
+    def onSearched(self, result):
+        """Show the match requested by find()."""
+        searcher, count = result
+        if self.findRequest is None or self.findRequest[0] is not searcher:
+            return
+        searcher, page, offset, backward = self.findRequest
+        self.findRequest = None
+        if page not in self.monitors:
+            return
+        match = searcher.find(offset, backward)
+        if match is None:
+            KApplication.kApplication().beep()
+            self.displayStatus(False, str(i18n("No matches in %s")) % 
+                searcher.fileName)
+            return
+        self.showOffset(searcher.fileName, match[0], match[1], 
+            searcher.rotated)
+        self.displayStatus(False, str(i18n("Match %d of %d")) % 
+            (searcher.current + 1, count))
+            
+    def showOffset(self, fileName, offset, length = 0, rotated = False):
+        """Show a file offset in a whole file view, opening one if 
+        necessary."""
+        for page in self.monitors:
+            if isinstance(page, FileView) and \
+                page.getFileName() == fileName and page.rotated == rotated:
+                self.tab.showPage(page)
+                break
+        else:
+            self.view(fileName, rotated)
+        if isinstance(self.currentPage, FileView) and \
+            self.currentPage.getFileName() == fileName:
+            self.currentPage.gotoOffset(offset, length)
 
-    def monitor(self, fileName):
-        """Start monitoring a file."""
+    def monitor(self, fileName, rotated = False, lazy = False):
+        """Start monitoring a file, or with rotated, the file and its rotated 
+        siblings. Compressed files do not grow, so they are viewed whole. 
+        Remote files, named like host:/path, are followed over a connection 
+        to the host. If lazy, the page is added in the background, and the 
+        file is only read when the page is first shown, starting with the 
+        snapshot of the last session."""
+        if RemoteHost.split(fileName) is None and RotationSet.kindOf(fileName):
+            self.view(fileName)
+            return
         try:
-            tailer = Tail(fileName)
+            tailer = openTail(fileName, rotated, self.cfg.encodingName, 
+                self.cfg.remoteCommand)
         except:
             KMessageBox.error(self, 
                 str(i18n("Cannot open file for monitoring:\n%s")) % 
                     fileName, makeCaption("Error"))
             return
-        mon = Monitor(self.tab, tailer)
-        base = os.path.basename(fileName)
-        self.monitors.append(mon)
-        self.tab.addTab(mon, base)
-        self.tab.showPage(mon)
-        self.tab.setTabToolTip(mon, fileName)
-        self.currentPage = mon
-        self.setCaption(makeCaption(base))
-        self.displayStatus(False, str(i18n("Monitoring %s")) % fileName)
-        self.connect(self.timer, SIGNAL("timeout()"), mon.follow)
-        self.saveFileList()
+        snapshot = None
+        if lazy:
+            snapshot = Snapshot.load(self.snapshotPath(fileName))
+        mon = Monitor(self.tab, tailer, self.pool, snapshot)
+        self.addPage(mon, str(i18n("Monitoring %s")) % fileName, not lazy)
         self.connect(mon, SIGNAL("copyAvailable(bool)"), self.onCopyAvailable)
-        self.closeAction.setEnabled(True)
-        self.copyAction.setEnabled(False)
-        self.clearAction.setEnabled(True)
-        self.selectAllAction.setEnabled(True)
-        self.addBookmarkAction.setEnabled(True)
-        self.findAction.setEnabled(True)
-        self.findNextAction.setEnabled(True)
-        self.findPrevAction.setEnabled(True)
+        if not lazy:
+            self.saveFileList()
+        
+    def startMonitor(self, mon):
+        """Start reading the files of a monitor, if not started yet."""
+        if mon.started:
+            return
+        if not isinstance(mon.tailer, Tail):
+            mon.start()
+            return
+        fileName = mon.getFileName()
+        offset = mon.tailer.loadIndex(self.indexPath(fileName))
+        if offset == Tail.REPLACED:
+            mon.start()
+            self.displayStatus(True, 
+                str(i18n("%s was rotated or truncated since last session")) %
+                    fileName)
+            return
+        mon.start(offset)
+        if offset is not None and mon.fileSizes()[0] > offset:
+            # The count is shown once the new lines are indexed
+            self.displayStatus(True, 
+                str(i18n("New lines in %s since last session")) % fileName)
+        elif offset is not None:
+            self.displayStatus(False, 
+                str(i18n("No new lines in %s since last session")) % 
+                    fileName)
+        
+    def merge(self, fileNames, lazy = False):
+        """Start monitoring files merged into one timeline. If lazy, the 
+        files are only read when the page is first shown."""
+        try:
+            tailer = Merger([openTail(fileName, False, 
+                self.cfg.encodingName, self.cfg.remoteCommand) 
+                for fileName in fileNames])
+        except:
+            KMessageBox.error(self, 
+                str(i18n("Cannot open files for monitoring:\n%s")) % 
+                    "\n".join(fileNames), makeCaption("Error"))
+            return
+        mon = Monitor(self.tab, tailer, self.pool)
+        self.addPage(mon, str(i18n("Merging %s")) % ", ".join(fileNames), 
+            not lazy)
+        self.connect(mon, SIGNAL("copyAvailable(bool)"), self.onCopyAvailable)
+        if not lazy:
+            self.saveFileList()
+        
+    def view(self, fileName, rotated = False):
+        """Open the whole of a file, or with rotated, the file and its 
+        rotated siblings."""
+        try:
+            view = FileView(self.tab, fileName, rotated)
+        except (IOError, OSError, mmap.error):
+            KMessageBox.error(self, 
+                str(i18n("Cannot open file for viewing:\n%s")) % 
+                    fileName, makeCaption("Error"))
+            return
+        self.addPage(view, str(i18n("Viewing %s")) % fileName)
+        
+    def addPage(self, page, msg, show = True):
+        """Add a monitor or file view page, and unless show is False, make 
+        it current."""
+        fileName = page.getFileName()
+        base = os.path.basename(fileName)
+        self.monitors.append(page)
+        self.tab.addTab(page, base)
+        self.tab.setTabToolTip(page, fileName)
+        self.watch(page)
+        if not show and self.currentPage is not None:
+            return
+        self.displayStatus(False, msg)
+        self.tab.showPage(page)
+        self.onPageChange(page)
+        
+    def updateActions(self):
+        """Enable the actions applicable to the current page."""
+        page = self.currentPage
+        isMonitor = isinstance(page, Monitor)
+        # Merged timelines and remote files cannot be searched or viewed 
+        # whole
+        isFile = page is not None and len(page.getFileNames()) == 1 and \
+            RemoteHost.split(page.getFileName()) is None
+        self.closeAction.setEnabled(page is not None)
+        self.copyAction.setEnabled(isMonitor and page.hasSelectedText())
+        self.clearAction.setEnabled(isMonitor)
+        self.selectAllAction.setEnabled(isMonitor)
+        self.addBookmarkAction.setEnabled(isMonitor or 
+            (isinstance(page, FileView) and not page.rotated))
+        self.findAction.setEnabled(isFile)
+        self.findNextAction.setEnabled(isFile)
+        self.findPrevAction.setEnabled(isFile)
+        self.fullViewAction.setEnabled(isMonitor and isFile)
+        self.gotoLineAction.setEnabled(isinstance(page, FileView))
+        self.filterAction.setEnabled(isMonitor)
+        self.fieldsAction.setEnabled(isMonitor)
+        
+    def watch(self, mon):
+        """Follow changes to a monitor's files, with inotify if possible."""
+        watched = []
+        if self.watcher is not None:
+            for fileName in mon.getFileNames():
+                if self.watcher.add(fileName, mon.follow):
+                    watched.append(fileName)
+        mon.watched = watched == mon.getFileNames()
+        if not mon.watched:
+            for fileName in watched:
+                self.watcher.remove(fileName, mon.follow)
+            self.scheduler.add(mon, mon.follow, mon.progress, 
+                len(mon.getFileNames()))
+            if mon is self.currentPage:
+                self.scheduler.setVisible(mon)
+            self.schedulePoll()
+            
+    def unwatch(self, mon):
+        """Stop following changes to a monitor's files."""
+        if mon.watched:
+            for fileName in mon.getFileNames():
+                self.watcher.remove(fileName, mon.follow)
+        else:
+            self.scheduler.remove(mon)
+        
+    def indexPath(self, fileName):
+        """Return the path of the saved line index of a file."""
+        return os.path.join(self.indexDir, 
+            hashlib.md5(os.path.abspath(fileName)).hexdigest())
+        
+    def snapshotPath(self, fileName):
+        """Return the path of the saved snapshot of a file."""
+        return self.indexPath(fileName) + ".snapshot"
+        
+    def saveIndex(self, mon):
+        """Save the line index of a monitor's file. Monitors not started 
+        keep the index of the last session."""
+        if isinstance(mon, Monitor) and isinstance(mon.tailer, Tail) and \
+            mon.started and not self.pool.isBusy((mon, mon.receive)):
+            try:
+                mon.tailer.saveIndex(self.indexPath(mon.getFileName()))
+            except (IOError, OSError):
+                pass
+                
+    def saveSnapshot(self, mon):
+        """Save the newest lines of a monitor's file, for the next session 
+        to show at once."""
+        if isinstance(mon, Monitor) and isinstance(mon.tailer, Tail) and \
+            mon.started and not self.pool.isBusy((mon, mon.receive)):
+            try:
+                mon.takeSnapshot().save(self.snapshotPath(mon.getFileName()))
+            except (IOError, OSError):
+                pass
         
     def saveFileList(self):
         """Update the list of monitored files in the configuration file."""
         files = []
+        rotated = []
+        merged = []
         for mon in self.monitors:
-            files.append(mon.getFileName())
+            if isinstance(mon, Monitor) and isinstance(mon.tailer, Merger):
+                merged.append("\t".join(mon.getFileNames()))
+            elif isinstance(mon, Monitor):
+                files.append(mon.getFileName())
+                if mon.tailer.rotated:
+                    rotated.append(mon.getFileName())
         cfg = KApplication.kApplication().config()
         cfg.setGroup("Monitor")
         cfg.writeEntry("files", files)
+        cfg.writeEntry("rotated", rotated)
+        cfg.writeEntry("merged", merged)
         
     def reconfigure(self):
         """Update self with configuration changes."""
@@ -503,8 +1714,7 @@ class MainWin(KMainWindow):
             mon.reconfigure()
             
     def doFind(self):
-        self.currentPage.find(self.findDlg.getText(), 
-            self.findDlg.case_sensitive(), self.findDlg.get_direction())
+        self.find(self.findDlg.get_direction())
 
 
 class LoviConfig:
@@ -514,14 +1724,15 @@ class LoviConfig:
     class LoviConfig_(KConfigSkeleton):
         """Configuration information""" 
         
-        WARNINGS = "warn, can't, cannot, unable"
-        ERRORS = "error, fail, badness"
+        WARNINGS = Classifier.WARNINGS
+        ERRORS = Classifier.ERRORS
         
         def __init__(self, *args):
             KConfigSkeleton.__init__(self, *args)
             
             self.filterErrorList = []
             self.filterWarningList = []
+            self.classifier = Classifier([], [])
             
             self.setCurrentGroup("Font")
             self.fontDefault = self.addItemBool("fontDefault", True)
@@ -537,17 +1748,42 @@ class LoviConfig:
             self.filterWarningsVal = QString()
             self.filterWarnings = self.addItemString("filterWarnings",
                 self.filterWarningsVal, LoviConfig.LoviConfig_.WARNINGS)
+                
+            self.setCurrentGroup("Files")
+            self.encodingVal = QString()
+            self.encoding = self.addItemString("encoding", self.encodingVal, 
+                "")
+            self.remoteCommandVal = QString()
+            self.remoteCommandItem = self.addItemString("remoteCommand", 
+                self.remoteCommandVal, RemoteHost.COMMAND)
+                
+            self.setCurrentGroup("Alarms")
+            self.alarmErrors = self.addItemInt("alarmErrors", 0)
+            self.alarmWarnings = self.addItemInt("alarmWarnings", 0)
+            self.alarmLines = self.addItemInt("alarmLines", 0)
+            self.alarmBeepItem = self.addItemBool("alarmBeep", True)
 
             self.readConfig()
             self.processConfig()
             
         def processConfig(self):
-            self.filterErrorList = []
-            for s in str(self.filterErrorsVal).split(","):
-                self.filterErrorList.append(s.strip())
-            self.filterWarningList = []
-            for s in str(self.filterWarningsVal).split(","):
-                self.filterWarningList.append(s.strip())
+            self.filterErrorList = \
+                Classifier.keywords(str(self.filterErrorsVal))
+            self.filterWarningList = \
+                Classifier.keywords(str(self.filterWarningsVal))
+            if self.filterErrorList != self.classifier.errors or \
+                self.filterWarningList != self.classifier.warnings:
+                # Monitors classify their lines again on a new classifier
+                self.classifier = Classifier(self.filterErrorList, 
+                    self.filterWarningList)
+            # Files are decoded with the configured encoding, or detected
+            self.encodingName = encodingName(str(self.encodingVal).strip())
+            self.remoteCommand = str(self.remoteCommandVal).strip() or \
+                RemoteHost.COMMAND
+            self.alarmErrorLimit = self.alarmErrors[0].property().toInt()
+            self.alarmWarningLimit = self.alarmWarnings[0].property().toInt()
+            self.alarmLineLimit = self.alarmLines[0].property().toInt()
+            self.alarmBeep = self.alarmBeepItem[0].property().toInt()
 
     instance_ = None
 
@@ -559,6 +1795,280 @@ class LoviConfig:
         return LoviConfig.instance_
 
 
+class FilterDlg(KDialogBase):
+
+    """Line filter dialog."""
+
+    SEVERITIES = [Classifier.NORMAL, Classifier.WARNING, Classifier.ERROR]
+
+    def __init__(self, parent, name = "filter", caption = "Filter"):
+        KDialogBase.__init__(self, parent, name, True, 
+            makeCaption(caption), KDialogBase.Ok | KDialogBase.Cancel)
+        page = QWidget(self)
+        self.setMainWidget(page)
+        self.box = box = QGridLayout(page, 5, 2, 3, 7)
+        box.addWidget(QLabel(i18n("Show lines matching:"), page), 0, 0)
+        self.include = QLineEdit(page)
+        box.addWidget(self.include, 0, 1)
+        box.addWidget(QLabel(i18n("Hide lines matching:"), page), 1, 0)
+        self.exclude = QLineEdit(page)
+        box.addWidget(self.exclude, 1, 1)
+        box.addWidget(QLabel(i18n("Show:"), page), 2, 0)
+        self.severity = QComboBox(page)
+        self.severity.insertItem(i18n("All lines"))
+        self.severity.insertItem(i18n("Warnings and errors"))
+        self.severity.insertItem(i18n("Errors"))
+        box.addWidget(self.severity, 2, 1)
+        box.addWidget(QLabel(i18n("Fields:"), page), 3, 0)
+        self.query = QLineEdit(page)
+        QWhatsThis.add(self.query, 
+            i18n("Show only JSON, syslog or logfmt lines with these fields, "
+            "like: status>=500 host=db3 msg~timeout. Use = and != for text, "
+            "<, <=, > and >= for numbers, and ~ for regular expressions."))
+        box.addWidget(self.query, 3, 1)
+        box.setRowStretch(4, 1)
+        
+    def setFilter(self, lineFilter):
+        """Show the settings of a filter."""
+        self.include.setText(lineFilter.include)
+        self.exclude.setText(lineFilter.exclude)
+        self.severity.setCurrentItem(
+            FilterDlg.SEVERITIES.index(lineFilter.severity))
+        self.query.setText(lineFilter.query)
+        
+    def getFilter(self):
+        """Return the filter set. Raise re.error if an expression is 
+        invalid, ValueError if the field query is."""
+        return LineFilter(str(self.include.text()), str(self.exclude.text()), 
+            FilterDlg.SEVERITIES[self.severity.currentItem()], 
+            str(self.query.text()))
+
+
+class ExportDlg(FilterDlg):
+
+    """Filter dialog of the lines to export, limiting them to the last 
+    hours."""
+
+    def __init__(self, parent):
+        FilterDlg.__init__(self, parent, "export", "Export Lines")
+        page = self.mainWidget()
+        self.box.setRowStretch(4, 0)
+        self.box.addWidget(QLabel(i18n("Only the last:"), page), 4, 0)
+        self.hours = QSpinBox(0, 24 * 365, 1, page)
+        self.hours.setSuffix(i18n(" hours"))
+        self.hours.setSpecialValueText(i18n("Any time"))
+        QWhatsThis.add(self.hours, 
+            i18n("Export only the lines with a syslog style timestamp in "
+            "the last hours, and the lines following them. The files must be "
+            "in time order."))
+        self.box.addWidget(self.hours, 4, 1)
+        self.box.setRowStretch(5, 1)
+        
+    def getHours(self):
+        """Return the number of hours to export, 0 for all lines."""
+        return self.hours.value()
+
+
+class FieldItem(QListViewItem):
+
+    """Row of the fields dialog, sorted by number where possible."""
+
+    def __init__(self, parent, values, color):
+        QListViewItem.__init__(self, parent)
+        self.color = color
+        for i in range(len(values)):
+            self.setText(i, values[i])
+            
+    def compare(self, other, column, ascending):
+        a = str(self.text(column))
+        b = str(other.text(column))
+        try:
+            return cmp(float(a), float(b))
+        except ValueError:
+            return cmp(a, b)
+            
+    def paintCell(self, painter, cg, column, width, align):
+        if self.color is not None:
+            cg = QColorGroup(cg)
+            cg.setColor(QColorGroup.Text, self.color)
+        QListViewItem.paintCell(self, painter, cg, column, width, align)
+
+
+class FieldsDlg(KDialogBase):
+
+    """Dialog showing the fields of parsed lines in sortable columns."""
+    
+    MAX_ROWS = 10000
+    MAX_COLUMNS = 20
+
+    def __init__(self, parent, names, rows, encoding):
+        KDialogBase.__init__(self, parent, "fields", True, 
+            makeCaption("Fields"), KDialogBase.Close)
+        view = QListView(self)
+        self.setMainWidget(view)
+        view.setAllColumnsShowFocus(True)
+        view.setShowSortIndicator(True)
+        names = names[:FieldsDlg.MAX_COLUMNS]
+        view.addColumn(i18n("Line"))
+        for name in names:
+            view.addColumn(name.decode(encoding, "replace"))
+        colors = {Classifier.WARNING: QColor("blue"),
+            Classifier.ERROR: QColor("red")}
+        for i in range(len(rows)):
+            record, severity = rows[i]
+            values = [str(i + 1)]
+            for name in names:
+                value = ""
+                if record is not None:
+                    value = record.get(name, "")
+                values.append(value.decode(encoding, "replace"))
+            FieldItem(view, values, colors.get(severity))
+        view.setSorting(0, False)
+        self.setInitialSize(QSize(700, 450))
+
+
+class BookmarksDlg(KDialogBase):
+
+    """Dialog listing the bookmarks, newest first. selected is the one to 
+    go to."""
+
+    def __init__(self, parent, store):
+        KDialogBase.__init__(self, parent, "bookmarks", True, 
+            makeCaption("Bookmarks"), 
+            KDialogBase.User1 | KDialogBase.User2 | KDialogBase.Close, 
+            KDialogBase.User1, False, KGuiItem(i18n("&Go To"), "goto"), 
+            KGuiItem(i18n("&Remove"), "editdelete"))
+        self.store = store
+        self.selected = None
+        self.items = {}
+        self.view = QListView(self)
+        self.setMainWidget(self.view)
+        self.view.setAllColumnsShowFocus(True)
+        self.view.setSorting(-1)
+        for title in (i18n("Time"), i18n("File"), i18n("Line")):
+            self.view.addColumn(title)
+        for bookmark in store.bookmarks:
+            # Items are inserted at the top
+            item = QListViewItem(self.view, 
+                time.strftime("%b %d %H:%M:%S", 
+                    time.localtime(bookmark.stamp)), 
+                bookmark.fileName, bookmark.text.decode(
+                    detectEncoding(bookmark.text), "replace").expandtabs())
+            self.items[item] = bookmark
+        self.updateButtons()
+        self.connect(self.view, SIGNAL("doubleClicked(QListViewItem *)"), 
+            self.onGoTo)
+        self.connect(self, SIGNAL("user1Clicked()"), self.onGoTo)
+        self.connect(self, SIGNAL("user2Clicked()"), self.onRemove)
+        self.setInitialSize(QSize(600, 300))
+        
+    def updateButtons(self):
+        """Select the newest bookmark, and enable the buttons if there are 
+        bookmarks."""
+        if self.view.firstChild() is not None:
+            self.view.setSelected(self.view.firstChild(), True)
+        self.enableButton(KDialogBase.User1, bool(self.items))
+        self.enableButton(KDialogBase.User2, bool(self.items))
+        
+    def onGoTo(self, *args):
+        """Go to the selected bookmark."""
+        item = self.view.selectedItem()
+        if item is not None:
+            self.selected = self.items[item]
+            self.accept()
+            
+    def onRemove(self):
+        """Remove the selected bookmark."""
+        item = self.view.selectedItem()
+        if item is None:
+            return
+        try:
+            self.store.remove(self.items.pop(item))
+        except (IOError, OSError):
+            KMessageBox.error(self, 
+                str(i18n("Cannot save bookmarks:\n%s")) % sys.exc_info()[1], 
+                makeCaption("Error"))
+        self.view.takeItem(item)
+        self.updateButtons()
+
+
+class PerformanceDlg(KDialogBase):
+
+    """Debug panel showing the timers, counters and histograms of the hot 
+    paths. The profiler is enabled while the panel is shown."""
+    
+    REFRESH_TIMEOUT = 1000
+
+    def __init__(self, parent):
+        KDialogBase.__init__(self, parent, "performance", False, 
+            makeCaption("Performance"), 
+            KDialogBase.User1 | KDialogBase.Close, KDialogBase.Close, False, 
+            KGuiItem(i18n("&Reset")))
+        self.view = QListView(self)
+        self.setMainWidget(self.view)
+        self.view.setAllColumnsShowFocus(True)
+        self.view.setSorting(-1)
+        for title in (i18n("Name"), i18n("Count"), i18n("Total"), 
+            i18n("Mean"), i18n("Max")):
+            self.view.addColumn(title)
+        for column in range(1, 5):
+            self.view.setColumnAlignment(column, Qt.AlignRight)
+        self.wasEnabled = PROFILER.enabled
+        self.timer = QTimer(self)
+        self.connect(self.timer, SIGNAL("timeout()"), self.refresh)
+        self.connect(self, SIGNAL("user1Clicked()"), self.onReset)
+        self.setInitialSize(QSize(500, 400))
+        
+    def showEvent(self, e):
+        self.wasEnabled = PROFILER.enabled
+        PROFILER.enabled = True
+        self.refresh()
+        self.timer.start(PerformanceDlg.REFRESH_TIMEOUT)
+        KDialogBase.showEvent(self, e)
+        
+    def hideEvent(self, e):
+        self.timer.stop()
+        PROFILER.enabled = self.wasEnabled
+        KDialogBase.hideEvent(self, e)
+        
+    def onReset(self):
+        PROFILER.reset()
+        self.refresh()
+        
+    def refresh(self):
+        """Show the data recorded so far."""
+        stats = PROFILER.stats()
+        self.view.clear()
+        rows = [[str(i18n("Recorded for %d s")) % stats["seconds"]]]
+        timers = stats["timers"].items()
+        timers.sort()
+        for name, timer in timers:
+            rows.append([name, str(timer["count"]), 
+                "%.1f ms" % (timer["total"] * 1000), 
+                "%.3f ms" % (timer["total"] * 1000 / timer["count"]), 
+                "%.1f ms" % (timer["max"] * 1000)])
+        counters = stats["counters"].items()
+        counters.sort()
+        for name, count in counters:
+            rows.append([name, str(count)])
+        histograms = stats["histograms"].items()
+        histograms.sort()
+        for name, histogram in histograms:
+            buckets = [(int(bucket), count) for bucket, count in 
+                histogram.items()]
+            buckets.sort()
+            for bucket, count in buckets:
+                if bucket < 2:
+                    label = "%s: %d" % (name, bucket)
+                else:
+                    label = "%s: %d-%d" % (name, bucket, 2 * bucket - 1)
+                rows.append([label, str(count)])
+        # Items are inserted at the top
+        rows.reverse()
+        for row in rows:
+            QListViewItem(self.view, *row)
+
+
 class SettingsDlg(KConfigDialog):
     
     """Settings dialog."""
@@ -589,7 +2099,7 @@ class SettingsDlg(KConfigDialog):
         
         filtersPage = QWidget(self, "filters")
         
-        box = QGridLayout(filtersPage, 3, 2, 3, 7)
+        box = QGridLayout(filtersPage, 5, 2, 3, 7)
         box.addWidget(QLabel(i18n("Errors:"), filtersPage), 0, 0)
         self.kcfg_filterErrors = QLineEdit(cfg.filterErrorsVal, filtersPage, 
             "kcfg_filterErrors")
@@ -598,13 +2108,51 @@ class SettingsDlg(KConfigDialog):
         self.kcfg_filterWarnings = QLineEdit(cfg.filterWarningsVal, 
             filtersPage, "kcfg_filterWarnings")
         box.addWidget(self.kcfg_filterWarnings, 1, 1)
-        box.setRowStretch(2, 1)
+        box.addWidget(QLabel(i18n("Encoding:"), filtersPage), 2, 0)
+        self.kcfg_encoding = QLineEdit(cfg.encodingVal, filtersPage, 
+            "kcfg_encoding")
+        QWhatsThis.add(self.kcfg_encoding, 
+            i18n("Encoding of the files, like utf-8 or iso-8859-2. Leave it "
+            "empty to detect the encoding of each file."))
+        box.addWidget(self.kcfg_encoding, 2, 1)
+        box.addWidget(QLabel(i18n("Remote command:"), filtersPage), 3, 0)
+        self.kcfg_remoteCommand = QLineEdit(cfg.remoteCommandVal, 
+            filtersPage, "kcfg_remoteCommand")
+        QWhatsThis.add(self.kcfg_remoteCommand, 
+            i18n("Command running a shell command on a remote host, for "
+            "files named like host:/path. %h stands for the host."))
+        box.addWidget(self.kcfg_remoteCommand, 3, 1)
+        box.setRowStretch(4, 1)
 
-        # actionsPage = QWidget(self, "actions")
+        alarmsPage = QWidget(self, "alarms")
+        
+        box = QGridLayout(alarmsPage, 5, 2, 3, 7)
+        box.addWidget(QLabel(i18n("Errors per second above:"), alarmsPage), 
+            0, 0)
+        self.kcfg_alarmErrors = QSpinBox(0, 1000000, 1, alarmsPage, 
+            "kcfg_alarmErrors")
+        box.addWidget(self.kcfg_alarmErrors, 0, 1)
+        box.addWidget(QLabel(i18n("Warnings per second above:"), alarmsPage), 
+            1, 0)
+        self.kcfg_alarmWarnings = QSpinBox(0, 1000000, 1, alarmsPage, 
+            "kcfg_alarmWarnings")
+        box.addWidget(self.kcfg_alarmWarnings, 1, 1)
+        box.addWidget(QLabel(i18n("Lines per second above:"), alarmsPage), 
+            2, 0)
+        self.kcfg_alarmLines = QSpinBox(0, 1000000, 1, alarmsPage, 
+            "kcfg_alarmLines")
+        box.addWidget(self.kcfg_alarmLines, 2, 1)
+        for spinBox in (self.kcfg_alarmErrors, self.kcfg_alarmWarnings, 
+            self.kcfg_alarmLines):
+            spinBox.setSpecialValueText(i18n("Off"))
+        self.kcfg_alarmBeep = QCheckBox(i18n("Beep on alarms"), alarmsPage, 
+            "kcfg_alarmBeep")
+        box.addMultiCellWidget(self.kcfg_alarmBeep, 3, 3, 0, 1)
+        box.setRowStretch(4, 1)
 
         self.addPage(fontPage, i18n("Font"), "fonts")
         self.addPage(filtersPage, i18n("Filters"), "2downarrow")
-        # self.addPage(actionsPage, i18n("Alarms"), "kalarm")
+        self.addPage(alarmsPage, i18n("Alarms"), "kalarm")
 
 
 def main():
@@ -617,7 +2165,9 @@ def main():
         KAboutData.License_GPL, "Copyright (C) 2005-2006 by Akos Polster")
     about.addAuthor("Akos Polster", "", "akos@pipacs.com")
     KCmdLineArgs.init(sys.argv, about)
-    KCmdLineArgs.addCmdLineOptions([("+files", "Files to monitor")])
+    KCmdLineArgs.addCmdLineOptions([("+files", "Files to monitor"), 
+        ("profile <file>", "Write cProfile stats to file, and timers of the "
+        "stages to file.json, on exit")])
     app = KApplication()
     mainWindow = MainWin(None, "lovi#")
     app.setMainWidget(mainWindow)
@@ -631,11 +2181,18 @@ def main():
         cfg = app.config()
         cfg.setGroup("Monitor")
         files = cfg.readListEntry("files")
+        rotated = [str(f) for f in cfg.readListEntry("rotated")]
+        # Only the current page is read at once
         for f in files:
-            mainWindow.monitor(str(f))
+            mainWindow.monitor(str(f), str(f) in rotated, True)
+        for f in cfg.readListEntry("merged"):
+            mainWindow.merge(str(f).split("\t"), True)
         
     mainWindow.show()
-    app.exec_loop()
+    if args.isSet("profile"):
+        profiled(str(args.getOption("profile")), app.exec_loop)
+    else:
+        app.exec_loop()
 
 
 if __name__ == "__main__":